@@ -0,0 +1,27 @@
+"""Benchmark building assertions from scratch against filling in a skeleton."""
+
+from common import make_response, time_per_call
+
+ROUNDS = 20_000
+
+
+def main() -> None:
+    """Run the benchmark."""
+    print(f"{'attributes':>10} {'build (us)':>12} {'fill (us)':>12}")
+    for count in (0, 5, 20):
+        response = make_response().model_copy(
+            update={"attributes": {f"attr{i}": f"value{i}" for i in range(count)}}
+        )
+        build = time_per_call(
+            lambda r=response: r.build_assertion("_id", "2024-01-01T00:00:00Z"),
+            ROUNDS,
+        )
+        fill = time_per_call(
+            lambda r=response: r.fill_assertion("_id", "2024-01-01T00:00:00Z"),
+            ROUNDS,
+        )
+        print(f"{count:>10} {build:>12.1f} {fill:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark decoding SAML requests, per message type."""
+
+from collections.abc import Callable
+from datetime import datetime
+
+from common import time_per_call
+from pydantic import HttpUrl, TypeAdapter
+
+from saml_idp.models.authn_request import validate_authn_request
+from saml_idp.models.logout_request import validate_logout_request
+from saml_idp.utils import deflate_and_encode, get_elem_from_path, inflate_and_decode
+
+ROUNDS = 10_000
+
+AUTHN_REQUEST = deflate_and_encode("""
+<saml2p:AuthnRequest
+    xmlns:saml2p="urn:oasis:names:tc:SAML:2.0:protocol"
+    AssertionConsumerServiceURL="https://example.com/saml2/idpresponse"
+    Destination="https://localhost:8000/auth/signin"
+    ID="_c0bce021-ddb3-47cb-848b-b257fbbcb9f4"
+    IssueInstant="2024-01-12T20:45:56.329Z"
+    Version="2.0"
+ >
+    <saml2:Issuer xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion"
+                  Format="urn:oasis:names:tc:SAML:2.0:nameid-format:entity"
+                  >http://myissuer.com</saml2:Issuer>
+</saml2p:AuthnRequest>
+""")
+
+LOGOUT_REQUEST = deflate_and_encode("""
+<saml2p:LogoutRequest xmlns:saml2p="urn:oasis:names:tc:SAML:2.0:protocol"
+                      Destination="https://localhost:8000/auth/logout"
+                      ID="_bf3ed8e8-b087-43c9-b936-4dd154542eeb"
+                      IssueInstant="2024-01-16T17:43:35.553Z"
+                      NotOnOrAfter="2024-01-16T17:48:35.553Z"
+                      Version="2.0"
+                      >
+    <saml2:Issuer xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion"
+                  >http://myissuer.com/</saml2:Issuer>
+    <saml2:NameID xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion"
+                  >davidbowie</saml2:NameID>
+    <saml2p:SessionIndex>xyxyxyxyxy</saml2p:SessionIndex>
+</saml2p:LogoutRequest>
+""")
+
+ADAPTERS = {datetime: TypeAdapter(datetime), HttpUrl: TypeAdapter(HttpUrl)}
+AUTHN_ATTRIBUTES = {
+    "ID": str,
+    "IssueInstant": datetime,
+    "AssertionConsumerServiceURL": HttpUrl,
+    "Destination": HttpUrl,
+}
+LOGOUT_ATTRIBUTES = {
+    "ID": str,
+    "IssueInstant": datetime,
+    "NotOnOrAfter": datetime,
+    "Destination": HttpUrl,
+}
+
+
+def xpath_decode(data: bytes, tag: str, attributes: dict[str, type]) -> dict:
+    """Decode a request the old way: XPath per child, pydantic per attribute."""
+    tree = inflate_and_decode(data)
+    result = {
+        name: ADAPTERS[kind].validate_python(tree.get(name))
+        if kind in ADAPTERS
+        else tree.get(name)
+        for name, kind in attributes.items()
+    }
+    for child in ("saml2:Issuer", "saml2:NameID", "saml2p:SessionIndex"):
+        elems = get_elem_from_path(tree, f"/saml2p:{tag}/{child}")
+        if elems:
+            result[child] = elems[0].text
+    return result
+
+
+def bench(
+    data: bytes,
+    tag: str,
+    attributes: dict[str, type],
+    validate: Callable[[bytes], object],
+) -> tuple[float, float, float]:
+    """Time the old decoding, the decoder, and inflating and parsing alone."""
+    return (
+        time_per_call(lambda: xpath_decode(data, tag, attributes), ROUNDS),
+        time_per_call(lambda: validate(data), ROUNDS),
+        time_per_call(lambda: inflate_and_decode(data), ROUNDS),
+    )
+
+
+def main() -> None:
+    """Run the benchmark."""
+    print(f"{'message':>15} {'xpath (us)':>12} {'decoder (us)':>14} {'parse (us)':>12}")
+    for tag, data, attributes, validate in (
+        ("AuthnRequest", AUTHN_REQUEST, AUTHN_ATTRIBUTES, validate_authn_request),
+        ("LogoutRequest", LOGOUT_REQUEST, LOGOUT_ATTRIBUTES, validate_logout_request),
+    ):
+        xpath, decoder, parse = bench(data, tag, attributes, validate)
+        print(f"{tag:>15} {xpath:>12.2f} {decoder:>14.2f} {parse:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Benchmark the replay cache at millions of request IDs per hour."""
+
+import time
+import tracemalloc
+import uuid
+
+from saml_idp.replay import ReplayCache
+
+RATES = (1_000_000, 3_000_000, 10_000_000)
+"""Request IDs per simulated hour."""
+
+SIMULATED_SECONDS = 1_800
+
+
+def make_ids(count: int) -> list[str]:
+    """Create request IDs like the ones SPs send."""
+    return [f"_{uuid.uuid4()}" for _ in range(count)]
+
+
+def bench(rate: int) -> tuple[float, int, float]:
+    """
+    Feed half an hour of IDs through a cache, on a simulated clock.
+
+    Return the throughput, the IDs remembered at the end and their memory use.
+    """
+    count = rate * SIMULATED_SECONDS // 3600
+    ids = make_ids(count)
+    step = SIMULATED_SECONDS / count
+
+    cache = ReplayCache()
+    start = time.perf_counter()
+    for i, request_id in enumerate(ids):
+        cache.add("https://sp.example.com", request_id, now=i * step)
+    elapsed = time.perf_counter() - start
+
+    cache = ReplayCache()
+    tracemalloc.start()
+    for i, request_id in enumerate(ids):
+        cache.add("https://sp.example.com", request_id, now=i * step)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return count / elapsed, len(cache), memory / 1024 / 1024
+
+
+def main() -> None:
+    """Run the benchmark."""
+    print(f"{'IDs/hour':>12} {'adds/s':>12} {'remembered':>12} {'memory (MiB)':>14}")
+    for rate in RATES:
+        throughput, remembered, memory = bench(rate)
+        print(f"{rate:>12} {throughput:>12.0f} {remembered:>12} {memory:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
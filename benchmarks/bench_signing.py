@@ -0,0 +1,54 @@
+"""Benchmark signing of SAML assertions."""
+
+from common import make_key_and_cert, time_per_call
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from signxml import CanonicalizationMethod, XMLSigner
+
+from saml_idp.signing import get_signing_context
+from saml_idp.utils import DS, SAML
+
+ROUNDS = 500
+
+
+def bench_pem() -> float:
+    """Time signing with PEM strings and a new signer every time."""
+    key, cert = make_key_and_cert()
+
+    def sign() -> None:
+        signer = XMLSigner(
+            c14n_algorithm=CanonicalizationMethod.EXCLUSIVE_XML_CANONICALIZATION_1_0,
+        )
+        element = SAML.Assertion(DS.Signature(Id="placeholder"), ID="_xxxx")
+        signer.sign(element, key=key, cert=cert)
+
+    return time_per_call(sign, ROUNDS)
+
+
+def bench_context(key: str, cert: str) -> float:
+    """Time signing with a loaded signing context."""
+
+    def sign() -> None:
+        element = SAML.Assertion(DS.Signature(Id="placeholder"), ID="_xxxx")
+        get_signing_context(key, cert).sign(element)
+
+    return time_per_call(sign, ROUNDS)
+
+
+def main() -> None:
+    """Compare signing with PEM strings and contexts for different key types."""
+    results = [("RSA-2048, PEM strings", bench_pem())]
+    keys = (
+        ("RSA-2048", rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+        ("RSA-3072", rsa.generate_private_key(public_exponent=65537, key_size=3072)),
+        ("EC P-256", ec.generate_private_key(ec.SECP256R1())),
+        ("EC P-384", ec.generate_private_key(ec.SECP384R1())),
+    )
+    results.extend((name, bench_context(*make_key_and_cert(key))) for name, key in keys)
+
+    print(f"{'key':>22} {'us/sign':>10} {'signs/s':>10}")
+    for name, elapsed in results:
+        print(f"{name:>22} {elapsed:>10.1f} {1_000_000 / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
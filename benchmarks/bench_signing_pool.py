@@ -0,0 +1,66 @@
+"""Benchmark signing throughput and event loop lag with a pool of workers."""
+
+import asyncio
+import os
+import time
+
+from common import make_key_and_cert, make_response
+
+from saml_idp import Settings
+from saml_idp.signing import SigningEngine
+
+REQUESTS = 400
+CONCURRENCY = 32
+
+
+async def ticker(stop: asyncio.Event) -> float:
+    """Return the worst event loop lag seen while the benchmark runs."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - start - 0.001)
+    return worst
+
+
+async def bench(settings: Settings) -> tuple[float, float]:
+    """Return the signatures per second and the worst loop lag in ms."""
+    engine = SigningEngine()
+    response = make_response()
+    # Start the pool before timing
+    await engine.to_response(response, settings)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def sign() -> None:
+        async with semaphore:
+            await engine.to_response(response, settings)
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(ticker(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(sign() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    engine.shutdown()
+    return REQUESTS / elapsed, await lag * 1000
+
+
+def main() -> None:
+    """Run the benchmark."""
+    key, cert = make_key_and_cert()
+    cpus = os.cpu_count() or 1
+    print(f"{cpus} CPUs")
+    print(f"{'workers':>8} {'signs/s':>10} {'max lag (ms)':>14}")
+    for workers in sorted({0, 1, 2, 4, cpus}):
+        settings = Settings(
+            saml_idp_entity_id="x",
+            saml_idp_metadata_key=key,
+            saml_idp_metadata_cert=cert,
+            saml_idp_signing_workers=workers,
+        )
+        rate, lag = asyncio.run(bench(settings))
+        print(f"{workers:>8} {rate:>10.0f} {lag:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
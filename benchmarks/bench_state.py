@@ -0,0 +1,54 @@
+"""Benchmark the operations of each state backend."""
+
+import tempfile
+from pathlib import Path
+
+from common import time_per_call
+
+from saml_idp.state import MemoryBackend, SqliteBackend, StateBackend
+
+ROUNDS = 20_000
+BATCH = 1_000
+
+
+def bench(backend: StateBackend) -> tuple[float, float, float, float]:
+    """Return the ops/sec of gets, sets, compare-and-sets and batched sets."""
+    counter = iter(range(10**9))
+    backend.set("key", b"value", 3600)
+
+    def batch() -> None:
+        backend.set_many(
+            [(f"batch{next(counter)}", b"value") for _ in range(BATCH)], 3600
+        )
+
+    return (
+        1_000_000 / time_per_call(lambda: backend.get("key"), ROUNDS),
+        1_000_000 / time_per_call(lambda: backend.set("key", b"value", 3600), ROUNDS),
+        1_000_000
+        / time_per_call(
+            lambda: backend.compare_and_set(f"cas{next(counter)}", None, b"", 3600),
+            ROUNDS,
+        ),
+        1_000_000 * BATCH / time_per_call(batch, ROUNDS // BATCH),
+    )
+
+
+def main() -> None:
+    """Run the benchmark."""
+    print(
+        f"{'backend':>8} {'get/s':>10} {'set/s':>10} {'cas/s':>10} {'set_many/s':>12}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for name, backend in (
+            ("memory", MemoryBackend()),
+            ("sqlite", SqliteBackend(str(Path(directory) / "state.db"))),
+        ):
+            get, set_, cas, set_many = bench(backend)
+            backend.close()
+            print(
+                f"{name:>8} {get:>10.0f} {set_:>10.0f} {cas:>10.0f} {set_many:>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
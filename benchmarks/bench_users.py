@@ -0,0 +1,65 @@
+"""Benchmark user lookups as the number of configured users grows."""
+
+import contextlib
+
+from common import run_sync, time_per_call
+
+from saml_idp import Settings
+from saml_idp.users import User
+
+SIZES = (10_000, 100_000, 1_000_000)
+ROUNDS = 1_000
+
+
+def make_users(count: int) -> list[User]:
+    """Create some test users."""
+    return [{"username": f"user{i}", "password": f"pass{i}"} for i in range(count)]
+
+
+def bench(count: int) -> tuple[float, float, float, float]:
+    """Time session lookups and logins of the first and last users."""
+    users = make_users(count)
+    settings = Settings(saml_idp_entity_id="x")
+    settings.saml_idp_users = users
+    first, last = users[0], users[-1]
+    session_id = Settings.generate_session_id(last)
+
+    def login_fail() -> None:
+        with contextlib.suppress(ValueError):
+            run_sync(settings.authenticate_user(last["username"], "wrong"))
+
+    return (
+        time_per_call(
+            lambda: run_sync(settings.get_user_from_session(session_id)), ROUNDS
+        ),
+        time_per_call(
+            lambda: run_sync(
+                settings.authenticate_user(first["username"], first["password"])
+            ),
+            ROUNDS,
+        ),
+        time_per_call(
+            lambda: run_sync(
+                settings.authenticate_user(last["username"], last["password"])
+            ),
+            ROUNDS,
+        ),
+        time_per_call(login_fail, ROUNDS),
+    )
+
+
+def main() -> None:
+    """Run the benchmark."""
+    print(
+        f"{'users':>10} {'session (us)':>14} {'login first (us)':>18}"
+        f" {'login last (us)':>17} {'login fail (us)':>17}"
+    )
+    for count in SIZES:
+        session, first, last, fail = bench(count)
+        print(
+            f"{count:>10} {session:>14.2f} {first:>18.2f} {last:>17.2f} {fail:>17.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
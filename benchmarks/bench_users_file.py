@@ -0,0 +1,69 @@
+"""Benchmark loading a users file into the compact store, against the JSON list."""
+
+import gc
+import json
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+from saml_idp.users import User, UserIndex, UserStore, read_users_file
+
+SIZES = (100_000, 1_000_000)
+
+
+def write_users(path: Path, count: int) -> None:
+    """Write a JSON Lines file of users with a few attributes."""
+    with path.open("w") as f:
+        for i in range(count):
+            user = {
+                "username": f"user{i}",
+                "password": f"pass{i}",
+                "attributes": {"email": f"user{i}@example.com", "group": f"g{i % 10}"},
+            }
+            f.write(json.dumps(user) + "\n")
+
+
+def load_list(path: Path) -> UserIndex:
+    """Load the users the way `SAML_IDP_USERS` is loaded: one JSON list of dicts."""
+    with path.open() as f:
+        users: list[User] = json.loads("[" + ",".join(f) + "]")
+    return UserIndex(users)
+
+
+def measure(load: Callable[[], object]) -> tuple[float, float]:
+    """Return the time to load, and the memory held by the result in MiB."""
+    gc.collect()
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return elapsed, memory / 1024 / 1024
+
+
+def main() -> None:
+    """Run the benchmark."""
+    print(
+        f"{'users':>10} {'list (s)':>10} {'list (MiB)':>11}"
+        f" {'file (s)':>10} {'file (MiB)':>11}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "users.jsonl"
+        for count in SIZES:
+            write_users(path, count)
+            list_time, list_memory = measure(lambda: load_list(path))
+            file_time, file_memory = measure(lambda: UserStore(read_users_file(path)))
+            print(
+                f"{count:>10} {list_time:>10.2f} {list_memory:>11.1f}"
+                f" {file_time:>10.2f} {file_memory:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
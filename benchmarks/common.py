@@ -0,0 +1,80 @@
+"""Helpers shared by the benchmarks."""
+
+import timeit
+from collections.abc import Callable, Coroutine
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.types import (
+    CertificateIssuerPrivateKeyTypes,
+)
+from cryptography.x509.oid import NameOID
+from pydantic import HttpUrl
+
+from saml_idp.models import AuthnResponse
+
+
+def run_sync[T](coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine that never awaits anything, without an event loop."""
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    msg = "The coroutine did not complete synchronously."
+    raise RuntimeError(msg)
+
+
+def time_per_call(func: Callable[[], object], number: int) -> float:
+    """Return the mean time of a call in microseconds."""
+    return timeit.timeit(func, number=number) / number * 1_000_000
+
+
+def make_key_and_cert(
+    key: CertificateIssuerPrivateKeyTypes | None = None,
+) -> tuple[str, str]:
+    """Create a PEM-encoded key (RSA by default) and self-signed certificate."""
+    key = key or rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.now(UTC)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return key_pem.decode(), cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def make_response() -> AuthnResponse:
+    """Create a response to sign."""
+    now = datetime.now(UTC)
+    return AuthnResponse(
+        issue_instant=now,
+        issuer=HttpUrl("https://example.com/issuer"),
+        destination=HttpUrl("https://example.com/destination"),
+        in_response_to="_yyyy",
+        status_code="urn:oasis:names:tc:SAML:2.0:status:Success",
+        subject_name_id_format="urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified",
+        subject_name_id="foo@example.com",
+        subject_not_on_or_after=now,
+        conditions_not_before=now,
+        conditions_not_on_or_after=now,
+        attributes={"foo": "bar"},
+        audience_restriction="https://example.com/samlauth/",
+        authn_instant=now,
+        authn_context_class_ref="urn:oasis:names:tc:SAML:2.0:ac:classes:Password",
+        session_index="session_index",
+    )
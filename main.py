@@ -5,7 +5,10 @@ from starlette.middleware.gzip import GZipMiddleware
 
 from saml_idp import router
 from saml_idp.config import settings
+from saml_idp.server_timing import ServerTimingMiddleware
 
 app = FastAPI()
 app.add_middleware(GZipMiddleware)
+if settings.saml_idp_server_timing:
+    app.add_middleware(ServerTimingMiddleware)
 app.include_router(router, prefix=settings.saml_idp_router_prefix)
@@ -0,0 +1,112 @@
+"""Bulk changes to the users, for the admin API."""
+
+import asyncio
+import json
+import logging
+import time
+from collections.abc import AsyncIterator
+
+from pydantic import BaseModel
+
+from .users import AttributeNames, UserRecord, UserStore
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1_000
+"""How many changes are applied at once, between yields to the event loop."""
+
+MAX_LINE_SIZE = 64 * 1024
+"""The maximum size of a line, in bytes."""
+
+
+class UserChangesResult(BaseModel):
+    """The outcome of a bulk change."""
+
+    upserted: int
+    deleted: int
+    seconds: float
+    changes_per_second: float
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a stream of chunks into lines."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > MAX_LINE_SIZE:
+            msg = f"Lines must be shorter than {MAX_LINE_SIZE} bytes."
+            raise ValueError(msg)
+    yield buffer
+
+
+async def apply_user_changes(
+    chunks: AsyncIterator[bytes], store: UserStore, batch_size: int = BATCH_SIZE
+) -> UserChangesResult:
+    """
+    Apply a stream of NDJSON changes to a store, in batches.
+
+    Each line is a user object, with an optional `op`: `upsert` (the default)
+    or `delete`, which only needs the `username`. Changes are applied in
+    order. If a line is invalid, the batches before it stay applied. Only
+    deletes of users that existed are counted.
+    """
+    start = time.perf_counter()
+    attribute_names = AttributeNames()
+    upserts: list[UserRecord] = []
+    deletes: list[str] = []
+    upserted = deleted = 0
+
+    def flush() -> None:
+        nonlocal upserted, deleted
+        deleted += store.apply(upserts, deletes)
+        upserted += len(upserts)
+        upserts.clear()
+        deletes.clear()
+
+    line_num = 0
+    async for line in _lines(chunks):
+        line_num += 1
+        if not line.strip():
+            continue
+        try:
+            change = json.loads(line)
+            op = change.get("op", "upsert")
+            if op == "upsert":
+                # Keep the changes in order, by never mixing ops in a batch.
+                if deletes:
+                    flush()
+                upserts.append(attribute_names.record(change))
+            elif op == "delete":
+                if upserts:
+                    flush()
+                deletes.append(str(change["username"]))
+            else:
+                msg = f"Unknown op: {op}"
+                raise ValueError(msg)  # noqa: TRY301
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            msg = f"Invalid change on line {line_num}."
+            raise ValueError(msg) from e
+        if len(upserts) + len(deletes) >= batch_size:
+            flush()
+            # Let other requests run between batches.
+            await asyncio.sleep(0)
+    flush()
+
+    seconds = time.perf_counter() - start
+    result = UserChangesResult(
+        upserted=upserted,
+        deleted=deleted,
+        seconds=seconds,
+        changes_per_second=(upserted + deleted) / seconds if seconds else 0.0,
+    )
+    logger.info(
+        "Applied %d upserts and %d deletes in %.3fs (%.0f/s)",
+        upserted,
+        deleted,
+        seconds,
+        result.changes_per_second,
+    )
+    return result
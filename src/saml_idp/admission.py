@@ -0,0 +1,135 @@
+"""Admission control for the endpoints that sign responses."""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+
+from .metrics import stage
+
+_queue_stage = stage("queue")
+
+
+class OverloadedError(Exception):
+    """Raised when a request can't be admitted, because the queue is full or slow."""
+
+
+class AdmissionStats(NamedTuple):
+    """Counters for an admission limiter."""
+
+    active: int
+    """How many requests hold a slot."""
+    waiting: int
+    """How many requests are queued for a slot."""
+    admitted: int
+    rejected: int
+    wait_time: float
+    """The total time admitted requests waited for a slot, in seconds."""
+    max_wait: float
+    """The longest time a request waited for a slot, in seconds."""
+
+    @property
+    def mean_wait(self) -> float:
+        """Return the mean time admitted requests waited for a slot, in seconds."""
+        return self.wait_time / self.admitted if self.admitted else 0.0
+
+
+class AdmissionLimiter:
+    """
+    Limit how many requests do expensive work at once, with a bounded wait queue.
+
+    Building and signing a response is CPU-bound, so under a burst of logins
+    requests that are all admitted just slow each other down, and the cheap
+    endpoints with them. Instead, requests over the limit wait for a slot in
+    FIFO order, and once the queue is full or a request has waited too long,
+    it's rejected straight away so the client can retry later.
+
+    Slots are handed directly from the request releasing them to the first
+    waiter, so a burst of new requests can't overtake the queue.
+    """
+
+    def __init__(self) -> None:
+        """Create a limiter with no requests."""
+        self._active = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    @asynccontextmanager
+    async def admit(
+        self, limit: int, queue_size: int, queue_timeout: float
+    ) -> AsyncIterator[None]:
+        """
+        Hold one of `limit` slots for the duration of the block.
+
+        If every slot is taken, wait up to `queue_timeout` seconds behind at most
+        `queue_size` other requests. Raises `OverloadedError` if the queue is
+        full or the wait times out. If `limit` is 0, there's no limit.
+        """
+        if limit <= 0:
+            yield
+            return
+        start = time.perf_counter()
+        if self._active < limit and not self._waiters:
+            self._active += 1
+        else:
+            await self._wait(queue_size, queue_timeout)
+        waited = time.perf_counter() - start
+        self.admitted += 1
+        self.wait_time += waited
+        self.max_wait = max(self.max_wait, waited)
+        _queue_stage.observe(waited)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _wait(self, queue_size: int, queue_timeout: float) -> None:
+        """Wait for a slot to be handed over."""
+        if len(self._waiters) >= queue_size:
+            self.rejected += 1
+            msg = "The wait queue is full."
+            raise OverloadedError(msg)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout(queue_timeout):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over as the wait ended, so pass it on.
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+            if isinstance(e, TimeoutError):
+                self.rejected += 1
+                msg = "Timed out waiting for a slot."
+                raise OverloadedError(msg) from None
+            raise
+
+    def _release(self) -> None:
+        """Hand the slot to the first waiter, or free it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> AdmissionStats:
+        """Return the limiter's counters."""
+        return AdmissionStats(
+            active=self._active,
+            waiting=len(self._waiters),
+            admitted=self.admitted,
+            rejected=self.rejected,
+            wait_time=self.wait_time,
+            max_wait=self.max_wait,
+        )
+
+
+admission_limiter = AdmissionLimiter()
@@ -0,0 +1,100 @@
+"""Pool of pre-signed responses for IdP-initiated SSO."""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+MAX_KEYS = 10_000
+"""The maximum number of (user, SP, ACS URL) combinations to keep pools for."""
+
+MAX_REFILLS = 4
+"""
+The maximum number of pools refilled at once.
+
+Each refill signs one response at a time, so this bounds the signing done in
+the background, however many new pools requests ask for.
+"""
+
+
+class AssertionPool:
+    """
+    Pools of pre-signed, encoded responses.
+
+    Unsolicited responses don't depend on a request, so they can be signed
+    ahead of time. Each pool is refilled in the background when responses are
+    taken, and responses are dropped once they're too old to hand out.
+    """
+
+    def __init__(self) -> None:
+        """Create empty pools."""
+        self._pools: dict[Hashable, deque[tuple[float, str]]] = {}
+        self._refilling: dict[Hashable, asyncio.Task[None]] = {}
+
+    def take(self, key: Hashable) -> str | None:
+        """Return a response from a pool, or None if it has no fresh ones."""
+        pool = self._pools.get(key)
+        now = time.monotonic()
+        while pool:
+            expires, response = pool.popleft()
+            if expires > now:
+                return response
+        return None
+
+    def size(self, key: Hashable) -> int:
+        """Return the number of responses in a pool, including expired ones."""
+        return len(self._pools.get(key, ()))
+
+    def schedule_refill(
+        self,
+        key: Hashable,
+        mint: Callable[[], Awaitable[str]],
+        depth: int,
+        ttl: float,
+    ) -> None:
+        """
+        Refill a pool in the background, unless it's already being refilled.
+
+        If `MAX_REFILLS` pools are already being refilled, the pool is left as
+        it is, to be refilled by a later request.
+        """
+        if key in self._refilling or len(self._refilling) >= MAX_REFILLS:
+            return
+        task = asyncio.create_task(self.refill(key, mint, depth, ttl))
+        self._refilling[key] = task
+        task.add_done_callback(lambda _: self._refilling.pop(key, None))
+
+    async def refill(
+        self,
+        key: Hashable,
+        mint: Callable[[], Awaitable[str]],
+        depth: int,
+        ttl: float,
+    ) -> None:
+        """Drop the expired responses in a pool and mint new ones up to `depth`."""
+        pool = self._pools.get(key)
+        if pool is None:
+            if len(self._pools) >= MAX_KEYS:
+                del self._pools[next(iter(self._pools))]
+            pool = self._pools[key] = deque()
+        now = time.monotonic()
+        while pool and pool[0][0] <= now:
+            pool.popleft()
+        try:
+            while len(pool) < depth:
+                response = await mint()
+                pool.append((time.monotonic() + ttl, response))
+        except Exception:
+            logger.exception("Unable to refill the assertion pool.")
+
+    def clear(self) -> None:
+        """Drop every pool, and stop refilling them."""
+        for task in self._refilling.values():
+            task.cancel()
+        self._pools.clear()
+
+
+assertion_pool = AssertionPool()
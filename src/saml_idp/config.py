@@ -1,20 +1,32 @@
 """Configuration for the SAML application."""
 
-import hashlib
+import asyncio
+import threading
+import time
+from collections.abc import Container, Iterable
 from pathlib import Path
-from typing import Any, Literal, NotRequired, Required, TypedDict
+from typing import Any, Literal
 
 from fastapi_csrf_protect.flexible import CsrfProtect
-from pydantic import HttpUrl, Json
+from pydantic import HttpUrl, Json, PrivateAttr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from .metrics import stage
+from .sessions import SessionToken, decode_token, encode_token
+from .state import check_state_backend_url
+from .users import (
+    SyntheticUsers,
+    SyntheticUsersConfig,
+    User,
+    UserIndex,
+    UsernameIndex,
+    UserSource,
+    UserStore,
+    generate_session_id,
+    read_users_file,
+)
 
-class User(TypedDict):
-    """Configuration for one test user."""
-
-    username: Required[str]
-    password: Required[str]
-    attributes: NotRequired[dict[str, str]]
+_lookup_stage = stage("lookup")
 
 
 class Settings(BaseSettings):
@@ -42,7 +54,34 @@ class Settings(BaseSettings):
     """The logout URL to redirect to."""
 
     saml_idp_users: Json[list[User]] | None = None
-    """The list of test users for the IdP."""
+    """
+    The list of test users for the IdP.
+
+    Assigning a new list rebuilds the session index; don't mutate it in place.
+    """
+
+    saml_idp_users_file: str = ""
+    """
+    The path of a file with more users, one per line.
+
+    The file can be JSON Lines, with one user object per line, or CSV with
+    `username` and `password` columns and a column per attribute.
+    """
+
+    saml_idp_synthetic_users: Json[SyntheticUsersConfig] | None = None
+    """
+    A pattern for generated users, which aren't stored. For example:
+
+    {"username": "user{n}", "password": "pass{n}", "count": 1000000,
+     "attributes": {"email": "user{n}@example.com"}}
+    """
+
+    saml_idp_users_reload_interval: float = 0
+    """
+    How often to check the users file and `.env` for changes, in seconds.
+
+    Changed users are loaded in the background. If 0, they're never reloaded.
+    """
 
     saml_idp_show_users: bool = False
     """Whether to show the user credentials on the login screen."""
@@ -53,8 +92,77 @@ class Settings(BaseSettings):
     saml_idp_secret_key: str = ""
     """Secret key used for CSRF protection."""
 
+    saml_idp_admin_token: str = ""
+    """The bearer token for the admin API. If empty, the admin API is disabled."""
+
+    saml_idp_signing_workers: int = 0
+    """The number of processes used to sign responses. If 0, sign in-process."""
+
+    saml_idp_metadata_max_age: int = 3600
+    """How many seconds the served metadata is cached before it's rebuilt."""
+
+    saml_idp_sign_metadata: bool = False
+    """Whether to sign the metadata. It's re-signed in the background."""
+
+    saml_idp_assertion_pool_depth: int = 0
+    """How many IdP-initiated responses to sign ahead of time per user and SP."""
+
+    saml_idp_assertion_pool_ttl: int = 120
+    """How many seconds a pre-signed response can wait in the pool."""
+
+    saml_idp_max_request_size: int = 64 * 1024
+    """The maximum size of an inflated SAML request, in bytes."""
+
+    saml_idp_request_cache_size: int = 1024
+    """How many decoded SAML requests to cache. If 0, don't cache them."""
+
+    saml_idp_max_concurrent_responses: int = 0
+    """
+    How many responses to SAML requests are built and signed at once.
+
+    Other requests wait in a queue for a slot. If 0, there's no limit.
+    """
+
+    saml_idp_response_queue_size: int = 100
+    """How many requests can wait for a slot before new ones are rejected."""
+
+    saml_idp_response_queue_timeout: float = 5
+    """How many seconds a request can wait for a slot before it's rejected."""
+
+    saml_idp_server_timing: bool = False
+    """Whether to add a `Server-Timing` header with the time spent in each stage."""
+
+    saml_idp_reject_replays: bool = False
+    """Whether to reject SAML request IDs that were already answered."""
+
+    saml_idp_state_backend: str = ""
+    """
+    Where to keep state shared between replicas, such as the replay cache.
+
+    `memory` or `sqlite:///path/to/state.db`. If empty, keep it in-process.
+    """
+
+    saml_idp_session_format: Literal["hash", "token"] = "hash"
+    """
+    The format of the session cookie.
+
+    `hash` is a hash of the user's credentials. `token` is a signed token that
+    any replica sharing the secret key can verify, with an expiry, the SPs the
+    user signed in to and the session index.
+    """
+
+    saml_idp_session_max_age: int = 3600
+    """How many seconds a session lasts."""
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
+    _user_sources: tuple[UserSource, ...] = PrivateAttr(default=())
+    _admin_users: UserStore = PrivateAttr(default_factory=UserStore)
+    _username_index: UsernameIndex = PrivateAttr(default_factory=UsernameIndex)
+    _username_index_version: int = PrivateAttr(default=0)
+    _users_loaded: bool = PrivateAttr(default=False)
+    _users_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
     def model_post_init(self, __context: Any, /) -> None:
         """Initialize the certificate parameters."""
         if not self.saml_idp_metadata_cert and self.saml_idp_metadata_cert_file:
@@ -63,6 +171,83 @@ class Settings(BaseSettings):
         if not self.saml_idp_metadata_key and self.saml_idp_metadata_key_file:
             with Path(self.saml_idp_metadata_key_file).open() as f:
                 self.saml_idp_metadata_key = f.read()
+        if self.saml_idp_session_format == "token" and not self.saml_idp_secret_key:
+            msg = "Token sessions require a secret key."
+            raise ValueError(msg)
+        if self.saml_idp_state_backend:
+            check_state_backend_url(self.saml_idp_state_backend)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """Keep the user indexes in sync when the users are replaced."""
+        super().__setattr__(name, value)
+        if self._users_loaded and name in {
+            "saml_idp_users",
+            "saml_idp_users_file",
+            "saml_idp_synthetic_users",
+        }:
+            self._load_users()
+
+    def load_users(self) -> None:
+        """
+        Index the users and load the users file, unless it was already done.
+
+        The users aren't loaded with the settings, since every process that
+        imports them would hold them, signing workers included. The router
+        loads them on startup, and lookups load them on first use.
+        """
+        if self._users_loaded:
+            return
+        with self._users_lock:
+            if not self._users_loaded:
+                self._load_users()
+
+    def _load_users(self) -> None:
+        """Index the users, and load the users file."""
+        sources = build_user_sources(
+            self.saml_idp_users,
+            self.saml_idp_users_file,
+            self.saml_idp_synthetic_users,
+        )
+        self._admin_users.shadowed = sources
+        self._user_sources = (self._admin_users, *sources)
+        self._username_index = index_usernames(
+            sources, self._admin_users.usernames(), self._admin_users.deleted()
+        )
+        self._username_index_version = self._admin_users.version
+        self._users_loaded = True
+
+    def replace_users(
+        self,
+        users: list[User] | None,
+        users_file: str,
+        sources: tuple[UserSource, ...],
+    ) -> None:
+        """
+        Replace the users with ones that were already indexed.
+
+        The sources are swapped in one assignment, so concurrent lookups see
+        either the old users or the new ones. Users added through the admin
+        API are kept. The username index is rebuilt by `reindex_users`.
+        """
+        super().__setattr__("saml_idp_users", users)
+        super().__setattr__("saml_idp_users_file", users_file)
+        self._admin_users.shadowed = sources
+        self._user_sources = (self._admin_users, *sources)
+        self._users_loaded = True
+
+    def _source_of(self, username: str) -> UserSource | None:
+        """
+        Return the first source with a username, whose user shadows the others.
+
+        Returns None if no source has it, or it was deleted through the admin API.
+        """
+        self.load_users()
+        if self._admin_users.is_deleted(username):
+            return None
+        for source in self._user_sources:
+            if username in source:
+                return source
+        return None
 
     async def authenticate_user(self, username: str, password: str) -> tuple[User, str]:
         """
@@ -70,18 +255,116 @@ class Settings(BaseSettings):
 
         If it's successful, return a username and session ID. Otherwise, raise an error.
         """
-        for user in self.saml_idp_users or []:
-            if user["username"] == username and user["password"] == password:
-                return user, self.generate_session_id(user)
+        start = time.perf_counter()
+        try:
+            # An unknown user is checked against the admin users, which compares
+            # the password to a placeholder, so failing takes as long either way.
+            source = self._source_of(username) or self._admin_users
+            if result := source.authenticate(username, password):
+                if self.saml_idp_session_format == "token":
+                    return result[0], self.create_session(result[0])
+                return result
+        finally:
+            _lookup_stage.observe_since(start)
         msg = "Invalid username or password."
         raise ValueError(msg)
 
     async def get_user_from_session(self, session_id: str) -> User | None:
         """Return the user from a session."""
-        for user in self.saml_idp_users or []:
-            if session_id == self.generate_session_id(user):
-                return user
-        return None
+        start = time.perf_counter()
+        try:
+            if self.saml_idp_session_format == "token":
+                token = self.get_session(session_id)
+                return self.get_user_by_username(token.username) if token else None
+            self.load_users()
+            for source in self._user_sources:
+                if (user := source.get_by_session(session_id)) is not None:
+                    # The session is only valid for the source the user comes from.
+                    if self._source_of(user["username"]) is source:
+                        return user
+                    return None
+            return None
+        finally:
+            _lookup_stage.observe_since(start)
+
+    def get_user_by_username(self, username: str) -> User | None:
+        """Return the user with a username."""
+        source = self._source_of(username)
+        return source.get_by_username(username) if source else None
+
+    async def reindex_users(self) -> None:
+        """
+        Rebuild the username index in a thread, after the users changed.
+
+        The admin users are copied first, since they can change meanwhile.
+        An index that was overtaken by a newer one isn't swapped in.
+        """
+        self.load_users()
+        sources = self._user_sources
+        admin = self._admin_users
+        version = admin.version
+        index = await asyncio.to_thread(
+            index_usernames, sources[1:], list(admin.usernames()), admin.deleted()
+        )
+        if sources is self._user_sources and version >= self._username_index_version:
+            self._username_index = index
+            self._username_index_version = version
+
+    def search_users(
+        self, prefix: str, offset: int, limit: int
+    ) -> tuple[int, list[User]]:
+        """
+        Return the number of users whose username starts with a prefix, and a page.
+
+        The sorted index is built with the users, and rebuilt off the event
+        loop by `reindex_users` when they change. Until then, users that are
+        gone are left out of the page, and new users aren't found. Synthetic
+        users aren't listed.
+        """
+        self.load_users()
+        total, usernames = self._username_index.search(prefix, offset, limit)
+        users = [
+            user
+            for username in usernames
+            if (user := self.get_user_by_username(username))
+        ]
+        return total, users
+
+    def create_session(
+        self, user: User, sp: str | None = None, session_id: str | None = None
+    ) -> str:
+        """
+        Return a session ID for a user, who's signing in to `sp` if it's set.
+
+        With token sessions, the user's current session (`session_id`) is
+        carried over, and the SP is added to it.
+        """
+        if self.saml_idp_session_format != "token":
+            # A synthetic user's session is only valid if no other user shadows it.
+            source = self._source_of(user["username"])
+            if isinstance(source, SyntheticUsers) and (
+                session_id := source.session_id(user)
+            ):
+                return session_id
+            return generate_session_id(user)
+        token = self.get_session(session_id) if session_id else None
+        if token is None or token.username != user["username"]:
+            token = SessionToken.new(user["username"], self.saml_idp_session_max_age)
+        if sp:
+            token = token.with_sp(sp)
+        return encode_token(token, self.saml_idp_secret_key)
+
+    @property
+    def admin_users(self) -> UserStore:
+        """The users managed through the admin API, which take precedence."""
+        self.load_users()
+        return self._admin_users
+
+    def get_session(self, session_id: str) -> SessionToken | None:
+        """Return the contents of a session token, or None for other sessions."""
+        if self.saml_idp_session_format != "token":
+            return None
+        return decode_token(session_id, self.saml_idp_secret_key)
 
     @classmethod
     def generate_session_id(cls, user: User) -> str:
@@ -91,10 +374,35 @@ class Settings(BaseSettings):
         This is *NOT* meant to be secure. It's only meant so we have a way to
         identify a user without a local state or database.
         """
-        h = hashlib.new("sha256")
-        h.update(user["username"].encode())
-        h.update(user["password"].encode())
-        return h.hexdigest()
+        return generate_session_id(user)
+
+
+def index_usernames(
+    sources: Iterable[UserSource],
+    admin_usernames: Iterable[str],
+    deleted: Container[str],
+) -> UsernameIndex:
+    """Index the usernames of the admin users and the sources they shadow."""
+    return UsernameIndex(
+        username
+        for usernames in (admin_usernames, *(source.usernames() for source in sources))
+        for username in usernames
+        if username not in deleted
+    )
+
+
+def build_user_sources(
+    users: list[User] | None,
+    users_file: str,
+    synthetic_users: SyntheticUsersConfig | None = None,
+) -> tuple[UserSource, ...]:
+    """Index the users, load the users file, and set up the synthetic users."""
+    sources: list[UserSource] = [UserIndex(users or [])]
+    if users_file:
+        sources.append(UserStore(read_users_file(users_file)))
+    if synthetic_users:
+        sources.append(SyntheticUsers(synthetic_users))
+    return tuple(sources)
 
 
 settings = Settings()
@@ -1,9 +1,11 @@
 """SAML IdP dependencies."""
 
+import hmac
 from typing import Annotated
 
-from fastapi import Cookie, Depends
+from fastapi import Cookie, Depends, Header, HTTPException
 from fastapi_csrf_protect.flexible import CsrfProtect
+from starlette import status
 
 from .config import User, settings
 
@@ -17,5 +19,23 @@ async def get_user(
     return None
 
 
+async def require_admin(
+    authorization: Annotated[str | None, Header()] = None,
+) -> None:
+    """Require the admin token as a bearer token."""
+    if not settings.saml_idp_admin_token:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), settings.saml_idp_admin_token.encode()
+    ):
+        raise HTTPException(
+            status.HTTP_401_UNAUTHORIZED,
+            "Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
 GetUser = Annotated[User | None, Depends(get_user)]
 GetCsrfProtect = Annotated[CsrfProtect, Depends()]
+RequireAdmin = Depends(require_admin)
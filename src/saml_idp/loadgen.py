@@ -0,0 +1,420 @@
+"""
+An SP simulator and end-to-end SSO load generator.
+
+Each virtual user signs in through `/signin` and `POST /login`, verifies the
+signed response against the certificate in the IdP's metadata, then logs out
+through `/logout`. Run it against a server, or against the router in-process:
+
+    python -m saml_idp.loadgen --url http://localhost:8000 -c 16 -n 1000
+    python -m saml_idp.loadgen -c 16 -n 1000
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import math
+import time
+import uuid
+from collections.abc import Iterator, Sequence
+from datetime import UTC, datetime, timedelta
+from typing import NamedTuple
+
+import httpx
+from fastapi import FastAPI
+from lxml import etree
+from signxml import XMLVerifier
+from starlette import status
+from starlette.middleware.gzip import GZipMiddleware
+
+from .config import settings
+from .models.decoder import SAML_NS, SAMLP_NS
+from .router import router
+from .server_timing import ServerTimingMiddleware
+from .utils import deflate_and_encode, saml2_timestamp
+
+DS_NS = "{http://www.w3.org/2000/09/xmldsig#}"
+
+SUCCESS = "urn:oasis:names:tc:SAML:2.0:status:Success"
+
+STEPS = ("signin", "login", "verify", "logout")
+"""The steps of an SSO flow, in order."""
+
+
+class StepStats(NamedTuple):
+    """The outcome of a step over a run."""
+
+    name: str
+    count: int
+    errors: int
+    throughput: float
+    """Successful steps per second."""
+    p50: float
+    p95: float
+    p99: float
+    """Latency percentiles, in seconds."""
+
+
+class LoadReport(NamedTuple):
+    """The outcome of a run."""
+
+    seconds: float
+    flows: int
+    """How many SSO flows completed without an error."""
+    errors: int
+    steps: list[StepStats]
+
+    @property
+    def flows_per_second(self) -> float:
+        """Return the number of completed flows per second."""
+        return self.flows / self.seconds if self.seconds else 0.0
+
+
+class LoadGenError(Exception):
+    """A step got a response it didn't expect."""
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """Return a percentile of sorted values, by the nearest-rank method."""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+class SpSimulator:
+    """A service provider that sends SAML requests and checks the responses."""
+
+    def __init__(self, issuer: str, acs_url: str, cert: str) -> None:
+        """Create an SP that trusts responses signed with a certificate."""
+        self.issuer = issuer
+        self.acs_url = acs_url
+        self.cert = cert
+        self._verifier = XMLVerifier()
+
+    def authn_request(self, destination: str) -> tuple[str, str]:
+        """Return the ID of a new AuthnRequest, and the encoded request."""
+        request_id = f"_{uuid.uuid4()}"
+        request = f"""<samlp:AuthnRequest
+    xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"
+    xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion"
+    AssertionConsumerServiceURL="{self.acs_url}"
+    Destination="{destination}"
+    ID="{request_id}"
+    IssueInstant="{saml2_timestamp(datetime.now(UTC))}"
+    Version="2.0">
+    <saml:Issuer>{self.issuer}</saml:Issuer>
+</samlp:AuthnRequest>"""
+        return request_id, deflate_and_encode(request).decode()
+
+    def logout_request(
+        self, destination: str, name_id: str, session_index: str
+    ) -> tuple[str, str]:
+        """Return the ID of a new LogoutRequest, and the encoded request."""
+        request_id = f"_{uuid.uuid4()}"
+        now = datetime.now(UTC)
+        request = f"""<samlp:LogoutRequest
+    xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"
+    xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion"
+    Destination="{destination}"
+    ID="{request_id}"
+    IssueInstant="{saml2_timestamp(now)}"
+    NotOnOrAfter="{saml2_timestamp(now + timedelta(minutes=5))}"
+    Version="2.0">
+    <saml:Issuer>{self.issuer}</saml:Issuer>
+    <saml:NameID>{name_id}</saml:NameID>
+    <samlp:SessionIndex>{session_index}</samlp:SessionIndex>
+</samlp:LogoutRequest>"""
+        return request_id, deflate_and_encode(request).decode()
+
+    @staticmethod
+    def read_response(html: bytes) -> etree.Element:
+        """Return the SAML response posted by a `redir.html` page."""
+        page = etree.fromstring(html, etree.HTMLParser())
+        values = page.xpath("//input[@name='SAMLResponse']/@value")
+        if not values:
+            msg = "No SAMLResponse in the page."
+            raise LoadGenError(msg)
+        return etree.fromstring(base64.b64decode(values[0]))
+
+    def verify(self, response: etree.Element, request_id: str) -> etree.Element:
+        """Verify a signed response to a request, and return the signed assertion."""
+        check_response(response, request_id)
+        return self._verifier.verify(response, x509_cert=self.cert).signed_xml
+
+
+def check_response(response: etree.Element, request_id: str) -> None:
+    """Check that a response is a successful answer to a request."""
+    if response.get("InResponseTo") != request_id:
+        msg = f"Response is not to {request_id}."
+        raise LoadGenError(msg)
+    status_code = response.find(f"{SAMLP_NS}Status/{SAMLP_NS}StatusCode")
+    if status_code is None or status_code.get("Value") != SUCCESS:
+        msg = "Response is not a success."
+        raise LoadGenError(msg)
+
+
+def read_metadata_cert(metadata: bytes) -> str:
+    """Return the signing certificate in an IdP's metadata, PEM-encoded."""
+    cert = etree.fromstring(metadata).findtext(f".//{DS_NS}X509Certificate")
+    if not cert:
+        msg = "No certificate in the metadata."
+        raise LoadGenError(msg)
+    body = "".join(cert.split())
+    lines = [body[i : i + 64] for i in range(0, len(body), 64)]
+    return "\n".join(
+        ["-----BEGIN CERTIFICATE-----", *lines, "-----END CERTIFICATE-----"]
+    )
+
+
+def login_form(html: bytes) -> tuple[str, dict[str, str]]:
+    """Return the action and the hidden fields of a login page's form."""
+    page = etree.fromstring(html, etree.HTMLParser())
+    forms = page.xpath("//form[.//input[@name='username']]")
+    if not forms:
+        msg = "No login form in the page."
+        raise LoadGenError(msg)
+    fields = {
+        str(field.get("name")): field.get("value", "")
+        for field in forms[0].xpath(".//input[@type='hidden'][@name]")
+    }
+    return forms[0].get("action", ""), fields
+
+
+class _Recorder:
+    """Collects the latency of each step, and the errors."""
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = {step: [] for step in STEPS}
+        self.errors: dict[str, int] = dict.fromkeys(STEPS, 0)
+        self.flows = 0
+
+    @contextlib.contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[name] += 1
+            raise
+        self.latencies[name].append(time.perf_counter() - start)
+
+    def report(self, seconds: float) -> LoadReport:
+        steps = []
+        for name in STEPS:
+            latencies = sorted(self.latencies[name])
+            steps.append(
+                StepStats(
+                    name=name,
+                    count=len(latencies),
+                    errors=self.errors[name],
+                    throughput=len(latencies) / seconds if seconds else 0.0,
+                    p50=percentile(latencies, 0.5),
+                    p95=percentile(latencies, 0.95),
+                    p99=percentile(latencies, 0.99),
+                )
+            )
+        return LoadReport(
+            seconds=seconds,
+            flows=self.flows,
+            errors=sum(self.errors.values()),
+            steps=steps,
+        )
+
+
+def _expect(response: httpx.Response, status_code: int) -> None:
+    if response.status_code != status_code:
+        msg = f"{response.request.url.path} returned {response.status_code}."
+        raise LoadGenError(msg)
+
+
+async def sso_flow(
+    client: httpx.AsyncClient,
+    sp: SpSimulator,
+    username: str,
+    password: str,
+    recorder: _Recorder,
+    *,
+    verify: bool = True,
+) -> None:
+    """Sign a user in to the SP, verify the response, and log them out."""
+    client.cookies.clear()
+    signin_url = str(client.base_url.join("signin"))
+    with recorder.step("signin"):
+        request_id, saml_request = sp.authn_request(signin_url)
+        response = await client.get("signin", params={"SAMLRequest": saml_request})
+        _expect(response, status.HTTP_200_OK)
+        action, fields = login_form(response.content)
+
+    with recorder.step("login"):
+        response = await client.post(
+            action, data={**fields, "username": username, "password": password}
+        )
+        _expect(response, status.HTTP_200_OK)
+        authn_response = sp.read_response(response.content)
+
+    with recorder.step("verify"):
+        if verify:
+            assertion = sp.verify(authn_response, request_id)
+        else:
+            check_response(authn_response, request_id)
+            assertion = authn_response.find(f"{SAML_NS}Assertion")
+            if assertion is None:
+                msg = "No assertion in the response."
+                raise LoadGenError(msg)
+        statement = assertion.find(f"{SAML_NS}AuthnStatement")
+        session_index = "" if statement is None else statement.get("SessionIndex", "")
+        name_id = assertion.findtext(f"{SAML_NS}Subject/{SAML_NS}NameID") or username
+
+    with recorder.step("logout"):
+        request_id, saml_request = sp.logout_request(
+            str(client.base_url.join("logout")), name_id, session_index
+        )
+        response = await client.get("logout", params={"SAMLRequest": saml_request})
+        _expect(response, status.HTTP_200_OK)
+        check_response(sp.read_response(response.content), request_id)
+    recorder.flows += 1
+
+
+def build_app() -> FastAPI:
+    """Build an app that serves the router, with the middleware `main.py` adds."""
+    app = FastAPI()
+    app.add_middleware(GZipMiddleware)
+    if settings.saml_idp_server_timing:
+        app.add_middleware(ServerTimingMiddleware)
+    app.include_router(router, prefix=settings.saml_idp_router_prefix)
+    return app
+
+
+async def run_load(
+    *,
+    url: str | None = None,
+    username: str,
+    password: str,
+    concurrency: int = 8,
+    flows: int = 100,
+    issuer: str = "https://sp.example.com/loadgen",
+    acs_url: str = "https://sp.example.com/acs",
+    verify: bool = True,
+) -> LoadReport:
+    """
+    Run `flows` SSO flows with `concurrency` virtual users, and report on them.
+
+    If `url` is None, the router is served in-process, with the current settings.
+    Each virtual user has its own client, like a browser, with its own cookies
+    and connection.
+    """
+    lifespan: contextlib.AbstractAsyncContextManager[object]
+    if url is None:
+        app = build_app()
+        base_url = f"http://loadgen{settings.saml_idp_router_prefix}/"
+        lifespan = app.router.lifespan_context(app)
+
+        def client() -> httpx.AsyncClient:
+            return httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+                base_url=base_url,
+            )
+
+    else:
+        base_url = url.rstrip("/") + "/"
+        lifespan = contextlib.nullcontext()
+
+        def client() -> httpx.AsyncClient:
+            return httpx.AsyncClient(base_url=base_url)
+
+    recorder = _Recorder()
+    remaining = flows
+
+    async def virtual_user(sp: SpSimulator) -> None:
+        nonlocal remaining
+        async with client() as user_client:
+            while remaining > 0:
+                remaining -= 1
+                # Errors are counted against their step, and the flow abandoned,
+                # whatever they are, so one bad response doesn't end the run.
+                with contextlib.suppress(Exception):
+                    await sso_flow(
+                        user_client, sp, username, password, recorder, verify=verify
+                    )
+
+    async with lifespan:
+        async with client() as metadata_client:
+            response = await metadata_client.get("metadata.xml")
+            _expect(response, status.HTTP_200_OK)
+        sp = SpSimulator(issuer, acs_url, read_metadata_cert(response.content))
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_user(sp) for _ in range(concurrency)))
+        return recorder.report(time.perf_counter() - start)
+
+
+def format_report(report: LoadReport) -> str:
+    """Format a report as a table."""
+    lines = [
+        (
+            f"{report.flows} flows in {report.seconds:.2f}s "
+            f"({report.flows_per_second:.1f}/s), {report.errors} errors"
+        ),
+        "",
+        (
+            f"{'step':<8} {'count':>7} {'errors':>7} {'per sec':>9} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        ),
+    ]
+    lines.extend(
+        f"{step.name:<8} {step.count:>7} {step.errors:>7} {step.throughput:>9.1f} "
+        f"{step.p50 * 1000:>8.2f} {step.p95 * 1000:>8.2f} {step.p99 * 1000:>8.2f}"
+        for step in report.steps
+    )
+    return "\n".join(lines)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run the load generator from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m saml_idp.loadgen", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument(
+        "--url", help="The IdP's base URL. If omitted, serve the router in-process."
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument(
+        "-n", "--flows", type=int, default=100, help="How many SSO flows to run."
+    )
+    parser.add_argument("-u", "--username", help="Defaults to the first user.")
+    parser.add_argument("-p", "--password", help="Defaults to the first user's.")
+    parser.add_argument("--issuer", default="https://sp.example.com/loadgen")
+    parser.add_argument("--acs-url", default="https://sp.example.com/acs")
+    parser.add_argument(
+        "--no-verify",
+        dest="verify",
+        action="store_false",
+        help="Don't verify the signatures, to leave more CPU to an in-process IdP.",
+    )
+    args = parser.parse_args(argv)
+
+    username, password = args.username, args.password
+    if username is None or password is None:
+        if not settings.saml_idp_users:
+            parser.error("--username and --password are required without users.")
+        user = settings.saml_idp_users[0]
+        username = username or user["username"]
+        password = password or user["password"]
+
+    report = asyncio.run(
+        run_load(
+            url=args.url,
+            username=username,
+            password=password,
+            concurrency=args.concurrency,
+            flows=args.flows,
+            issuer=args.issuer,
+            acs_url=args.acs_url,
+            verify=args.verify,
+        )
+    )
+    print(format_report(report))  # noqa: T201
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,195 @@
+"""Cache of the serialized IdP metadata."""
+
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 64
+"""The most entries kept, the least recently used being dropped first."""
+
+MIN_REFRESH_INTERVAL = 1.0
+"""The shortest time between background refreshes, in seconds."""
+
+
+class CachedMetadata(NamedTuple):
+    """Serialized metadata, ready to be served."""
+
+    body: bytes
+    gzipped: bytes
+    etag: str
+    expires: float
+    """When the entry goes stale, in `time.monotonic` seconds."""
+
+    def max_age(self) -> int:
+        """Return the number of seconds the entry stays fresh."""
+        return max(0, int(self.expires - time.monotonic()))
+
+
+class MetadataCache:
+    """
+    A cache of serialized metadata, keyed by the URLs it contains.
+
+    Unless a base URL is configured, the URLs follow the request's Host header,
+    so the number of entries is capped, dropping the least recently used.
+
+    SPs poll the metadata often, but it only changes when the certificate
+    changes or the entry goes stale and `validUntil` is pushed out again.
+    Each stale entry is regenerated by one thread at a time. Entries can also be
+    refreshed in the background, so requests never have to build them.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES) -> None:
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, CachedMetadata] = OrderedDict()
+        self._builders: dict[Hashable, Callable[[], bytes]] = {}
+        self._building: dict[Hashable, threading.Lock] = {}
+        """The locks of the entries being built, so each is built once at a time."""
+        self._used: dict[Hashable, float] = {}
+        """When each entry was last returned, in `time.monotonic` seconds."""
+        self._material: Hashable = None
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: Hashable,
+        material: Hashable,
+        build: Callable[[], bytes],
+        max_age: float,
+    ) -> CachedMetadata:
+        """
+        Return the cached metadata for a key, building it if needed.
+
+        When `material` (the certificate and key) changes, every entry is dropped.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and self._material == material and entry.expires > now:
+            self._used[key] = now
+            with contextlib.suppress(KeyError):
+                # The entry may have just been dropped by another thread.
+                self._entries.move_to_end(key)
+            return entry
+        with self._lock:
+            if self._material != material:
+                self._entries.clear()
+                self._builders.clear()
+                self._used.clear()
+                self._material = material
+            key_lock = self._building.setdefault(key, threading.Lock())
+        # Build under the key's lock, so other keys can be served meanwhile.
+        with key_lock:
+            try:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry and entry.expires > time.monotonic():
+                        self._used[key] = now
+                        return entry
+                entry = _build_entry(build, max_age)
+                with self._lock:
+                    if self._material == material:
+                        self._entries[key] = entry
+                        self._entries.move_to_end(key)
+                        self._builders[key] = build
+                        self._used[key] = now
+                        while len(self._entries) > self.max_entries:
+                            self._drop(next(iter(self._entries)))
+                return entry
+            finally:
+                with self._lock:
+                    if self._building.get(key) is key_lock:
+                        del self._building[key]
+
+    def _drop(self, key: Hashable) -> None:
+        """Drop an entry and its builder. The lock must be held."""
+        self._entries.pop(key, None)
+        self._builders.pop(key, None)
+        self._used.pop(key, None)
+
+    def refresh(self, max_age: float) -> None:
+        """
+        Rebuild the entries used in the last `max_age` seconds.
+
+        Each entry is replaced once it's ready. The other entries are dropped,
+        so hosts that stop asking for the metadata aren't signed for forever.
+        """
+        cutoff = time.monotonic() - max_age
+        with self._lock:
+            for key in self._used.keys() | self._builders.keys():
+                if key not in self._builders or self._used.get(key, -math.inf) < cutoff:
+                    self._drop(key)
+        for key, build in list(self._builders.items()):
+            entry = _build_entry(build, max_age)
+            with self._lock:
+                if self._builders.get(key) is build:
+                    self._entries[key] = entry
+
+    async def refresh_periodically(self, max_age: float) -> None:
+        """
+        Refresh the entries in a thread at half their max age, forever.
+
+        The refreshes are at least `MIN_REFRESH_INTERVAL` apart, even if the
+        max age is shorter.
+        """
+        while True:
+            await asyncio.sleep(max(max_age / 2, MIN_REFRESH_INTERVAL))
+            try:
+                await asyncio.to_thread(self.refresh, max_age)
+            except Exception:
+                logger.exception("Unable to refresh the metadata.")
+
+    def clear(self) -> None:
+        """Drop all the entries."""
+        with self._lock:
+            self._entries.clear()
+            self._builders.clear()
+            self._used.clear()
+
+
+def _build_entry(build: Callable[[], bytes], max_age: float) -> CachedMetadata:
+    """Build and compress the metadata."""
+    body = build()
+    return CachedMetadata(
+        body=body,
+        gzipped=gzip.compress(body),
+        etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        expires=time.monotonic() + max_age,
+    )
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    """Return whether an Accept-Encoding header allows gzip, by its q-values."""
+    qualities: dict[str, float] = {}
+    for item in (accept_encoding or "").split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Return whether an If-None-Match header matches an ETag."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags or "*" in tags
+
+
+metadata_cache = MetadataCache()
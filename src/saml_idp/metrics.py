@@ -0,0 +1,139 @@
+"""Latency histograms and counters, in the Prometheus text format."""
+
+import bisect
+import math
+import time
+from collections.abc import Iterable
+from contextvars import ContextVar
+from typing import Literal, NamedTuple
+
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+"""The upper bounds of the histogram buckets, in seconds."""
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"""The content type of the Prometheus text format."""
+
+request_timings: ContextVar[dict[str, float] | None] = ContextVar(
+    "request_timings", default=None
+)
+"""
+The time spent in each stage by the current request, if it's being collected.
+
+Every value observed by a histogram is also added here, under its name.
+"""
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets.
+
+    Observing a value only increments a bucket count and a sum, so it doesn't
+    allocate unless the request's timings are being collected. Updates aren't
+    locked: they almost all happen on the event loop, and a racing update
+    from another thread can at worst be lost, which is fine for metrics.
+    """
+
+    __slots__ = ("buckets", "counts", "name", "sum")
+
+    def __init__(self, name: str, buckets: tuple[float, ...] = BUCKETS) -> None:
+        """Create an empty histogram."""
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        """The number of values in each bucket, the last being for the overflow."""
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """Record a value."""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        timings = request_timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + seconds
+
+    def observe_since(self, start: float) -> None:
+        """Record the time since `start`, a `time.perf_counter()` value."""
+        self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self) -> int:
+        """Return the number of values recorded."""
+        return sum(self.counts)
+
+    def clear(self) -> None:
+        """Forget every value."""
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+
+class Sample(NamedTuple):
+    """A single counter or gauge value."""
+
+    name: str
+    kind: Literal["counter", "gauge"]
+    help: str
+    value: float
+
+
+STAGES: dict[str, Histogram] = {}
+"""The latency histograms of the stages of handling a request, by name."""
+
+
+def stage(name: str) -> Histogram:
+    """Return the latency histogram of a stage, creating it the first time."""
+    if (histogram := STAGES.get(name)) is None:
+        histogram = STAGES[name] = Histogram(name)
+    return histogram
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if math.isinf(value) else str(value)
+
+
+def render_metrics(samples: Iterable[Sample] = ()) -> str:
+    """Render the stage histograms and other samples in the Prometheus text format."""
+    lines = [
+        "# HELP saml_idp_stage_seconds Time spent in each stage of handling requests.",
+        "# TYPE saml_idp_stage_seconds histogram",
+    ]
+    for name, histogram in sorted(STAGES.items()):
+        cumulative = 0
+        for bound, count in zip(
+            (*histogram.buckets, math.inf), histogram.counts, strict=True
+        ):
+            cumulative += count
+            lines.append(
+                f'saml_idp_stage_seconds_bucket{{stage="{name}",'
+                f'le="{_format_value(bound)}"}} {cumulative}'
+            )
+        lines.extend(
+            (
+                f'saml_idp_stage_seconds_sum{{stage="{name}"}} {histogram.sum!r}',
+                f'saml_idp_stage_seconds_count{{stage="{name}"}} {cumulative}',
+            )
+        )
+    for sample in samples:
+        lines.extend(
+            (
+                f"# HELP {sample.name} {sample.help}",
+                f"# TYPE {sample.name} {sample.kind}",
+                f"{sample.name} {_format_value(sample.value)}",
+            )
+        )
+    return "\n".join(lines) + "\n"
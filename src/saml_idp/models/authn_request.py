@@ -3,9 +3,16 @@
 from datetime import datetime
 from typing import Annotated, Any
 
-from pydantic import HttpUrl, PlainValidator, TypeAdapter
+from pydantic import HttpUrl, PlainValidator
 
-from saml_idp.utils import get_elem_from_path, inflate_and_decode
+from saml_idp.models.decoder import (
+    SAML_NS,
+    RequestDecoder,
+    parse_datetime,
+    parse_str,
+    parse_url,
+)
+from saml_idp.utils import CUTOFF
 
 
 # This cannot be a pydantic model, otherwise FastAPI doesn't allow it in a query param
@@ -19,33 +26,24 @@ class AuthnRequest:
     issuer: str
 
 
-DateTimeValidate = TypeAdapter(datetime)
-HttpUrlValidate = TypeAdapter(HttpUrl)
+decoder = RequestDecoder(
+    AuthnRequest,
+    "AuthnRequest",
+    "an authn request",
+    attributes={
+        "ID": ("id", parse_str),
+        "IssueInstant": ("issue_instant", parse_datetime),
+        "AssertionConsumerServiceURL": ("assertion_consumer_service_url", parse_url),
+        "Destination": ("destination", parse_url),
+    },
+    children={SAML_NS + "Issuer": "issuer"},
+    expires=lambda req: (req.issue_instant + CUTOFF).timestamp(),
+)
 
 
 def validate_authn_request(data: Any) -> AuthnRequest:
     """Decode and parse SAML request XML."""
-    tree = inflate_and_decode(data)
-    # Get the attributes from the authnrequest
-    if tree.tag != "{urn:oasis:names:tc:SAML:2.0:protocol}AuthnRequest":
-        msg = "Not an authn request."
-        raise ValueError(msg)
-
-    req = AuthnRequest()
-    req.id = tree.get("ID")
-    req.issue_instant = DateTimeValidate.validate_python(tree.get("IssueInstant"))
-    req.assertion_consumer_service_url = HttpUrlValidate.validate_python(
-        tree.get("AssertionConsumerServiceURL"),
-    )
-    req.destination = HttpUrlValidate.validate_python(tree.get("Destination"))
-
-    elems = get_elem_from_path(tree, "/saml2p:AuthnRequest/saml2:Issuer")
-    if len(elems) > 0:
-        req.issuer = elems[0].text
-    else:
-        msg = "No issuer found in request"
-        raise ValueError(msg)
-    return req
+    return decoder.decode(data)
 
 
 AuthnRequestField = Annotated[AuthnRequest, PlainValidator(validate_authn_request)]
@@ -1,22 +1,37 @@
 """Model for SAML Authn Response."""
 
+import copy
+import time
 import uuid
 from datetime import datetime
 
 from lxml import etree
 from pydantic import BaseModel, HttpUrl
-from signxml import CanonicalizationMethod, XMLSigner
 
 from saml_idp import Settings
+from saml_idp.metrics import stage
+from saml_idp.signing import SigningContext, get_signing_context
 from saml_idp.utils import DS, SAML, SAMLP, encode_response, saml2_timestamp
 
+_build_stage = stage("build")
+
+MAX_SKELETONS = 1024
+"""The maximum number of assertion skeletons to cache."""
+
+# Unsigned assertions keyed by the parts that don't change between responses
+# to the same SP for the same user.
+_skeletons: dict[
+    tuple[str, str, str, str, tuple[tuple[str, str], ...], str, bool], etree
+] = {}
+
 
 class AuthnResponse(BaseModel):
     """The response to an Authn request."""
 
     issue_instant: datetime
     destination: HttpUrl
-    in_response_to: str
+    in_response_to: str | None
+    """The ID of the request, or None for an unsolicited (IdP-initiated) response."""
     issuer: HttpUrl
     status_code: str
     subject_name_id_format: str
@@ -32,20 +47,46 @@ class AuthnResponse(BaseModel):
 
     def to_xml(self, settings: Settings) -> etree:
         """Build an XML file from the model."""
+        signing_context = get_signing_context(
+            settings.saml_idp_metadata_key,
+            settings.saml_idp_metadata_cert,
+        )
+        return self.to_signed_xml(signing_context)
+
+    def to_signed_xml(self, signing_context: SigningContext) -> etree:
+        """Build an XML file from the model, signed with a loaded context."""
+        start = time.perf_counter()
         issue_instant = saml2_timestamp(self.issue_instant)
         response_attrs = {
             "ID": f"_{uuid.uuid4()}",
             "Version": "2.0",
-            "InResponseTo": self.in_response_to,
+            **self._in_response_to_attrs(),
             "IssueInstant": issue_instant,
             "Destination": str(self.destination),
         }
         status = SAMLP.Status(SAMLP.StatusCode(Value=self.status_code))
+        assertion = self.fill_assertion(f"_{uuid.uuid4()}", issue_instant)
+        built = time.perf_counter()
+        signed_assertion = signing_context.sign(assertion)
+        signed = time.perf_counter()
+
+        response = SAMLP.Response(
+            SAML.Issuer(str(self.issuer)),
+            status,
+            signed_assertion,
+            **response_attrs,
+        )
+        # The signature is timed separately.
+        _build_stage.observe(built - start + time.perf_counter() - signed)
+        return response
+
+    def build_assertion(self, assertion_id: str, issue_instant: str) -> etree:
+        """Build the unsigned assertion from scratch."""
         subject = SAML.Subject(
             SAML.NameID(self.subject_name_id, Format=self.subject_name_id_format),
             SAML.SubjectConfirmation(
                 SAML.SubjectConfirmationData(
-                    InResponseTo=self.in_response_to,
+                    **self._in_response_to_attrs(),
                     NotOnOrAfter=saml2_timestamp(self.subject_not_on_or_after),
                     Recipient=str(self.destination),
                 ),
@@ -57,7 +98,6 @@ class AuthnResponse(BaseModel):
             NotBefore=saml2_timestamp(self.conditions_not_before),
             NotOnOrAfter=saml2_timestamp(self.conditions_not_on_or_after),
         )
-        assertion_id = f"_{uuid.uuid4()}"
         authn_statement = SAML.AuthnStatement(
             SAML.AuthnContext(SAML.AuthnContextClassRef(self.authn_context_class_ref)),
             AuthnInstant=saml2_timestamp(self.authn_instant),
@@ -72,7 +112,7 @@ class AuthnResponse(BaseModel):
         else:
             attr_statement = []
 
-        assertion = SAML.Assertion(
+        return SAML.Assertion(
             SAML.Issuer(str(self.issuer)),
             DS.Signature(Id="placeholder"),
             subject,
@@ -83,21 +123,56 @@ class AuthnResponse(BaseModel):
             Version="2.0",
             IssueInstant=issue_instant,
         )
-        signer = XMLSigner(
-            c14n_algorithm=CanonicalizationMethod.EXCLUSIVE_XML_CANONICALIZATION_1_0,
-        )
-        signed_assertion = signer.sign(
-            assertion,
-            key=settings.saml_idp_metadata_key,
-            cert=settings.saml_idp_metadata_cert,
+
+    def fill_assertion(self, assertion_id: str, issue_instant: str) -> etree:
+        """
+        Build the unsigned assertion from a cached skeleton.
+
+        Most of the assertion only depends on the SP and the user, so it's built
+        once and copied. Only the IDs, timestamps, InResponseTo, Recipient and
+        SessionIndex are filled in. The result is identical to `build_assertion`.
+        """
+        key = (
+            str(self.issuer),
+            self.subject_name_id_format,
+            self.subject_name_id,
+            self.audience_restriction,
+            tuple(self.attributes.items()),
+            self.authn_context_class_ref,
+            self.in_response_to is None,
         )
+        skeleton = _skeletons.get(key)
+        if skeleton is None:
+            skeleton = self.build_assertion(assertion_id, issue_instant)
+            if len(_skeletons) >= MAX_SKELETONS:
+                del _skeletons[next(iter(_skeletons))]
+            _skeletons[key] = skeleton
 
-        return SAMLP.Response(
-            SAML.Issuer(str(self.issuer)),
-            status,
-            signed_assertion,
-            **response_attrs,
+        assertion = copy.deepcopy(skeleton)
+        assertion.set("ID", assertion_id)
+        assertion.set("IssueInstant", issue_instant)
+        # The children are Issuer, Signature, Subject, Conditions,
+        # an optional AttributeStatement and AuthnStatement.
+        confirmation_data = assertion[2][1][0]
+        if self.in_response_to is not None:
+            confirmation_data.set("InResponseTo", self.in_response_to)
+        confirmation_data.set(
+            "NotOnOrAfter", saml2_timestamp(self.subject_not_on_or_after)
         )
+        confirmation_data.set("Recipient", str(self.destination))
+        conditions = assertion[3]
+        conditions.set("NotBefore", saml2_timestamp(self.conditions_not_before))
+        conditions.set("NotOnOrAfter", saml2_timestamp(self.conditions_not_on_or_after))
+        authn_statement = assertion[-1]
+        authn_statement.set("AuthnInstant", saml2_timestamp(self.authn_instant))
+        authn_statement.set("SessionIndex", self.session_index)
+        return assertion
+
+    def _in_response_to_attrs(self) -> dict[str, str]:
+        """Return the InResponseTo attribute, if the response is solicited."""
+        if self.in_response_to is None:
+            return {}
+        return {"InResponseTo": self.in_response_to}
 
     def to_response(self, settings: Settings) -> str:
         """Generate an XML response."""
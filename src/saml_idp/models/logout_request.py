@@ -3,9 +3,17 @@
 from datetime import datetime
 from typing import Annotated, Any
 
-from pydantic import HttpUrl, PlainValidator, TypeAdapter
+from pydantic import HttpUrl, PlainValidator
 
-from saml_idp.utils import get_elem_from_path, inflate_and_decode
+from saml_idp.models.decoder import (
+    SAML_NS,
+    SAMLP_NS,
+    RequestDecoder,
+    parse_datetime,
+    parse_str,
+    parse_url,
+)
+from saml_idp.utils import CUTOFF
 
 
 # This cannot be a pydantic model, otherwise FastAPI doesn't allow it in a query param
@@ -21,45 +29,30 @@ class LogoutRequest:
     session_index: str
 
 
-DateTimeValidate = TypeAdapter(datetime)
-HttpUrlValidate = TypeAdapter(HttpUrl)
+decoder = RequestDecoder(
+    LogoutRequest,
+    "LogoutRequest",
+    "a logout request",
+    attributes={
+        "ID": ("id", parse_str),
+        "IssueInstant": ("issue_instant", parse_datetime),
+        "NotOnOrAfter": ("not_on_or_after", parse_datetime),
+        "Destination": ("destination", parse_url),
+    },
+    children={
+        SAML_NS + "Issuer": "issuer",
+        SAML_NS + "NameID": "name_id",
+        SAMLP_NS + "SessionIndex": "session_index",
+    },
+    expires=lambda req: min(
+        (req.issue_instant + CUTOFF).timestamp(), req.not_on_or_after.timestamp()
+    ),
+)
 
 
 def validate_logout_request(data: Any) -> LogoutRequest:
     """Decode and parse SAML request XML."""
-    tree = inflate_and_decode(data)
-    if tree.tag != "{urn:oasis:names:tc:SAML:2.0:protocol}LogoutRequest":
-        msg = "Not a logout request."
-        raise ValueError(msg)
-
-    req = LogoutRequest()
-    req.id = tree.get("ID")
-    req.issue_instant = DateTimeValidate.validate_python(tree.get("IssueInstant"))
-    req.not_on_or_after = DateTimeValidate.validate_python(tree.get("NotOnOrAfter"))
-    req.destination = HttpUrlValidate.validate_python(tree.get("Destination"))
-
-    elems = get_elem_from_path(tree, "/saml2p:LogoutRequest/saml2:Issuer")
-    if len(elems) > 0:
-        req.issuer = elems[0].text
-    else:
-        msg = "No issuer found in request"
-        raise ValueError(msg)
-
-    elems = get_elem_from_path(tree, "/saml2p:LogoutRequest/saml2:NameID")
-    if len(elems) > 0:
-        req.name_id = elems[0].text
-    else:
-        msg = "No name_id found in request"
-        raise ValueError(msg)
-
-    elems = get_elem_from_path(tree, "/saml2p:LogoutRequest/saml2p:SessionIndex")
-    if len(elems) > 0:
-        req.session_index = elems[0].text
-    else:
-        msg = "No session_index found in request"
-        raise ValueError(msg)
-
-    return req
+    return decoder.decode(data)
 
 
 LogoutRequestField = Annotated[LogoutRequest, PlainValidator(validate_logout_request)]
@@ -1,13 +1,17 @@
 """SAML2 Logout Response model."""
 
+import time
 import uuid
 from datetime import datetime
 
 from lxml import etree
 from pydantic import BaseModel, HttpUrl
 
+from saml_idp.metrics import stage
 from saml_idp.utils import SAML, SAMLP, encode_response, saml2_timestamp
 
+_build_stage = stage("build")
+
 
 class LogoutResponse(BaseModel):
     """The response to a Logout request."""
@@ -20,6 +24,7 @@ class LogoutResponse(BaseModel):
 
     def to_xml(self) -> etree:
         """Build an XML file from the model."""
+        start = time.perf_counter()
         issue_instant = saml2_timestamp(self.issue_instant)
         response_attrs = {
             "ID": f"_{uuid.uuid4()}",
@@ -30,7 +35,9 @@ class LogoutResponse(BaseModel):
         }
         issuer = SAML.Issuer(self.issuer)
         status = SAMLP.Status(SAMLP.StatusCode(Value=self.status_code))
-        return SAMLP.LogoutResponse(issuer, status, **response_attrs)
+        response = SAMLP.LogoutResponse(issuer, status, **response_attrs)
+        _build_stage.observe_since(start)
+        return response
 
     def to_response(self) -> str:
         """Generate an XML response."""
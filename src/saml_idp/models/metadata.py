@@ -1,5 +1,6 @@
 """SAML metadata model."""
 
+import uuid
 from datetime import datetime
 
 import signxml
@@ -14,6 +15,10 @@ META = ElementMaker(
     nsmap={None: "urn:oasis:names:tc:SAML:2.0:metadata"},
 )
 DS = ElementMaker(namespace=signxml.namespaces.ds, nsmap={"ds": signxml.namespaces.ds})
+ALG = ElementMaker(
+    namespace="urn:oasis:names:tc:SAML:metadata:algsupport",
+    nsmap={"alg": "urn:oasis:names:tc:SAML:metadata:algsupport"},
+)
 
 
 class SamlMetadata(BaseModel):
@@ -24,6 +29,8 @@ class SamlMetadata(BaseModel):
     logout_url: str
     valid_until: datetime
     cert: str
+    signing_method: str = ""
+    signed: bool = False
 
     def to_xml(self) -> etree:
         """Serialize to XML."""
@@ -40,7 +47,14 @@ class SamlMetadata(BaseModel):
             Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect",
             Location=self.signon_url,
         )
+        # Advertise the signature algorithm, since it depends on the key type.
+        extensions = (
+            [META.Extensions(ALG.SigningMethod(Algorithm=self.signing_method))]
+            if self.signing_method
+            else []
+        )
         sso_desc = META.IDPSSODescriptor(
+            *extensions,
             key_desc,
             logout,
             name_id,
@@ -48,6 +62,15 @@ class SamlMetadata(BaseModel):
             WantAuthnRequestsSigned="false",
             protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol",
         )
+        if self.signed:
+            # The placeholder is replaced by an enveloped signature.
+            return META.EntityDescriptor(
+                DS.Signature(Id="placeholder"),
+                sso_desc,
+                ID=f"_{uuid.uuid4()}",
+                validUntil=saml2_timestamp(self.valid_until),
+                entityID=self.entity_id,
+            )
         return META.EntityDescriptor(
             sso_desc,
             validUntil=saml2_timestamp(self.valid_until),
@@ -0,0 +1,250 @@
+"""Sampled profiling of live requests, with the standard library's profiler."""
+
+import cProfile
+import logging
+import marshal
+import pstats
+import random
+import time
+from collections import Counter
+from collections.abc import Callable, Coroutine
+from typing import Any, Self
+
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field, model_validator
+from starlette.requests import Request
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PATH = "/admin/profile"
+"""The path of the endpoints that control profiling."""
+
+MAX_STACK_DEPTH = 64
+"""The deepest stack reconstructed for the collapsed-stack output."""
+
+MIN_STACK_MICROSECONDS = 1
+"""Stacks with less time than this are dropped from the collapsed-stack output."""
+
+type Handler = Callable[[Request], Coroutine[Any, Any, Response]]
+type FunctionKey = tuple[str, int, str]
+
+
+class ProfilingRequest(BaseModel):
+    """What to profile: the next `requests` requests, or a sample for `seconds`."""
+
+    requests: int | None = Field(default=None, ge=1)
+    rate: float = Field(default=1.0, gt=0, le=1)
+    """The fraction of requests that are profiled."""
+    seconds: float | None = Field(default=None, gt=0)
+
+    @model_validator(mode="after")
+    def _check_limit(self) -> Self:
+        if self.requests is None and self.seconds is None:
+            msg = "Either requests or seconds is required."
+            raise ValueError(msg)
+        return self
+
+
+class ProfilingStatus(BaseModel):
+    """Whether requests are being profiled, and the profiles collected so far."""
+
+    active: bool
+    remaining: int | None
+    """How many more requests will be profiled, if limited."""
+    seconds_left: float | None
+    """How long until profiling stops, if limited."""
+    rate: float
+    routes: dict[str, int]
+    """How many requests were profiled for each route."""
+
+
+class RequestProfiler:
+    """
+    Profile a sample of requests, aggregating the profiles by route.
+
+    Only one request is profiled at a time, since the profiler can't be
+    enabled twice in the same thread; requests that arrive while another is
+    profiled aren't sampled. Other requests that run on the event loop while a
+    profiled request awaits are included in its profile.
+
+    While profiling is off, checking whether to profile a request is a single
+    attribute lookup.
+    """
+
+    def __init__(self) -> None:
+        """Create a profiler that's off."""
+        self.active = False
+        self._remaining: int | None = None
+        self._until: float | None = None
+        self._rate = 1.0
+        self._busy = False
+        self._stats: dict[str, pstats.Stats] = {}
+        self._counts: Counter[str] = Counter()
+
+    def start(self, config: ProfilingRequest) -> None:
+        """Start profiling. The profiles collected so far are kept."""
+        self._remaining = config.requests
+        self._until = (
+            None if config.seconds is None else time.monotonic() + config.seconds
+        )
+        self._rate = config.rate
+        self.active = True
+        logger.info("Started profiling requests: %s", config)
+
+    def stop(self) -> None:
+        """Stop profiling. The profiles collected so far are kept."""
+        self.active = False
+
+    def clear(self) -> None:
+        """Stop profiling, and drop the profiles."""
+        self.stop()
+        self._stats.clear()
+        self._counts.clear()
+
+    def _sample(self) -> bool:
+        """Return whether to profile a request, updating the limits."""
+        if self._busy or not self.active:
+            return False
+        if self._until is not None and time.monotonic() >= self._until:
+            self.stop()
+            return False
+        if random.random() >= self._rate:  # noqa: S311
+            return False
+        if self._remaining is not None:
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self.stop()
+        return True
+
+    async def run(self, route: str, handler: Handler, request: Request) -> Response:
+        """Handle a request, profiling it if it's sampled."""
+        if not self._sample():
+            return await handler(request)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active, such as a debugger's.
+            return await handler(request)
+        self._busy = True
+        try:
+            return await handler(request)
+        finally:
+            profile.disable()
+            self._busy = False
+            self._add(route, profile)
+
+    def _add(self, route: str, profile: cProfile.Profile) -> None:
+        if stats := self._stats.get(route):
+            stats.add(profile)
+        else:
+            self._stats[route] = pstats.Stats(profile)
+        self._counts[route] += 1
+
+    def status(self) -> ProfilingStatus:
+        """Return whether requests are being profiled, and the profiles so far."""
+        if self.active and self._until is not None and time.monotonic() >= self._until:
+            self.stop()
+        return ProfilingStatus(
+            active=self.active,
+            remaining=self._remaining if self.active else None,
+            seconds_left=(
+                max(self._until - time.monotonic(), 0.0)
+                if self.active and self._until is not None
+                else None
+            ),
+            rate=self._rate,
+            routes=dict(self._counts),
+        )
+
+    def stats(self, route: str | None = None) -> pstats.Stats | None:
+        """Return the profile of a route, or of every route, if there is one."""
+        if route is not None:
+            return self._stats.get(route)
+        if not self._stats:
+            return None
+        combined = pstats.Stats()
+        for stats in self._stats.values():
+            combined.add(stats)
+        return combined
+
+
+def dump_pstats(stats: pstats.Stats) -> bytes:
+    """Serialize a profile in the format of `pstats.Stats.dump_stats`."""
+    return marshal.dumps(stats.stats)  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def _frame_name(function: FunctionKey) -> str:
+    return pstats.func_std_string(function).replace(";", ":")
+
+
+def dump_collapsed(stats: pstats.Stats) -> str:
+    """
+    Serialize a profile as collapsed stacks, for flame graph tools.
+
+    The profiler only records which function called which, so the stacks are
+    reconstructed from the call graph: each function's own time is split
+    between its callers in proportion to the time spent under each. Times are
+    in microseconds.
+    """
+    entries: dict[FunctionKey, tuple[Any, ...]] = stats.stats  # pyright: ignore[reportAttributeAccessIssue]
+    stacks: Counter[str] = Counter()
+
+    def walk(function: FunctionKey, path: list[FunctionKey], micros: float) -> None:
+        callers = entries.get(function, (0, 0, 0, 0, {}))[4]
+        total = sum(timing[3] for timing in callers.values())
+        if not callers or total <= 0 or len(path) >= MAX_STACK_DEPTH:
+            stacks[";".join(_frame_name(f) for f in reversed(path))] += micros
+            return
+        for caller, timing in callers.items():
+            share = micros * timing[3] / total
+            if share < MIN_STACK_MICROSECONDS:
+                continue
+            if caller in path:
+                # Recursion: attribute the time to the innermost call.
+                stacks[";".join(_frame_name(f) for f in reversed(path))] += share
+            else:
+                walk(caller, [*path, caller], share)
+
+    for function, (_, _, own_time, _, _) in entries.items():
+        if (micros := own_time * 1_000_000) >= MIN_STACK_MICROSECONDS:
+            walk(function, [function], micros)
+    return "".join(
+        f"{stack} {round(micros)}\n"
+        for stack, micros in sorted(stacks.items())
+        if round(micros) > 0
+    )
+
+
+request_profiler = RequestProfiler()
+
+_unprofiled_endpoints: set[Callable[..., Any]] = set()
+
+
+def unprofiled[F: Callable[..., Any]](endpoint: F) -> F:
+    """
+    Mark an endpoint as never profiled, such as the ones that control profiling.
+
+    It's decided when the route is defined, so it holds under any router prefix.
+    """
+    _unprofiled_endpoints.add(endpoint)
+    return endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """A route whose requests can be profiled by the request profiler."""
+
+    def get_route_handler(self) -> Handler:
+        """Return the route's handler, profiling the requests that are sampled."""
+        handler = super().get_route_handler()
+        if self.endpoint in _unprofiled_endpoints:
+            return handler
+        path = self.path
+
+        async def profiled_handler(request: Request) -> Response:
+            if not request_profiler.active:
+                return await handler(request)
+            return await request_profiler.run(path, handler, request)
+
+        return profiled_handler
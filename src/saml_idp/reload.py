@@ -0,0 +1,126 @@
+"""Hot reloading of the users."""
+
+import asyncio
+import logging
+import time
+from pathlib import Path
+
+from pydantic import Json
+from pydantic_settings import BaseSettings
+
+from .config import Settings, User, build_user_sources
+from .users import UserSource
+
+logger = logging.getLogger(__name__)
+
+
+class UserSettings(BaseSettings):
+    """The settings that define the users, read again from the environment."""
+
+    saml_idp_users: Json[list[User]] | None = None
+    saml_idp_users_file: str = ""
+
+    model_config = Settings.model_config
+
+
+class UserReloader:
+    """
+    Reload the users when the users file or `.env` changes.
+
+    Changes are detected by polling modification times. The new users are
+    read and indexed in a thread, then swapped in at once, so requests never
+    see a partly built index.
+    """
+
+    def __init__(self, settings: Settings, env_file: str | None = None) -> None:
+        """Start watching the current files. `env_file` defaults to the settings'."""
+        self._settings = settings
+        env_file = env_file or settings.model_config.get("env_file")
+        self._env_file = Path(str(env_file)) if env_file else None
+        self._mtimes = self._snapshot()
+        self.last_duration: float | None = None
+        """How long the last reload took, in seconds."""
+
+    def _paths(self) -> list[Path]:
+        paths = [self._env_file] if self._env_file else []
+        if self._settings.saml_idp_users_file:
+            paths.append(Path(self._settings.saml_idp_users_file))
+        return paths
+
+    def _snapshot(self) -> dict[Path, tuple[int, int] | None]:
+        return {path: _stat(path) for path in self._paths()}
+
+    async def check(self) -> bool:
+        """Reload the users if a file changed. Return whether they were reloaded."""
+        mtimes = await asyncio.to_thread(self._snapshot)
+        if mtimes == self._mtimes:
+            return False
+        start = time.perf_counter()
+        env_changed = self._env_file is not None and mtimes.get(
+            self._env_file
+        ) != self._mtimes.get(self._env_file)
+        users, users_file, sources, mtimes = await asyncio.to_thread(
+            self._load, mtimes, env_changed=env_changed
+        )
+        self._settings.replace_users(users, users_file, sources)
+        await self._settings.reindex_users()
+        # The times are from before the files were read, so a write made
+        # during the reload is picked up by the next check.
+        self._mtimes = mtimes
+        self.last_duration = time.perf_counter() - start
+        logger.info(
+            "Reloaded %d users in %.3fs",
+            sum(len(source) for source in sources),
+            self.last_duration,
+        )
+        return True
+
+    def _load(
+        self, mtimes: dict[Path, tuple[int, int] | None], *, env_changed: bool
+    ) -> tuple[
+        list[User] | None,
+        str,
+        tuple[UserSource, ...],
+        dict[Path, tuple[int, int] | None],
+    ]:
+        """
+        Read and index the users, reading them from the environment if it changed.
+
+        Also return the times of the files to watch from now on, which are
+        `mtimes` unless the environment points at another users file.
+        """
+        users = self._settings.saml_idp_users
+        users_file = self._settings.saml_idp_users_file
+        if env_changed:
+            user_settings = UserSettings(_env_file=self._env_file)  # pyright: ignore[reportCallIssue]
+            users = user_settings.saml_idp_users
+            users_file = user_settings.saml_idp_users_file
+        if users_file != self._settings.saml_idp_users_file:
+            # Watch the new file, as it is before it's read.
+            mtimes = {
+                path: mtime for path, mtime in mtimes.items() if path == self._env_file
+            }
+            if users_file:
+                mtimes[Path(users_file)] = _stat(Path(users_file))
+        sources = build_user_sources(
+            users, users_file, self._settings.saml_idp_synthetic_users
+        )
+        return users, users_file, sources, mtimes
+
+    async def watch(self, interval: float) -> None:
+        """Check for changes every `interval` seconds, forever."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Unable to reload the users.")
+
+
+def _stat(path: Path) -> tuple[int, int] | None:
+    """Return the modification time and size of a file, or None if it's missing."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,98 @@
+"""Detection of replayed SAML request IDs."""
+
+import logging
+import time
+
+from .utils import CUTOFF
+
+logger = logging.getLogger(__name__)
+
+WHEEL_SLOTS = 60
+"""How many buckets the window is split into."""
+
+MAX_ENTRIES = 5_000_000
+"""The maximum number of IDs remembered at once."""
+
+
+class ReplayCache:
+    """
+    Remember the request IDs seen over a time window, in a hashed timing wheel.
+
+    The window is split into `slots` buckets. Each ID goes into the bucket for
+    the current tick, and when the wheel turns, the buckets that fall out of
+    the window are dropped whole. Checking and adding an ID are O(1), and
+    expiring IDs is amortized O(1), since each ID is dropped exactly once.
+
+    IDs are remembered for at least `window` seconds, and at most one tick
+    longer. If there are more than `max_entries` IDs, the oldest buckets are
+    dropped early, so memory stays bounded under a flood of requests.
+    """
+
+    def __init__(
+        self,
+        window: float = CUTOFF.total_seconds(),
+        slots: int = WHEEL_SLOTS,
+        max_entries: int = MAX_ENTRIES,
+    ) -> None:
+        """Create an empty wheel."""
+        self._tick_length = window / slots
+        self._buckets: list[list[str]] = [[] for _ in range(slots + 1)]
+        self._seen: set[str] = set()
+        self._tick = -1
+        self._max_entries = max_entries
+
+    def __len__(self) -> int:
+        """Return the number of remembered IDs."""
+        return len(self._seen)
+
+    def add(self, issuer: str, request_id: str, now: float | None = None) -> bool:
+        """
+        Remember a request ID from an issuer.
+
+        Return False if it was already seen within the window.
+        """
+        self._advance(time.monotonic() if now is None else now)
+        key = f"{issuer}\n{request_id}"
+        if key in self._seen:
+            return False
+        if len(self._seen) >= self._max_entries:
+            logger.warning("The replay cache is full, expiring IDs early.")
+            self._expire_oldest()
+        self._seen.add(key)
+        self._buckets[self._tick % len(self._buckets)].append(key)
+        return True
+
+    def _advance(self, now: float) -> None:
+        """Turn the wheel to the current tick, emptying the buckets it passes."""
+        tick = int(now / self._tick_length)
+        if tick <= self._tick:
+            return
+        # A bucket that's about to be reused holds IDs from a full turn ago.
+        slots = len(self._buckets)
+        for passed in range(self._tick + 1, min(tick, self._tick + slots) + 1):
+            self._drop(passed % slots)
+        self._tick = tick
+
+    def _expire_oldest(self) -> None:
+        """Empty the oldest non-empty bucket."""
+        slots = len(self._buckets)
+        for age in range(slots - 1, -1, -1):
+            index = (self._tick - age) % slots
+            if self._buckets[index]:
+                self._drop(index)
+                return
+
+    def _drop(self, index: int) -> None:
+        """Forget the IDs in a bucket."""
+        bucket = self._buckets[index]
+        self._seen.difference_update(bucket)
+        bucket.clear()
+
+    def clear(self) -> None:
+        """Forget every ID."""
+        for bucket in self._buckets:
+            bucket.clear()
+        self._seen.clear()
+
+
+replay_cache = ReplayCache()
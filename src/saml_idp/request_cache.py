@@ -0,0 +1,88 @@
+"""Cache of decoded SAML requests."""
+
+import hashlib
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any, NamedTuple
+
+from .utils import CUTOFF
+
+
+class CacheStats(NamedTuple):
+    """Counters for a request cache."""
+
+    hits: int
+    misses: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the fraction of lookups that were hits."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class RequestCache:
+    """
+    A bounded LRU cache of decoded SAML requests, keyed by a digest of the request.
+
+    Browsers retrying and load tests replaying a redirect send the same
+    `SAMLRequest` many times. Entries never outlive the request's validity,
+    so a cached request is never accepted once it's out of date.
+
+    The cached objects are shared, so they must not be modified.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty cache."""
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get[T](
+        self,
+        kind: str,
+        data: str | bytes,
+        decode: Callable[[], T],
+        expires: Callable[[T], float],
+        max_size: int,
+    ) -> T:
+        """
+        Return the decoded request, decoding it on a miss.
+
+        `expires` returns the POSIX timestamp at which a request stops being
+        valid. Requests that fail to decode aren't cached.
+        """
+        raw = data.encode() if isinstance(data, str) else data
+        key = (kind, hashlib.blake2b(raw, digest_size=16).digest())
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+
+        self.misses += 1
+        value = decode()
+        expiry = min(expires(value), now + CUTOFF.total_seconds())
+        if expiry > now:
+            self._entries[key] = (expiry, value)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> CacheStats:
+        """Return the cache's counters."""
+        return CacheStats(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def clear(self) -> None:
+        """Drop all the entries and reset the counters."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+request_cache = RequestCache()
@@ -1,21 +1,31 @@
 """SAML IdP Router."""
 
+import asyncio
 import secrets
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from datetime import UTC, datetime, timedelta
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Any, Literal
 from urllib.parse import urljoin
 
-from fastapi import APIRouter, Form, Query
+from fastapi import APIRouter, Cookie, FastAPI, Form, HTTPException, Query
 from lxml import etree
 from pydantic import HttpUrl
 from starlette import status
+from starlette.datastructures import URL
 from starlette.requests import Request
 from starlette.responses import RedirectResponse, Response
 from starlette.templating import Jinja2Templates
 
+from .admin import UserChangesResult, apply_user_changes
+from .admission import OverloadedError, admission_limiter
+from .assertion_pool import assertion_pool
 from .config import Settings, User, settings
-from .dependencies import GetCsrfProtect, GetUser
+from .dependencies import GetCsrfProtect, GetUser, RequireAdmin
+from .metadata_cache import accepts_gzip, etag_matches, metadata_cache
+from .metrics import CONTENT_TYPE, Sample, render_metrics, stage
 from .models import (
     AuthnRequestField,
     AuthnResponse,
@@ -23,27 +33,72 @@ from .models import (
     LogoutResponse,
     SamlMetadata,
 )
+from .profiling import (
+    PROFILE_PATH,
+    ProfiledRoute,
+    ProfilingRequest,
+    ProfilingStatus,
+    dump_collapsed,
+    dump_pstats,
+    request_profiler,
+    unprofiled,
+)
+from .reload import UserReloader
+from .replay import replay_cache
+from .request_cache import request_cache
+from .signing import get_signing_context, signing_engine
+from .state import close_state_backends, get_state_backend
 from .urls import rel_url_for
-from .utils import is_out_of_date
+from .utils import CUTOFF, is_out_of_date
 
 template_path = Path(__file__).parent.resolve() / "templates"
 templates = Jinja2Templates(directory=str(template_path))
 
+_render_stage = stage("render")
+
 
-router = APIRouter()
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    """Start the router's background tasks, and release its resources on shutdown."""
+    if settings.saml_idp_metadata_key:
+        # Fail now if the key can't sign, rather than on the first login.
+        get_signing_context(
+            settings.saml_idp_metadata_key, settings.saml_idp_metadata_cert
+        )
+    await asyncio.to_thread(settings.load_users)
+    tasks: list[asyncio.Task[None]] = []
+    if settings.saml_idp_sign_metadata:
+        # Re-sign the metadata off the request path.
+        tasks.append(
+            asyncio.create_task(
+                metadata_cache.refresh_periodically(settings.saml_idp_metadata_max_age)
+            )
+        )
+    if (interval := settings.saml_idp_users_reload_interval) > 0:
+        tasks.append(asyncio.create_task(UserReloader(settings).watch(interval)))
+    yield
+    for task in tasks:
+        task.cancel()
+    assertion_pool.clear()
+    signing_engine.shutdown()
+    close_state_backends()
 
 
-@router.get("/metadata.xml")
-def metadata_xml(request: Request) -> Response:
-    """Return the IdP's metadata.xml."""
+router = APIRouter(lifespan=lifespan, route_class=ProfiledRoute)
+
+
+def build_metadata(signon_url: str, logout_url: str) -> bytes:
+    """Build and serialize the IdP's metadata."""
     lines = [line.strip() for line in settings.saml_idp_metadata_cert.splitlines()]
     cert = "".join(lines[1:-1])
-    if base_url := str(settings.saml_idp_base_url):
-        signon_url = urljoin(base_url, rel_url_for(request, "signin"))
-        logout_url = urljoin(base_url, rel_url_for(request, "logout"))
-    else:
-        signon_url = str(request.url_for("signin"))
-        logout_url = str(request.url_for("logout"))
+
+    signing_context = None
+    signing_method = ""
+    if settings.saml_idp_metadata_key:
+        signing_context = get_signing_context(
+            settings.saml_idp_metadata_key, settings.saml_idp_metadata_cert
+        )
+        signing_method = signing_context.signature_method.value
 
     metadata = SamlMetadata(
         entity_id=settings.saml_idp_entity_id,
@@ -51,8 +106,61 @@ def metadata_xml(request: Request) -> Response:
         logout_url=logout_url,
         valid_until=datetime.now(UTC) + timedelta(days=365),
         cert=cert,
+        signing_method=signing_method,
+        signed=settings.saml_idp_sign_metadata,
     )
-    return Response(etree.tostring(metadata.to_xml()), media_type="text/xml")
+    tree = metadata.to_xml()
+    if settings.saml_idp_sign_metadata:
+        if signing_context is None:
+            msg = "Signing the metadata requires a key."
+            raise RuntimeError(msg)
+        tree = signing_context.sign(tree)
+    return etree.tostring(tree)
+
+
+DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+
+
+def _normalize_host(url: URL) -> str:
+    """Lowercase the host and drop the default port, so equivalent hosts match."""
+    netloc = url.netloc.lower()
+    if (port := DEFAULT_PORTS.get(url.scheme)) and netloc.endswith(port):
+        netloc = netloc.removesuffix(port)
+    return str(url.replace(netloc=netloc))
+
+
+@router.get("/metadata.xml")
+def metadata_xml(request: Request) -> Response:
+    """Return the IdP's metadata.xml."""
+    if base_url := str(settings.saml_idp_base_url):
+        signon_url = urljoin(base_url, rel_url_for(request, "signin"))
+        logout_url = urljoin(base_url, rel_url_for(request, "logout"))
+    else:
+        # The URLs follow the Host header, so each host has its own entry.
+        signon_url = _normalize_host(request.url_for("signin"))
+        logout_url = _normalize_host(request.url_for("logout"))
+
+    entry = metadata_cache.get(
+        (settings.saml_idp_entity_id, signon_url, logout_url),
+        (
+            settings.saml_idp_metadata_cert,
+            settings.saml_idp_metadata_key,
+            settings.saml_idp_sign_metadata,
+        ),
+        lambda: build_metadata(signon_url, logout_url),
+        settings.saml_idp_metadata_max_age,
+    )
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"public, max-age={entry.max_age()}",
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        headers["Content-Encoding"] = "gzip"
+        return Response(entry.gzipped, media_type="text/xml", headers=headers)
+    return Response(entry.body, media_type="text/xml", headers=headers)
 
 
 @router.get("/")
@@ -69,22 +177,22 @@ async def main(request: Request, user: GetUser) -> Response:
     )
 
 
-def redir(
-    request: Request,
+def build_authn_response(
     settings: Settings,
     *,
-    saml_request_id: str,
+    saml_request_id: str | None,
     destination: str,
     request_issuer: str,
     user: User,
-    relay_state: str,
-) -> Response:
-    """Render a redirect to the SP."""
+    session_index: str | None = None,
+) -> AuthnResponse:
+    """Build a successful response for a user."""
     issue_instant = datetime.now(UTC)
     not_on_or_after = datetime.now(UTC) + timedelta(hours=1)
-    session_id = Settings.generate_session_id(user)
-    session_index = f"_{secrets.token_hex(nbytes=16)}_{session_id}"
-    authn_response = AuthnResponse(
+    if session_index is None:
+        session_id = Settings.generate_session_id(user)
+        session_index = f"_{secrets.token_hex(nbytes=16)}_{session_id}"
+    return AuthnResponse(
         issue_instant=issue_instant,
         issuer=HttpUrl(settings.saml_idp_entity_id),
         destination=HttpUrl(destination),
@@ -101,16 +209,179 @@ def redir(
         authn_context_class_ref="urn:oasis:names:tc:SAML:2.0:ac:classes:Password",
         session_index=session_index,
     )
+
+
+async def is_replayed(request_issuer: str, saml_request_id: str) -> bool:
+    """Return whether a request was already answered, if replays are rejected."""
+    if not settings.saml_idp_reject_replays:
+        return False
+    if url := settings.saml_idp_state_backend:
+        # Shared with the other replicas, so a request can only be answered once.
+        # The backend can block on another process's lock, so call it in a thread.
+        key = f"replay\n{request_issuer}\n{saml_request_id}"
+        return not await asyncio.to_thread(
+            lambda: get_state_backend(url).compare_and_set(
+                key, None, b"", CUTOFF.total_seconds()
+            )
+        )
+    return not replay_cache.add(request_issuer, saml_request_id)
+
+
+def render_redir(request: Request, context: dict[str, Any]) -> Response:
+    """Render the page that posts a SAML response to the SP."""
+    start = time.perf_counter()
+    response = templates.TemplateResponse(request, "redir.html", context)
+    _render_stage.observe_since(start)
+    return response
+
+
+RETRY_AFTER = 1
+"""How many seconds clients are told to wait before retrying a rejected request."""
+
+
+async def redir(
+    request: Request,
+    settings: Settings,
+    *,
+    saml_request_id: str,
+    destination: str,
+    request_issuer: str,
+    user: User,
+    relay_state: str,
+) -> Response:
+    """
+    Render a redirect to the SP.
+
+    Building and signing the response waits for a slot from the admission
+    limiter, and the request is shed with a 503 if none comes free in time.
+    Replays are checked once the request is admitted, so a shed request can
+    be retried.
+    """
+    try:
+        async with admission_limiter.admit(
+            settings.saml_idp_max_concurrent_responses,
+            settings.saml_idp_response_queue_size,
+            settings.saml_idp_response_queue_timeout,
+        ):
+            if await is_replayed(request_issuer, saml_request_id):
+                return Response("Replayed request", status_code=400)
+            session_id = settings.create_session(
+                user, request_issuer, request.cookies.get("session_id")
+            )
+            session = settings.get_session(session_id)
+            authn_response = build_authn_response(
+                settings,
+                saml_request_id=saml_request_id,
+                destination=destination,
+                request_issuer=request_issuer,
+                user=user,
+                session_index=session.session_index if session else None,
+            )
+            saml_response = await signing_engine.to_response(authn_response, settings)
+    except OverloadedError:
+        return Response(
+            "Too many requests, try again later",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
     context = {
         "destination": destination,
-        "saml_response": authn_response.to_response(settings),
+        "saml_response": saml_response,
         "relay_state": relay_state,
     }
-    response = templates.TemplateResponse(request, "redir.html", context)
-    response.set_cookie("session_id", session_id, max_age=3600)
+    response = render_redir(request, context)
+    response.set_cookie(
+        "session_id", session_id, max_age=settings.saml_idp_session_max_age
+    )
     return response
 
 
+@router.get("/idp-initiated")
+async def idp_initiated(
+    request: Request,
+    user: GetUser,
+    sp: Annotated[str, Query()],
+    acs: Annotated[HttpUrl, Query()],
+    relay_state: Annotated[str, Query(alias="RelayState")] = "",
+) -> Response:
+    """
+    Send an unsolicited response for the signed-in user to an SP.
+
+    If `saml_idp_assertion_pool_depth` is set, the response comes from a pool of
+    responses that are signed ahead of time.
+    """
+    if not user:
+        return Response("Not signed in", status_code=status.HTTP_401_UNAUTHORIZED)
+
+    destination = str(acs)
+
+    async def mint() -> str:
+        authn_response = build_authn_response(
+            settings,
+            saml_request_id=None,
+            destination=destination,
+            request_issuer=sp,
+            user=user,
+        )
+        return await signing_engine.to_response(authn_response, settings)
+
+    saml_response = None
+    if (depth := settings.saml_idp_assertion_pool_depth) > 0:
+        key = (user["username"], sp, destination)
+        saml_response = assertion_pool.take(key)
+        assertion_pool.schedule_refill(
+            key, mint, depth, settings.saml_idp_assertion_pool_ttl
+        )
+    if saml_response is None:
+        saml_response = await mint()
+
+    context = {
+        "destination": destination,
+        "saml_response": saml_response,
+        "relay_state": relay_state,
+    }
+    return render_redir(request, context)
+
+
+USER_PAGE_SIZE = 20
+"""How many users are listed on the login page at once."""
+
+MAX_USER_PAGE_SIZE = 100
+
+
+def user_picker(request: Request) -> dict[str, Any]:
+    """Return the login page's context for the first page of users, if shown."""
+    if not settings.saml_idp_show_users:
+        return {"show_users": False}
+    total, users = settings.search_users("", 0, USER_PAGE_SIZE)
+    return {
+        "show_users": True,
+        "users": users,
+        "users_total": total,
+        "users_url": rel_url_for(request, "search_users"),
+        "users_page_size": USER_PAGE_SIZE,
+    }
+
+
+@router.get("/users")
+async def search_users(
+    prefix: str = "",
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=MAX_USER_PAGE_SIZE)] = USER_PAGE_SIZE,
+) -> dict[str, Any]:
+    """Return a page of the users whose username starts with a prefix."""
+    if not settings.saml_idp_show_users:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Not Found")
+    total, users = settings.search_users(prefix, offset, limit)
+    return {
+        "total": total,
+        "users": [
+            {"username": user["username"], "password": user["password"]}
+            for user in users
+        ],
+    }
+
+
 @router.get("/signin")
 async def signin(
     request: Request,
@@ -127,7 +398,7 @@ async def signin(
     destination = str(saml_request.assertion_consumer_service_url)
     request_issuer = saml_request.issuer
     if user:
-        return redir(
+        return await redir(
             request,
             settings,
             saml_request_id=saml_request.id,
@@ -138,8 +409,7 @@ async def signin(
         )
 
     context = {
-        "show_users": settings.saml_idp_show_users,
-        "users": settings.saml_idp_users,
+        **user_picker(request),
         "saml_request_id": saml_request.id,
         "destination": destination,
         "request_issuer": request_issuer,
@@ -157,8 +427,7 @@ async def login(request: Request, csrf_protect: GetCsrfProtect) -> Response:
         request,
         "login.html",
         {
-            "show_users": settings.saml_idp_show_users,
-            "users": settings.saml_idp_users,
+            **user_picker(request),
             "action": rel_url_for(request, "login"),
             "csrf_token": csrf_token,
         },
@@ -193,7 +462,7 @@ async def login_post(
             and request_issuer is not None
         ):
             # This is the SAML login
-            return redir(
+            return await redir(
                 request,
                 settings,
                 saml_request_id=saml_request_id,
@@ -208,13 +477,14 @@ async def login_post(
             rel_url_for(request, "main"), status_code=status.HTTP_302_FOUND
         )
         csrf_protect.unset_csrf_cookie(response)
-        response.set_cookie("session_id", session_id, max_age=3600)
+        response.set_cookie(
+            "session_id", session_id, max_age=settings.saml_idp_session_max_age
+        )
         return response
     except ValueError as e:
         csrf_token, signed_token = csrf_protect.generate_csrf_tokens()
         context = {
-            "show_users": settings.saml_idp_show_users,
-            "users": settings.saml_idp_users,
+            **user_picker(request),
             "error_message": str(e),
             "saml_request_id": saml_request_id,
             "destination": destination,
@@ -234,6 +504,7 @@ async def logout(
     user: GetUser,
     saml_request: Annotated[LogoutRequestField, Query(alias="SAMLRequest")],
     relay_state: Annotated[str, Query(alias="RelayState")] = "",
+    session_id: Annotated[str | None, Cookie()] = None,
 ) -> Response:
     """Handle SAML logout requests."""
     now = datetime.now(UTC)
@@ -243,14 +514,19 @@ async def logout(
         return Response("Out of date", status_code=400)
     if saml_request.not_on_or_after < now:
         return Response("Out of date (not on or after)", status_code=400)
+    if await is_replayed(saml_request.issuer, saml_request.id):
+        return Response("Replayed request", status_code=400)
 
     issue_instant = now
     destination = str(settings.saml_idp_logout_url)
     clear_cookie = False
-    if user:
-        # NOTE: Check to make sure the person logged in is the
-        # one that is wanting to be logged out
-
+    # Token sessions know their session index, so only that session is logged out.
+    # NOTE: Other sessions don't check the person logged in is the one that
+    # is wanting to be logged out.
+    session = settings.get_session(session_id) if session_id else None
+    if user and (
+        session is None or session.session_index == saml_request.session_index
+    ):
         logout_response = LogoutResponse(
             issue_instant=issue_instant,
             issuer=saml_request.issuer,
@@ -274,7 +550,7 @@ async def logout(
         "relay_state": relay_state,
     }
 
-    response = templates.TemplateResponse(request, "redir.html", context)
+    response = render_redir(request, context)
     if clear_cookie:
         response.delete_cookie("session_id")
     return response
@@ -288,3 +564,139 @@ async def logout_post(request: Request) -> Response:
     )
     response.delete_cookie("session_id")
     return response
+
+
+@router.get("/metrics")
+async def metrics() -> Response:
+    """Return the latency histograms and counters, in the Prometheus text format."""
+    admission = admission_limiter.stats()
+    cache = request_cache.stats()
+    samples = [
+        Sample(
+            "saml_idp_admission_active",
+            "gauge",
+            "Requests holding a slot to build and sign a response.",
+            admission.active,
+        ),
+        Sample(
+            "saml_idp_admission_waiting",
+            "gauge",
+            "Requests waiting for a slot to build and sign a response.",
+            admission.waiting,
+        ),
+        Sample(
+            "saml_idp_admission_admitted_total",
+            "counter",
+            "Requests given a slot to build and sign a response.",
+            admission.admitted,
+        ),
+        Sample(
+            "saml_idp_admission_rejected_total",
+            "counter",
+            "Requests rejected because the queue was full or the wait too long.",
+            admission.rejected,
+        ),
+        Sample(
+            "saml_idp_request_cache_hits_total",
+            "counter",
+            "Decoded SAML requests found in the cache.",
+            cache.hits,
+        ),
+        Sample(
+            "saml_idp_request_cache_misses_total",
+            "counter",
+            "SAML requests decoded because they weren't in the cache.",
+            cache.misses,
+        ),
+        Sample(
+            "saml_idp_request_cache_size",
+            "gauge",
+            "Decoded SAML requests in the cache.",
+            cache.size,
+        ),
+    ]
+    return Response(render_metrics(samples), media_type=CONTENT_TYPE)
+
+
+@router.get("/admin/stats", dependencies=[RequireAdmin])
+async def admin_stats() -> dict[str, Any]:
+    """
+    Return the admission limiter's and the request cache's counters.
+
+    Requires the admin token as a bearer token.
+    """
+    admission = admission_limiter.stats()
+    cache = request_cache.stats()
+    return {
+        "admission": {**admission._asdict(), "mean_wait": admission.mean_wait},
+        "request_cache": {**cache._asdict(), "hit_rate": cache.hit_rate},
+    }
+
+
+@router.get(PROFILE_PATH, dependencies=[RequireAdmin])
+@unprofiled
+async def profile_status() -> ProfilingStatus:
+    """Return whether requests are being profiled, and how many were by route."""
+    return request_profiler.status()
+
+
+@router.post(PROFILE_PATH, dependencies=[RequireAdmin])
+@unprofiled
+async def start_profile(config: ProfilingRequest) -> ProfilingStatus:
+    """
+    Profile the next `requests` requests, or a `rate` of them for `seconds`.
+
+    Requires the admin token as a bearer token.
+    """
+    request_profiler.start(config)
+    return request_profiler.status()
+
+
+@router.delete(PROFILE_PATH, dependencies=[RequireAdmin])
+@unprofiled
+async def clear_profile() -> ProfilingStatus:
+    """Stop profiling, and drop the profiles collected so far."""
+    request_profiler.clear()
+    return request_profiler.status()
+
+
+@router.get(PROFILE_PATH + "/{profile_format}", dependencies=[RequireAdmin])
+@unprofiled
+async def download_profile(
+    profile_format: Literal["pstats", "collapsed"], route: str | None = None
+) -> Response:
+    """
+    Download the profile of a route, or of every route, as pstats or collapsed stacks.
+
+    `route` is the route's path, such as `/signin`.
+    """
+    stats = request_profiler.stats(route)
+    if stats is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "No profile")
+    if profile_format == "pstats":
+        return Response(
+            dump_pstats(stats),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="profile.pstats"'},
+        )
+    return Response(
+        dump_collapsed(stats),
+        media_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+    )
+
+
+@router.post("/admin/users", dependencies=[RequireAdmin])
+async def admin_users(request: Request) -> UserChangesResult:
+    """
+    Add, replace or delete users, from a stream of NDJSON changes.
+
+    Requires the admin token as a bearer token.
+    """
+    try:
+        return await apply_user_changes(request.stream(), settings.admin_users)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e)) from e
+    finally:
+        # The batches before an invalid line stay applied, so index them too.
+        await settings.reindex_users()
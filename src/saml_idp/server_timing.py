@@ -0,0 +1,52 @@
+"""The `Server-Timing` response header."""
+
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import request_timings
+
+
+def format_server_timing(timings: dict[str, float]) -> str:
+    """Format the time spent in each stage, in seconds, as a `Server-Timing` value."""
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()
+    )
+
+
+class ServerTimingMiddleware:
+    """
+    Add a `Server-Timing` header to every response.
+
+    It has an entry for each stage the request went through, such as decoding
+    the SAML request, looking up the user or signing the response, and a
+    `total` for the time until the response started. Browsers show these in
+    their developer tools.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        """Wrap an ASGI app."""
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Collect the request's timings, and add them to the response."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: dict[str, float] = {}
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                timings["total"] = time.perf_counter() - start
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", format_server_timing(timings))
+            await send(message)
+
+        token = request_timings.set(timings)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
@@ -0,0 +1,201 @@
+"""Signing of SAML assertions."""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from lxml import etree
+from signxml import (
+    CanonicalizationMethod,
+    DigestAlgorithm,
+    SignatureMethod,
+    XMLSigner,
+)
+
+from .config import Settings
+from .metrics import request_timings, stage
+from .utils import encode_response
+
+if TYPE_CHECKING:
+    from .models import AuthnResponse  # pragma: nocover
+
+logger = logging.getLogger(__name__)
+
+_sign_stage = stage("sign")
+_respond_stage = stage("respond")
+
+EC_ALGORITHMS = {
+    "secp256r1": (SignatureMethod.ECDSA_SHA256, DigestAlgorithm.SHA256),
+    "secp384r1": (SignatureMethod.ECDSA_SHA384, DigestAlgorithm.SHA384),
+    "secp521r1": (SignatureMethod.ECDSA_SHA512, DigestAlgorithm.SHA512),
+}
+"""The signature and digest algorithms for each supported curve."""
+
+
+def get_algorithms(key: PrivateKeyTypes) -> tuple[SignatureMethod, DigestAlgorithm]:
+    """Return the signature and digest algorithms that match a key."""
+    if isinstance(key, rsa.RSAPrivateKey):
+        return SignatureMethod.RSA_SHA256, DigestAlgorithm.SHA256
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        if algorithms := EC_ALGORITHMS.get(key.curve.name):
+            return algorithms
+        msg = f"Unsupported elliptic curve: {key.curve.name}."
+        raise ValueError(msg)
+    # signxml can't produce EdDSA signatures, so Ed25519 keys end up here too.
+    msg = f"Unsupported signing key type: {type(key).__name__}."
+    raise ValueError(msg)
+
+
+class SigningContext:
+    """
+    A loaded signing key and certificate chain.
+
+    Parsing the PEM key and certificate is a noticeable part of the cost of a
+    signature, so it's only done once per context instead of on every sign.
+    """
+
+    __slots__ = ("certs", "key", "signature_method", "signer")
+
+    def __init__(self, key: str, cert: str) -> None:
+        """Load the PEM-encoded key and certificate chain."""
+        self.key = load_pem_private_key(key.encode(), password=None)
+        self.certs = x509.load_pem_x509_certificates(cert.encode())
+        self.signature_method, digest_algorithm = get_algorithms(self.key)
+        self.signer = XMLSigner(
+            signature_algorithm=self.signature_method,
+            digest_algorithm=digest_algorithm,
+            c14n_algorithm=CanonicalizationMethod.EXCLUSIVE_XML_CANONICALIZATION_1_0,
+        )
+
+    def sign(self, element: etree.Element) -> etree.Element:
+        """Sign an element with an enveloped signature."""
+        start = time.perf_counter()
+        signed = self.signer.sign(element, key=self.key, cert=self.certs)
+        _sign_stage.observe_since(start)
+        return signed
+
+
+@functools.lru_cache(maxsize=1)
+def get_signing_context(key: str, cert: str) -> SigningContext:
+    """
+    Return the signing context for a key and certificate.
+
+    The context is rebuilt only when the key or certificate changes.
+    """
+    return SigningContext(key, cert)
+
+
+# The signing context of a worker process in the signing pool.
+_worker_context: SigningContext | None = None
+
+
+def _init_worker(key: str, cert: str) -> None:
+    """Load the signing key once when a worker process starts."""
+    global _worker_context  # noqa: PLW0603
+    _worker_context = SigningContext(key, cert)
+
+
+def _to_response_in_worker(
+    authn_response: "AuthnResponse",
+) -> tuple[str, dict[str, float]]:
+    """
+    Build, sign and encode a response in a worker process.
+
+    Returns the time spent in each stage along with the response, since the
+    worker's histograms aren't the server's.
+    """
+    if _worker_context is None:
+        msg = "The signing worker was not initialized."
+        raise RuntimeError(msg)
+    timings: dict[str, float] = {}
+    token = request_timings.set(timings)
+    try:
+        return encode_response(authn_response.to_signed_xml(_worker_context)), timings
+    finally:
+        request_timings.reset(token)
+
+
+class SigningEngine:
+    """
+    Builds and signs authn responses.
+
+    If ``saml_idp_signing_workers`` is set, responses are signed in a pool of
+    worker processes so the RSA operations and canonicalization don't block
+    the event loop. Otherwise, or if the pool breaks, they're signed in-process.
+    """
+
+    def __init__(self) -> None:
+        """Create an engine. The pool is started on first use."""
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_config: tuple[int, str, str] | None = None
+
+    def _get_pool(self, settings: Settings) -> ProcessPoolExecutor | None:
+        """Return the worker pool for the settings, if there should be one."""
+        workers = settings.saml_idp_signing_workers
+        if workers <= 0:
+            self.shutdown()
+            return None
+        key, cert = settings.saml_idp_metadata_key, settings.saml_idp_metadata_cert
+        config = (workers, key, cert)
+        if self._pool is None or self._pool_config != config:
+            self.shutdown()
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(key, cert),
+            )
+            self._pool_config = config
+        return self._pool
+
+    async def to_response(
+        self, authn_response: "AuthnResponse", settings: Settings
+    ) -> str:
+        """
+        Return the signed and encoded response.
+
+        The whole call is timed as the `respond` stage. When there's a pool,
+        the stages inside it are timed by the worker, and recorded here.
+        """
+        start = time.perf_counter()
+        try:
+            return await self._to_response(authn_response, settings)
+        finally:
+            _respond_stage.observe_since(start)
+
+    async def _to_response(
+        self, authn_response: "AuthnResponse", settings: Settings
+    ) -> str:
+        if pool := self._get_pool(settings):
+            loop = asyncio.get_running_loop()
+            try:
+                response, timings = await loop.run_in_executor(
+                    pool, _to_response_in_worker, authn_response
+                )
+            except BrokenProcessPool:
+                logger.exception("The signing pool is broken, signing in-process.")
+                self.shutdown()
+            else:
+                for name, seconds in timings.items():
+                    stage(name).observe(seconds)
+                return response
+        return authn_response.to_response(settings)
+
+    def shutdown(self) -> None:
+        """Stop the worker processes, if any."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pool_config = None
+
+
+signing_engine = SigningEngine()
@@ -0,0 +1,279 @@
+"""Shared state backends, for state that has to be seen by every replica."""
+
+import abc
+import contextlib
+import heapq
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+PURGE_EVERY = 1_000
+"""How many SQLite writes happen between purges of the expired rows."""
+
+BUSY_TIMEOUT = 5
+"""How many seconds a SQLite statement waits for another writer's lock."""
+
+
+class StateBackend(abc.ABC):
+    """
+    A key-value store with expiring entries and atomic compare-and-set.
+
+    Expiry times are wall-clock times, so they can be shared between processes.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes | None:
+        """Return the value of a key, or None if it's missing or expired."""
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Set the value of a key for `ttl` seconds."""
+
+    @abc.abstractmethod
+    def set_many(self, items: Iterable[tuple[str, bytes]], ttl: float) -> None:
+        """Set the values of several keys for `ttl` seconds, in a single batch."""
+
+    @abc.abstractmethod
+    def compare_and_set(
+        self, key: str, expected: bytes | None, value: bytes, ttl: float
+    ) -> bool:
+        """
+        Set the value of a key, if its current value is `expected`.
+
+        If `expected` is None, the key is only set if it's missing or expired.
+        Returns whether the value was set.
+        """
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete a key."""
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Release the backend's resources."""
+
+
+class MemoryBackend(StateBackend):
+    """
+    State kept in this process, for a single replica.
+
+    Expiry times are also kept in a heap, so each write only drops the entries
+    that have expired since, instead of scanning the whole store. A key that's
+    rewritten leaves its old expiry in the heap, which is skipped once it's
+    popped, so the heap never outlives the longest TTL.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty store."""
+        self._entries: dict[str, tuple[float, bytes]] = {}
+        self._expiries: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        """Return the value of a key, or None if it's missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Set the value of a key for `ttl` seconds."""
+        self.set_many([(key, value)], ttl)
+
+    def set_many(self, items: Iterable[tuple[str, bytes]], ttl: float) -> None:
+        """Set the values of several keys for `ttl` seconds, in a single batch."""
+        expires = time.time() + ttl
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = (expires, value)
+                self._written(key, expires)
+
+    def compare_and_set(
+        self, key: str, expected: bytes | None, value: bytes, ttl: float
+    ) -> bool:
+        """Set the value of a key, if its current value is `expected`."""
+        with self._lock:
+            if self.get(key) != expected:
+                return False
+            expires = time.time() + ttl
+            self._entries[key] = (expires, value)
+            self._written(key, expires)
+            return True
+
+    def delete(self, key: str) -> None:
+        """Delete a key."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def close(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._expiries.clear()
+
+    def _written(self, key: str, expires: float) -> None:
+        now = time.time()
+        while self._expiries and self._expiries[0][0] <= now:
+            expired, expired_key = heapq.heappop(self._expiries)
+            entry = self._entries.get(expired_key)
+            if entry is not None and entry[0] == expired:
+                del self._entries[expired_key]
+        heapq.heappush(self._expiries, (expires, key))
+
+
+class SqliteBackend(StateBackend):
+    """
+    State kept in a SQLite database, for several processes on a single host.
+
+    The database uses write-ahead logging, so readers don't block the writer.
+    Connections are pooled, and each write is a single atomic statement.
+    Calls block while another process holds the write lock, so async code
+    should make them in a thread.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4) -> None:
+        """Open a pool of connections to the database, creating it if needed."""
+        self._pool: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._connections: list[sqlite3.Connection] = []
+        self._writes = 0
+        for _ in range(pool_size):
+            connection = sqlite3.connect(
+                path,
+                timeout=BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections.append(connection)
+            self._pool.put(connection)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS state_expires ON state (expires)"
+            )
+
+    @contextlib.contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def get(self, key: str) -> bytes | None:
+        """Return the value of a key, or None if it's missing or expired."""
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT value FROM state WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Set the value of a key for `ttl` seconds."""
+        self.set_many([(key, value)], ttl)
+
+    def set_many(self, items: Iterable[tuple[str, bytes]], ttl: float) -> None:
+        """Set the values of several keys for `ttl` seconds, in a single transaction."""
+        expires = time.time() + ttl
+        rows = [(key, value, expires) for key, value in items]
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT INTO state (key, value, expires) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE "
+                    "SET value = excluded.value, expires = excluded.expires",
+                    rows,
+                )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            self._written(connection, len(rows))
+
+    def compare_and_set(
+        self, key: str, expected: bytes | None, value: bytes, ttl: float
+    ) -> bool:
+        """Set the value of a key, if its current value is `expected`."""
+        now = time.time()
+        with self._connection() as connection:
+            if expected is None:
+                cursor = connection.execute(
+                    "INSERT INTO state (key, value, expires) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE "
+                    "SET value = excluded.value, expires = excluded.expires "
+                    "WHERE state.expires <= ?",
+                    (key, value, now + ttl, now),
+                )
+            else:
+                cursor = connection.execute(
+                    "UPDATE state SET value = ?, expires = ? "
+                    "WHERE key = ? AND value = ? AND expires > ?",
+                    (value, now + ttl, key, expected, now),
+                )
+            if changed := cursor.rowcount == 1:
+                self._written(connection, 1)
+        return changed
+
+    def delete(self, key: str) -> None:
+        """Delete a key."""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def _written(self, connection: sqlite3.Connection, count: int) -> None:
+        before, self._writes = self._writes, self._writes + count
+        if before // PURGE_EVERY != self._writes // PURGE_EVERY:
+            connection.execute("DELETE FROM state WHERE expires <= ?", (time.time(),))
+
+    def close(self) -> None:
+        """Close every connection."""
+        for connection in self._connections:
+            connection.close()
+
+
+def check_state_backend_url(url: str) -> None:
+    """Raise `ValueError` unless a URL is `memory` or `sqlite:///path/to/state.db`."""
+    if url != "memory" and not (
+        url.startswith("sqlite:///") and url.removeprefix("sqlite:///")
+    ):
+        msg = f"Unsupported state backend: {url}"
+        raise ValueError(msg)
+
+
+_backends: dict[str, StateBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_state_backend(url: str) -> StateBackend:
+    """
+    Return the backend for a URL, opening it the first time.
+
+    The URL is `memory` or `sqlite:///path/to/state.db`.
+    """
+    if backend := _backends.get(url):
+        return backend
+    with _backends_lock:
+        if backend := _backends.get(url):
+            return backend
+        check_state_backend_url(url)
+        if url == "memory":
+            backend = MemoryBackend()
+        else:
+            backend = SqliteBackend(url.removeprefix("sqlite:///"))
+        _backends[url] = backend
+        return backend
+
+
+def close_state_backends() -> None:
+    """Close every backend that was opened."""
+    with _backends_lock:
+        for backend in _backends.values():
+            backend.close()
+        _backends.clear()
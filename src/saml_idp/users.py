@@ -0,0 +1,524 @@
+"""Lookup indexes over the configured test users."""
+
+import bisect
+import csv
+import hashlib
+import hmac
+import json
+import re
+import sys
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, NotRequired, Protocol, Required, TypedDict
+
+
+class User(TypedDict):
+    """Configuration for one test user."""
+
+    username: Required[str]
+    password: Required[str]
+    attributes: NotRequired[dict[str, str]]
+
+
+def generate_session_id(user: User) -> str:
+    """
+    Generate a session ID for a user.
+
+    This is *NOT* meant to be secure. It's only meant so we have a way to
+    identify a user without a local state or database.
+    """
+    h = hashlib.new("sha256")
+    h.update(user["username"].encode())
+    h.update(user["password"].encode())
+    return h.hexdigest()
+
+
+# Compared against when the username is unknown, so a failed login takes
+# about as long whether or not the user exists.
+_NO_PASSWORD = b"\0" * 32
+
+
+class UserIndex:
+    """
+    An index of users by their session ID and username.
+
+    The index is built once from the list of users, so looking up a session
+    doesn't require hashing the credentials of every user on every request.
+    """
+
+    __slots__ = ("_by_session", "_by_username")
+
+    def __init__(self, users: Iterable[User] = ()) -> None:
+        """Build the index from a list of users."""
+        self._by_session: dict[str, User] = {}
+        self._by_username: dict[str, tuple[User, bytes, str]] = {}
+        for user in users:
+            session_id = generate_session_id(user)
+            # The first user wins, just like a linear search would.
+            self._by_session.setdefault(session_id, user)
+            self._by_username.setdefault(
+                user["username"], (user, user["password"].encode(), session_id)
+            )
+
+    def __len__(self) -> int:
+        """Return the number of indexed sessions."""
+        return len(self._by_session)
+
+    def __contains__(self, username: object) -> bool:
+        """Return whether there's a user with a username."""
+        return username in self._by_username
+
+    def get_by_session(self, session_id: str) -> User | None:
+        """Return the user for a session ID, or None if there isn't one."""
+        return self._by_session.get(session_id)
+
+    def get_by_username(self, username: str) -> User | None:
+        """Return the user with a username, or None if there isn't one."""
+        entry = self._by_username.get(username)
+        return entry[0] if entry else None
+
+    def usernames(self) -> Iterable[str]:
+        """Return the usernames."""
+        return self._by_username.keys()
+
+    def authenticate(self, username: str, password: str) -> tuple[User, str] | None:
+        """
+        Return the user and session ID for a username/password combo.
+
+        The password is compared in constant time. Returns None if the
+        credentials don't match.
+        """
+        entry = self._by_username.get(username)
+        expected = entry[1] if entry else _NO_PASSWORD
+        if hmac.compare_digest(expected, password.encode()) and entry:
+            return entry[0], entry[2]
+        return None
+
+
+class UserSource(Protocol):
+    """Something users can be looked up in."""
+
+    def __len__(self) -> int:
+        """Return the number of users."""
+        ...
+
+    def __contains__(self, username: object) -> bool:
+        """Return whether there's a user with a username."""
+        ...
+
+    def get_by_session(self, session_id: str) -> User | None:
+        """Return the user for a session ID, or None if there isn't one."""
+        ...
+
+    def get_by_username(self, username: str) -> User | None:
+        """Return the user with a username, or None if there isn't one."""
+        ...
+
+    def authenticate(self, username: str, password: str) -> tuple[User, str] | None:
+        """Return the user and session ID for a username/password combo."""
+        ...
+
+    def usernames(self) -> Iterable[str]:
+        """Return the usernames that can be listed."""
+        ...
+
+
+class UserRecord:
+    """A user, stored compactly."""
+
+    __slots__ = ("attribute_names", "attribute_values", "password", "username")
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        attribute_names: tuple[str, ...] = (),
+        attribute_values: tuple[str, ...] = (),
+    ) -> None:
+        """Create a record."""
+        self.username = username
+        self.password = password
+        self.attribute_names = attribute_names
+        """The names of the attributes. Records with the same names share them."""
+        self.attribute_values = attribute_values
+
+    def to_user(self) -> User:
+        """Return the record as a user."""
+        user: User = {"username": self.username, "password": self.password}
+        if self.attribute_names:
+            user["attributes"] = dict(
+                zip(self.attribute_names, self.attribute_values, strict=True)
+            )
+        return user
+
+
+class UserStore:
+    """
+    A compact store of users, for directories with millions of users.
+
+    Users are kept as slotted records rather than dicts, with interned
+    attribute names. Sessions are indexed by the first 8 bytes of their
+    digest, and the full session ID is checked against the record.
+
+    The store can override other sources, set in `shadowed`: deleting one
+    of their users leaves a tombstone, which hides the user until it's
+    upserted again.
+    """
+
+    __slots__ = ("_by_session", "_by_username", "_deleted", "shadowed", "version")
+
+    def __init__(self, records: Iterable[UserRecord] = ()) -> None:
+        """Build the store from records."""
+        self._by_username: dict[str, UserRecord] = {}
+        self._by_session: dict[int, UserRecord] = {}
+        self._deleted: set[str] = set()
+        self.shadowed: tuple[UserSource, ...] = ()
+        """The sources whose users this store overrides."""
+        self.version = 0
+        """Incremented whenever users are changed."""
+        for record in records:
+            # Keep the first record of a username, as UserIndex does.
+            if record.username not in self._by_username:
+                self._add(record)
+
+    def _add(self, record: UserRecord) -> None:
+        self._by_username[record.username] = record
+        digest = _session_digest(record.username, record.password)
+        self._by_session.setdefault(int.from_bytes(digest[:8]), record)
+
+    def _remove(self, username: str) -> bool:
+        record = self._by_username.pop(username, None)
+        if record is None:
+            return False
+        digest = _session_digest(record.username, record.password)
+        key = int.from_bytes(digest[:8])
+        if self._by_session.get(key) is record:
+            del self._by_session[key]
+        return True
+
+    def apply(self, upserts: Iterable[UserRecord], deletes: Iterable[str]) -> int:
+        """
+        Add or replace users, and delete users by username.
+
+        Each user is replaced in both indexes before the next one, so lookups
+        never see a user's old session with its new password. Returns how
+        many deletes removed a user, from the store or the shadowed sources.
+        """
+        for record in upserts:
+            self._remove(record.username)
+            self._deleted.discard(record.username)
+            self._add(record)
+        deleted = 0
+        for username in deletes:
+            removed = self._remove(username)
+            if username not in self._deleted and any(
+                username in source for source in self.shadowed
+            ):
+                self._deleted.add(username)
+                removed = True
+            deleted += removed
+        self.version += 1
+        return deleted
+
+    def is_deleted(self, username: str) -> bool:
+        """Return whether a username was deleted from the shadowed sources."""
+        return username in self._deleted
+
+    def deleted(self) -> frozenset[str]:
+        """Return the usernames deleted from the shadowed sources."""
+        return frozenset(self._deleted)
+
+    def usernames(self) -> Iterable[str]:
+        """Return the usernames."""
+        return self._by_username.keys()
+
+    def __len__(self) -> int:
+        """Return the number of users."""
+        return len(self._by_username)
+
+    def __contains__(self, username: object) -> bool:
+        """Return whether there's a user with a username."""
+        return username in self._by_username
+
+    def get_by_session(self, session_id: str) -> User | None:
+        """Return the user for a session ID, or None if there isn't one."""
+        try:
+            digest = bytes.fromhex(session_id)
+        except ValueError:
+            return None
+        record = self._by_session.get(int.from_bytes(digest[:8]))
+        if record is None or not hmac.compare_digest(
+            _session_digest(record.username, record.password), digest
+        ):
+            return None
+        return record.to_user()
+
+    def get_by_username(self, username: str) -> User | None:
+        """Return the user with a username, or None if there isn't one."""
+        record = self._by_username.get(username)
+        return record.to_user() if record else None
+
+    def authenticate(self, username: str, password: str) -> tuple[User, str] | None:
+        """
+        Return the user and session ID for a username/password combo.
+
+        The password is compared in constant time. Returns None if the
+        credentials don't match.
+        """
+        record = self._by_username.get(username)
+        expected = record.password.encode() if record else _NO_PASSWORD
+        if hmac.compare_digest(expected, password.encode()) and record:
+            user = record.to_user()
+            return user, generate_session_id(user)
+        return None
+
+
+def _session_digest(username: str, password: str) -> bytes:
+    h = hashlib.new("sha256")
+    h.update(username.encode())
+    h.update(password.encode())
+    return h.digest()
+
+
+class AttributeNames:
+    """Share the tuples of attribute names between records."""
+
+    def __init__(self) -> None:
+        """Start with no names."""
+        self._names: dict[tuple[str, ...], tuple[str, ...]] = {}
+
+    def record(self, user: Any) -> UserRecord:
+        """
+        Return a record for a user object parsed from JSON.
+
+        Raises `TypeError` if the username, password or an attribute value
+        isn't a string.
+        """
+        username, password = user["username"], user["password"]
+        if not isinstance(username, str) or not isinstance(password, str):
+            msg = "The username and password must be strings."
+            raise TypeError(msg)
+        return UserRecord(
+            username, password, *self.split(user.get("attributes", {}).items())
+        )
+
+    def split(
+        self, items: Iterable[tuple[str, str | None]]
+    ) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        """
+        Split attributes into shared names and values, skipping missing values.
+
+        Raises `TypeError` if a name or value isn't a string.
+        """
+        pairs = [(name, value) for name, value in items if value is not None]
+        for name, value in pairs:
+            if not isinstance(name, str) or not isinstance(value, str):
+                msg = f"Attribute {name!r} must be a string, not {value!r}."
+                raise TypeError(msg)
+        names = tuple(name for name, _ in pairs)
+        names = self._names.setdefault(names, tuple(sys.intern(n) for n in names))
+        return names, tuple(value for _, value in pairs)
+
+
+def read_users_file(path: str | Path) -> Iterator[UserRecord]:
+    """
+    Read users from a file, one at a time.
+
+    `.csv` files have `username` and `password` columns, and every other
+    column is an attribute, which users with an empty cell don't have. Other
+    files are JSON Lines, with one user object per line, whose attribute
+    values must be strings.
+    """
+    path = Path(path)
+    attribute_names = AttributeNames()
+    with path.open(newline="") as f:
+        if path.suffix.lower() == ".csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                username, password = (
+                    row.pop("username", None),
+                    row.pop("password", None),
+                )
+                msg = f"Invalid user on line {reader.line_num} of {path}."
+                if not username or password is None:
+                    raise ValueError(msg)
+                try:
+                    # Cells past the header are a list, which isn't a valid value.
+                    attributes = attribute_names.split(
+                        (name, value or None) for name, value in row.items()
+                    )
+                except TypeError as e:
+                    raise ValueError(msg) from e
+                yield UserRecord(username, password, *attributes)
+            return
+
+        for line_num, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = attribute_names.record(json.loads(line))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                msg = f"Invalid user on line {line_num} of {path}."
+                raise ValueError(msg) from e
+            yield record
+
+
+class SyntheticUsersConfig(TypedDict):
+    """
+    A pattern for generated users.
+
+    `{n}` in the templates is replaced with the user's number, which goes
+    from `start` to `start + count - 1`.
+    """
+
+    username: Required[str]
+    password: Required[str]
+    count: Required[int]
+    start: NotRequired[int]
+    attributes: NotRequired[dict[str, str]]
+
+
+SYNTHETIC_SESSION_PREFIX = "synthetic-"
+
+
+class SyntheticUsers:
+    """
+    Users generated from a pattern, for load tests with millions of subjects.
+
+    Users are never stored: they're found by parsing their number out of the
+    username or session ID. Session IDs look like `synthetic-<n>-<digest>`,
+    where the digest is the usual hash of the user's credentials.
+    """
+
+    __slots__ = (
+        "_attributes",
+        "_count",
+        "_number",
+        "_password",
+        "_pattern",
+        "_start",
+        "_username",
+    )
+
+    def __init__(self, config: SyntheticUsersConfig) -> None:
+        """Compile the pattern."""
+        self._username = config["username"]
+        self._password = config["password"]
+        self._start = config.get("start", 0)
+        self._count = config["count"]
+        self._attributes = tuple(config.get("attributes", {}).items())
+        prefix, n, suffix = self._username.partition("{n}")
+        if not n or "{n}" in suffix:
+            msg = "The synthetic username must contain {n} exactly once."
+            raise ValueError(msg)
+        # ASCII digits, no longer than the largest number, so parsing is cheap.
+        digits = len(str(max(self._start + self._count - 1, 0)))
+        number = f"0|[1-9][0-9]{{0,{digits - 1}}}"
+        self._number = re.compile(number)
+        self._pattern = re.compile(f"{re.escape(prefix)}({number}){re.escape(suffix)}")
+
+    def __len__(self) -> int:
+        """Return the number of users."""
+        return self._count
+
+    def __contains__(self, username: object) -> bool:
+        """Return whether there's a user with a username."""
+        return isinstance(username, str) and self._lookup(username) is not None
+
+    def _user(self, number: str) -> User | None:
+        """Return the user with a number, or None if it's out of range."""
+        if not self._start <= int(number) < self._start + self._count:
+            return None
+        user: User = {
+            "username": self._username.replace("{n}", number),
+            "password": self._password.replace("{n}", number),
+        }
+        if self._attributes:
+            user["attributes"] = {
+                name: value.replace("{n}", number) for name, value in self._attributes
+            }
+        return user
+
+    def _lookup(self, username: str) -> tuple[str, User] | None:
+        """Return the number and user for a username."""
+        match = self._pattern.fullmatch(username)
+        if match is None or (user := self._user(match[1])) is None:
+            return None
+        return match[1], user
+
+    def get_by_username(self, username: str) -> User | None:
+        """Return the user with a username, or None if there isn't one."""
+        found = self._lookup(username)
+        return found[1] if found else None
+
+    def usernames(self) -> Iterable[str]:
+        """Return no usernames: there are too many to list."""
+        return ()
+
+    def session_id(self, user: User) -> str | None:
+        """Return the session ID of a user, or None if it isn't one of ours."""
+        found = self._lookup(user["username"])
+        if found is None or found[1] != user:
+            return None
+        return f"{SYNTHETIC_SESSION_PREFIX}{found[0]}-{generate_session_id(user)}"
+
+    def get_by_session(self, session_id: str) -> User | None:
+        """Return the user for a session ID, or None if there isn't one."""
+        if not session_id.startswith(SYNTHETIC_SESSION_PREFIX):
+            return None
+        number, _, digest = session_id.removeprefix(SYNTHETIC_SESSION_PREFIX).partition(
+            "-"
+        )
+        if not self._number.fullmatch(number):
+            return None
+        user = self._user(number)
+        if user is None or not hmac.compare_digest(generate_session_id(user), digest):
+            return None
+        return user
+
+    def authenticate(self, username: str, password: str) -> tuple[User, str] | None:
+        """
+        Return the user and session ID for a username/password combo.
+
+        The password is compared in constant time. Returns None if the
+        credentials don't match.
+        """
+        found = self._lookup(username)
+        expected = found[1]["password"].encode() if found else _NO_PASSWORD
+        if hmac.compare_digest(expected, password.encode()) and found:
+            number, user = found
+            return (
+                user,
+                f"{SYNTHETIC_SESSION_PREFIX}{number}-{generate_session_id(user)}",
+            )
+        return None
+
+
+class UsernameIndex:
+    """A sorted index of usernames, for searching by prefix."""
+
+    __slots__ = ("_usernames",)
+
+    def __init__(self, usernames: Iterable[str] = ()) -> None:
+        """Sort the usernames."""
+        self._usernames = sorted(set(usernames))
+
+    def __len__(self) -> int:
+        """Return the number of usernames."""
+        return len(self._usernames)
+
+    def search(self, prefix: str, offset: int, limit: int) -> tuple[int, list[str]]:
+        """
+        Return the number of usernames that start with a prefix, and a page of them.
+
+        Both are found by binary search, so this doesn't depend on the number
+        of users.
+        """
+        start = bisect.bisect_left(self._usernames, prefix)
+        end = (
+            bisect.bisect_left(self._usernames, prefix + "\U0010ffff", lo=start)
+            if prefix
+            else len(self._usernames)
+        )
+        first = min(start + offset, end)
+        return end - start, self._usernames[first : min(first + limit, end)]
@@ -1,6 +1,9 @@
 """Utilities for encoding and creating SAML requests/responses."""
 
 import base64
+import binascii
+import logging
+import time
 import zlib
 from datetime import UTC, datetime, timedelta
 
@@ -8,12 +11,75 @@ import signxml
 from lxml import etree
 from lxml.builder import ElementMaker
 
+from .metrics import stage
 
-def inflate_and_decode(data: str | bytes) -> etree.ElementTree:
-    """Inflate and decode a SAML request."""
+logger = logging.getLogger(__name__)
+
+_decode_stage = stage("decode")
+_parse_stage = stage("parse")
+_encode_stage = stage("encode")
+
+
+MAX_INFLATED_SIZE = 64 * 1024
+"""The default maximum size of an inflated SAML request, in bytes."""
+
+
+class InvalidSamlRequestError(ValueError):
+    """The SAML request can't be decoded or parsed."""
+
+
+class SamlRequestTooLargeError(InvalidSamlRequestError):
+    """The SAML request inflates to more than the maximum size."""
+
+
+# Requests are untrusted, so never resolve entities or touch the network.
+REQUEST_PARSER = etree.XMLParser(
+    resolve_entities=False,
+    no_network=True,
+    load_dtd=False,
+    huge_tree=False,
+)
+
+
+def inflate_and_decode(
+    data: str | bytes, max_size: int = MAX_INFLATED_SIZE
+) -> etree.ElementTree:
+    """
+    Inflate and decode a SAML request.
+
+    Inflating stops as soon as the output would be larger than `max_size`,
+    so a small deflate bomb can't make us allocate huge buffers. Raises
+    `InvalidSamlRequestError` if the request can't be decoded or parsed.
+    """
     # https://github.com/IdentityPython/pysaml2/blob/master/src/saml2/s_utils.py
-    unzipped = zlib.decompress(base64.b64decode(data), -15)
-    return etree.fromstring(unzipped)
+    start = time.perf_counter()
+    decompressor = zlib.decompressobj(-15)
+    try:
+        unzipped = decompressor.decompress(base64.b64decode(data), max_size + 1)
+    except (binascii.Error, zlib.error) as e:
+        msg = "SAML request is not deflated and base64-encoded."
+        raise InvalidSamlRequestError(msg) from e
+    if len(unzipped) > max_size:
+        msg = f"SAML request is larger than {max_size} bytes."
+        raise SamlRequestTooLargeError(msg)
+    if not decompressor.eof:
+        msg = "SAML request is truncated."
+        raise InvalidSamlRequestError(msg)
+    decoded = time.perf_counter()
+    _decode_stage.observe(decoded - start)
+    try:
+        tree = etree.fromstring(unzipped, REQUEST_PARSER)
+    except etree.XMLSyntaxError as e:
+        msg = "SAML request is not well-formed XML."
+        raise InvalidSamlRequestError(msg) from e
+    parsed = time.perf_counter()
+    _parse_stage.observe(parsed - decoded)
+    logger.debug(
+        "Decoded SAML request in %.3fms, parsed in %.3fms",
+        (decoded - start) * 1000,
+        (parsed - decoded) * 1000,
+    )
+    return tree
 
 
 def deflate_and_encode(data: str) -> bytes:
@@ -23,7 +89,10 @@ def deflate_and_encode(data: str) -> bytes:
 
 def encode_response(tree: etree.ElementTree) -> str:
     """Encode a SAML response."""
-    return base64.b64encode(etree.tostring(tree)).decode()
+    start = time.perf_counter()
+    encoded = base64.b64encode(etree.tostring(tree)).decode()
+    _encode_stage.observe_since(start)
+    return encoded
 
 
 def get_elem_from_path(tree: etree.ElementTree, xpath: str) -> list[etree.Element]:
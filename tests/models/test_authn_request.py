@@ -4,7 +4,7 @@ import pytest
 from pydantic import TypeAdapter, ValidationError
 
 from saml_idp.models import AuthnRequestField
-from saml_idp.utils import deflate_and_encode
+from saml_idp.utils import deflate_and_encode, saml2_timestamp
 
 REQUEST = """
 <saml2p:AuthnRequest
@@ -56,3 +56,13 @@ def test_no_issuer() -> None:
     """
     with pytest.raises(ValidationError, match="No issuer"):
         Validator.validate_python(deflate_and_encode(req))
+
+
+def test_parse_request_cached() -> None:
+    """Fresh requests are decoded once, out of date ones every time."""
+    data = deflate_and_encode(
+        REQUEST.replace("2024-01-12T20:45:56.329Z", saml2_timestamp(datetime.now(UTC)))
+    )
+    assert Validator.validate_python(data) is Validator.validate_python(data)
+    data = deflate_and_encode(REQUEST)
+    assert Validator.validate_python(data) is not Validator.validate_python(data)
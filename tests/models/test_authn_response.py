@@ -64,3 +64,45 @@ def test_attributes() -> None:
     attr = xml.find(".//{urn:oasis:names:tc:SAML:2.0:assertion}Attribute")
     assert attr.get("Name") == "foo"
     assert attr[0].text == "bar"
+
+
+@pytest.mark.parametrize("attributes", [{}, {"foo": "bar", "baz": "qux"}])
+def test_fill_assertion(attributes: dict[str, str]) -> None:
+    """Filling in a cached skeleton gives the same bytes as building it."""
+    first = _make_response(attributes)
+    first.fill_assertion("_first", "2024-01-01T00:00:00Z")
+
+    response = _make_response(attributes).model_copy(
+        update={
+            "in_response_to": "_zzzz",
+            "destination": HttpUrl("https://example.com/other"),
+            "conditions_not_before": datetime(2024, 1, 2, tzinfo=UTC),
+            "session_index": "other_session_index",
+        }
+    )
+    filled = response.fill_assertion("_second", "2024-01-02T00:00:00Z")
+    built = response.build_assertion("_second", "2024-01-02T00:00:00Z")
+    assert etree.tostring(filled) == etree.tostring(built)
+    assert b"_zzzz" in etree.tostring(filled)
+
+
+def test_fill_assertion_copies() -> None:
+    """Filling in an assertion doesn't change the cached skeleton."""
+    response = _make_response({})
+    first = response.fill_assertion("_first", "2024-01-01T00:00:00Z")
+    second = response.fill_assertion("_second", "2024-01-01T00:00:00Z")
+    assert first is not second
+    assert first.get("ID") == "_first"
+    assert second.get("ID") == "_second"
+
+
+def test_unsolicited() -> None:
+    """Unsolicited responses don't have an InResponseTo."""
+    response = _make_response({}).model_copy(update={"in_response_to": None})
+    xml = response.to_xml(settings)
+    assert xml.get("InResponseTo") is None
+    assert b"InResponseTo" not in etree.tostring(xml)
+
+    filled = response.fill_assertion("_id", "2024-01-02T00:00:00Z")
+    built = response.build_assertion("_id", "2024-01-02T00:00:00Z")
+    assert etree.tostring(filled) == etree.tostring(built)
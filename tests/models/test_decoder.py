@@ -0,0 +1,44 @@
+from datetime import UTC, datetime
+
+import pytest
+from pydantic import ValidationError
+
+from saml_idp.models.decoder import DateTimeValidate, parse_datetime, parse_url
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "2024-01-12T20:45:56Z",
+        "2024-01-12T20:45:56.329Z",
+        "2024-01-12T20:45:56.329+02:00",
+        "2024-01-12T20:45:56",
+        "1705092356",
+    ],
+)
+def test_parse_datetime(value: str) -> None:
+    """The fast path parses timestamps the same way pydantic does."""
+    assert parse_datetime(value) == DateTimeValidate.validate_python(value)
+
+
+def test_parse_datetime_fast_path() -> None:
+    """The usual SAML format is parsed."""
+    assert parse_datetime("2024-01-12T20:45:56.329Z") == datetime(
+        2024, 1, 12, 20, 45, 56, 329000, tzinfo=UTC
+    )
+
+
+@pytest.mark.parametrize("value", [None, "", "yesterday", "2024-01-12Tnoon:00:00"])
+def test_parse_datetime_invalid(value: str | None) -> None:
+    """Invalid timestamps are rejected."""
+    with pytest.raises(ValidationError):
+        parse_datetime(value)
+
+
+def test_parse_url() -> None:
+    """URLs are validated, and cached."""
+    url = parse_url("https://example.com/acs")
+    assert str(url) == "https://example.com/acs"
+    assert parse_url("https://example.com/acs") is url
+    with pytest.raises(ValidationError):
+        parse_url("not a url")
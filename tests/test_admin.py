@@ -0,0 +1,97 @@
+import json
+from collections.abc import AsyncIterator
+
+import pytest
+
+from saml_idp.admin import MAX_LINE_SIZE, apply_user_changes
+from saml_idp.users import UserIndex, UserStore, generate_session_id
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _chunks(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+def _lines(*changes: dict) -> bytes:
+    return b"".join(json.dumps(change).encode() + b"\n" for change in changes)
+
+
+async def test_upsert_delete() -> None:
+    """Users are added, replaced and deleted in order."""
+    store = UserStore()
+    body = _lines(
+        {"username": "a", "password": "1", "attributes": {"x": "y"}},
+        {"username": "b", "password": "2"},
+        {"op": "delete", "username": "a"},
+        {"op": "upsert", "username": "a", "password": "3"},
+        {"username": "b", "password": "4"},
+    )
+    # Split the body across chunks, in the middle of lines.
+    result = await apply_user_changes(
+        _chunks(body[:10], body[10:50], body[50:]), store, batch_size=2
+    )
+    assert (result.upserted, result.deleted) == (4, 1)
+    assert result.changes_per_second > 0
+    assert store.get_by_username("a") == {"username": "a", "password": "3"}
+    assert store.authenticate("b", "4") is not None
+    old_session = generate_session_id({"username": "b", "password": "2"})
+    assert store.get_by_session(old_session) is None
+    assert len(store) == 2  # noqa: PLR2004
+
+
+async def test_delete_missing() -> None:
+    """Only deletes of users that exist are counted."""
+    store = UserStore()
+    store.shadowed = (UserIndex([{"username": "b", "password": "2"}]),)
+    body = _lines(
+        {"username": "a", "password": "1", "attributes": {"x": ""}},
+        {"op": "delete", "username": "b"},
+        {"op": "delete", "username": "b"},
+        {"op": "delete", "username": "c"},
+    )
+    result = await apply_user_changes(_chunks(body), store)
+    assert (result.upserted, result.deleted) == (1, 1)
+    assert store.get_by_username("a") == {
+        "username": "a",
+        "password": "1",
+        "attributes": {"x": ""},
+    }
+    assert store.is_deleted("b")
+
+
+async def test_no_trailing_newline() -> None:
+    """The last line doesn't need a newline."""
+    store = UserStore()
+    await apply_user_changes(_chunks(b'\n{"username": "a", "password": "1"}'), store)
+    assert store.get_by_username("a") is not None
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        b"not json",
+        b'{"username": "a"}',
+        b'{"op": "rename", "username": "a"}',
+        b'{"op": "delete"}',
+        b"[]",
+        b'{"username": "b", "password": null}',
+        b'{"username": "b", "password": "2", "attributes": {"age": 30}}',
+    ],
+)
+async def test_invalid(line: bytes) -> None:
+    """Invalid lines are reported, and the batches before them stay applied."""
+    store = UserStore()
+    body = _lines({"username": "a", "password": "1"}) + line + b"\n"
+    with pytest.raises(ValueError, match="line 2"):
+        await apply_user_changes(_chunks(body), store, batch_size=1)
+    assert store.get_by_username("a") is not None
+
+
+async def test_line_too_long() -> None:
+    """Lines can't be longer than the maximum."""
+    with pytest.raises(ValueError, match="shorter than"):
+        await apply_user_changes(
+            _chunks(b"x" * (MAX_LINE_SIZE + 1)), UserStore(), batch_size=1
+        )
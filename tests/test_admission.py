@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from saml_idp.admission import AdmissionLimiter, OverloadedError
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_unlimited() -> None:
+    """With no limit, requests are admitted without being counted."""
+    limiter = AdmissionLimiter()
+    async with limiter.admit(0, 0, 0), limiter.admit(0, 0, 0):
+        pass
+    assert limiter.stats().admitted == 0
+
+
+async def test_queue() -> None:
+    """Requests over the limit wait for a slot, in order."""
+    limiter = AdmissionLimiter()
+    order: list[int] = []
+    release = asyncio.Event()
+
+    async def work(n: int) -> None:
+        async with limiter.admit(1, 10, 10):
+            order.append(n)
+            await release.wait()
+
+    tasks = [asyncio.create_task(work(n)) for n in range(3)]
+    await asyncio.sleep(0)
+    stats = limiter.stats()
+    assert (stats.active, stats.waiting) == (1, 2)
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == [0, 1, 2]
+    stats = limiter.stats()
+    assert (stats.active, stats.waiting, stats.admitted) == (0, 0, 3)
+    assert stats.max_wait > 0
+    assert stats.mean_wait > 0
+
+
+async def test_queue_full() -> None:
+    """Requests are rejected once the queue is full."""
+    limiter = AdmissionLimiter()
+    async with limiter.admit(1, 0, 10):
+        with pytest.raises(OverloadedError, match="queue is full"):
+            async with limiter.admit(1, 0, 10):
+                pass
+    assert limiter.stats().rejected == 1
+    # The slot was freed.
+    async with limiter.admit(1, 0, 10):
+        pass
+
+
+async def test_timeout() -> None:
+    """Requests that wait too long are rejected, and leave the queue."""
+    limiter = AdmissionLimiter()
+    async with limiter.admit(1, 10, 10):
+        with pytest.raises(OverloadedError, match="Timed out"):
+            async with limiter.admit(1, 10, 0.01):
+                pass
+        assert limiter.stats().waiting == 0
+    stats = limiter.stats()
+    assert (stats.active, stats.rejected) == (0, 1)
+
+
+async def test_cancelled() -> None:
+    """Cancelled waiters leave the queue without taking the slot."""
+    limiter = AdmissionLimiter()
+    async with limiter.admit(1, 10, 10):
+        task = asyncio.create_task(limiter.admit(1, 10, 10).__aenter__())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert limiter.stats().waiting == 0
+    assert limiter.stats().active == 0
@@ -0,0 +1,84 @@
+import asyncio
+import itertools
+from collections.abc import Awaitable, Callable
+
+import pytest
+
+from saml_idp.assertion_pool import MAX_REFILLS, AssertionPool
+
+pytestmark = pytest.mark.asyncio
+
+
+def _minter() -> tuple[list[str], Callable[[], Awaitable[str]]]:
+    minted: list[str] = []
+    counter = itertools.count()
+
+    async def mint() -> str:
+        minted.append(response := f"response{next(counter)}")
+        return response
+
+    return minted, mint
+
+
+async def test_refill_and_take() -> None:
+    """A pool is refilled up to its depth, and responses come out in order."""
+    pool = AssertionPool()
+    minted, mint = _minter()
+    assert pool.take("a") is None
+    await pool.refill("a", mint, 3, 60)
+    assert pool.size("a") == 3  # noqa: PLR2004
+    assert pool.take("a") == "response0"
+    await pool.refill("a", mint, 3, 60)
+    assert minted == ["response0", "response1", "response2", "response3"]
+    assert pool.take("b") is None
+
+
+async def test_expired() -> None:
+    """Expired responses are never handed out, and are dropped on refill."""
+    pool = AssertionPool()
+    minted, mint = _minter()
+    await pool.refill("a", mint, 2, 0)
+    assert pool.take("a") is None
+    await pool.refill("a", mint, 2, 0)
+    await pool.refill("a", mint, 2, 60)
+    assert pool.size("a") == 2  # noqa: PLR2004
+    assert pool.take("a") == minted[-2]
+
+
+async def test_schedule_refill() -> None:
+    """Only one refill runs at a time for a pool."""
+    pool = AssertionPool()
+    minted, mint = _minter()
+    pool.schedule_refill("a", mint, 2, 60)
+    pool.schedule_refill("a", mint, 2, 60)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert len(minted) == 2  # noqa: PLR2004
+    pool.clear()
+    assert pool.size("a") == 0
+
+
+async def test_schedule_refill_limit() -> None:
+    """Only a few pools are refilled at once."""
+    pool = AssertionPool()
+    minted, mint = _minter()
+    for key in range(MAX_REFILLS + 5):
+        pool.schedule_refill(key, mint, 1, 60)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert len(minted) == MAX_REFILLS
+    pool.schedule_refill("later", mint, 1, 60)
+    await asyncio.sleep(0)
+    assert pool.size("later") == 1
+    pool.clear()
+
+
+async def test_refill_error() -> None:
+    """Errors while minting don't escape the refill."""
+    pool = AssertionPool()
+
+    async def mint() -> str:
+        raise RuntimeError
+
+    await pool.refill("a", mint, 2, 60)
+    assert pool.size("a") == 0
@@ -3,6 +3,7 @@ from pathlib import Path
 import pytest
 
 from saml_idp import Settings
+from saml_idp.users import UserRecord
 
 path = Path(__file__).parent.resolve() / "files"
 
@@ -77,3 +78,179 @@ async def test_get_user_from_session_fail() -> None:
         settings.generate_session_id({"username": "a", "password": "b"}),
     )
     assert user is None
+
+
+@pytest.mark.asyncio
+async def test_get_user_from_session_reassigned() -> None:
+    """Replacing the users keeps the session index in sync."""
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "taylorswift", "password": "all2well"}]',  # pyright: ignore[reportArgumentType]
+    )
+    old_session = settings.generate_session_id(
+        {"username": "taylorswift", "password": "all2well"},
+    )
+    settings.saml_idp_users = [{"username": "davidbowie", "password": "starman"}]
+    assert await settings.get_user_from_session(old_session) is None
+    user = await settings.get_user_from_session(
+        settings.generate_session_id({"username": "davidbowie", "password": "starman"}),
+    )
+    assert user is not None
+    assert user["username"] == "davidbowie"
+
+
+@pytest.mark.asyncio
+async def test_token_sessions() -> None:
+    """Token sessions identify the user, and carry over the SPs visited."""
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "taylorswift", "password": "all2well"}]',  # pyright: ignore[reportArgumentType]
+        saml_idp_session_format="token",
+        saml_idp_secret_key="secret",
+    )
+    user, session_id = await settings.authenticate_user("taylorswift", "all2well")
+    assert session_id != settings.generate_session_id(user)
+    assert await settings.get_user_from_session(session_id) is user
+    assert await settings.get_user_from_session(session_id + "x") is None
+
+    first = settings.get_session(session_id)
+    assert first is not None
+    session_id = settings.create_session(user, "https://sp.example.com", session_id)
+    session = settings.get_session(session_id)
+    assert session is not None
+    assert session.sps == ("https://sp.example.com",)
+    assert session.session_index == first.session_index
+
+    settings.saml_idp_users = [{"username": "davidbowie", "password": "starman"}]
+    assert await settings.get_user_from_session(session_id) is None
+
+
+def test_token_sessions_secret() -> None:
+    """Token sessions require a secret key."""
+    with pytest.raises(ValueError, match="secret key"):
+        Settings(saml_idp_entity_id="x", saml_idp_session_format="token")
+
+
+def test_state_backend_checked() -> None:
+    """An unsupported state backend is rejected on startup."""
+    with pytest.raises(ValueError, match="Unsupported state backend"):
+        Settings(saml_idp_state_backend="redis://localhost")
+
+
+@pytest.mark.asyncio
+async def test_users_file(tmp_path: Path) -> None:
+    """Users can also come from a file."""
+    users_path = tmp_path / "users.csv"
+    users_path.write_text(
+        "username,password,email\ndavidbowie,starman,db@example.com\n"
+    )
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "taylorswift", "password": "all2well"}]',  # pyright: ignore[reportArgumentType]
+        saml_idp_users_file=str(users_path),
+    )
+    user, session_id = await settings.authenticate_user("davidbowie", "starman")
+    assert user["attributes"] == {"email": "db@example.com"}
+    assert await settings.get_user_from_session(session_id) == user
+    user, session_id = await settings.authenticate_user("taylorswift", "all2well")
+    assert await settings.get_user_from_session(session_id) is user
+
+    settings.saml_idp_users_file = ""
+    with pytest.raises(ValueError, match="Invalid username or password"):
+        await settings.authenticate_user("davidbowie", "starman")
+
+
+@pytest.mark.asyncio
+async def test_users_loaded_lazily(tmp_path: Path) -> None:
+    """The users file is only read when the users are first needed."""
+    users_path = tmp_path / "users.csv"
+    settings = Settings(saml_idp_entity_id="x", saml_idp_users_file=str(users_path))
+    users_path.write_text("username,password\ndavidbowie,starman\n")
+    await settings.authenticate_user("davidbowie", "starman")
+
+
+@pytest.mark.asyncio
+async def test_synthetic_users() -> None:
+    """Synthetic users work alongside the static users."""
+    synthetic = '{"username": "user{n}", "password": "pass{n}", "count": 10}'
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "taylorswift", "password": "all2well"}]',  # pyright: ignore[reportArgumentType]
+        saml_idp_synthetic_users=synthetic,  # pyright: ignore[reportArgumentType]
+    )
+    user, session_id = await settings.authenticate_user("user9", "pass9")
+    assert await settings.get_user_from_session(session_id) == user
+    assert settings.create_session(user) == session_id
+    user, session_id = await settings.authenticate_user("taylorswift", "all2well")
+    assert await settings.get_user_from_session(session_id) is user
+    with pytest.raises(ValueError, match="Invalid username or password"):
+        await settings.authenticate_user("user10", "pass10")
+
+
+@pytest.mark.asyncio
+async def test_synthetic_users_shadowed() -> None:
+    """A user who shadows an identical synthetic user gets a session of their own."""
+    synthetic = '{"username": "user{n}", "password": "pass{n}", "count": 10}'
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "user3", "password": "pass3"}]',  # pyright: ignore[reportArgumentType]
+        saml_idp_synthetic_users=synthetic,  # pyright: ignore[reportArgumentType]
+    )
+    user, session_id = await settings.authenticate_user("user3", "pass3")
+    assert settings.create_session(user) == session_id
+    assert await settings.get_user_from_session(session_id) is user
+
+
+@pytest.mark.asyncio
+async def test_search_users() -> None:
+    """Users can be searched, and the index follows changes to the users."""
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "taylorswift", "password": "all2well"}, {"username": "davidbowie", "password": "starman"}, {"username": "taylorhawkins", "password": "drums"}]',  # pyright: ignore[reportArgumentType]  # noqa: E501
+    )
+    total, users = settings.search_users("taylor", 0, 1)
+    assert total == 2  # noqa: PLR2004
+    assert [user["username"] for user in users] == ["taylorhawkins"]
+
+    settings.admin_users.apply([UserRecord("taylorx", "x", (), ())], [])
+    assert settings.search_users("taylor", 2, 10) == (2, [])
+    await settings.reindex_users()
+    total, users = settings.search_users("taylor", 2, 10)
+    assert total == 3  # noqa: PLR2004
+    assert [user["username"] for user in users] == ["taylorx"]
+
+    settings.saml_idp_users = [{"username": "davidbowie", "password": "starman"}]
+    total, users = settings.search_users("taylor", 0, 10)
+    assert total == 1
+    assert [user["username"] for user in users] == ["taylorx"]
+
+
+@pytest.mark.asyncio
+async def test_admin_users_shadow() -> None:
+    """Admin users replace and delete the configured users with the same name."""
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "alice", "password": "old"}]',  # pyright: ignore[reportArgumentType]
+    )
+    _, old_session = await settings.authenticate_user("alice", "old")
+
+    settings.admin_users.apply([UserRecord("alice", "new", (), ())], [])
+    with pytest.raises(ValueError, match="Invalid username or password"):
+        await settings.authenticate_user("alice", "old")
+    assert await settings.get_user_from_session(old_session) is None
+    user, session_id = await settings.authenticate_user("alice", "new")
+    assert await settings.get_user_from_session(session_id) == user
+
+    assert settings.admin_users.apply([], ["alice"]) == 1
+    assert settings.admin_users.apply([], ["alice", "nobody"]) == 0
+    for password in ("old", "new"):
+        with pytest.raises(ValueError, match="Invalid username or password"):
+            await settings.authenticate_user("alice", password)
+    assert await settings.get_user_from_session(old_session) is None
+    assert await settings.get_user_from_session(session_id) is None
+    assert settings.get_user_by_username("alice") is None
+    await settings.reindex_users()
+    assert settings.search_users("", 0, 10) == (0, [])
+
+    settings.admin_users.apply([UserRecord("alice", "old", (), ())], [])
+    assert await settings.get_user_from_session(old_session) is not None
@@ -0,0 +1,83 @@
+import binascii
+
+import pytest
+
+from saml_idp.config import settings
+from saml_idp.loadgen import (
+    SpSimulator,
+    format_report,
+    main,
+    percentile,
+    run_load,
+)
+
+
+@pytest.fixture(autouse=True)
+def _set_users() -> None:
+    """Add a user, and a logout URL for the SP."""
+    settings.saml_idp_users = [{"username": "taylorswift", "password": "all2well"}]
+    settings.saml_idp_secret_key = ""
+    settings.saml_idp_logout_url = "https://example.com/logout"
+
+
+def test_percentile() -> None:
+    """Percentiles use the nearest rank."""
+    values = [float(n) for n in range(1, 101)]
+    assert percentile(values, 0.5) == 50  # noqa: PLR2004
+    assert percentile(values, 0.99) == 99  # noqa: PLR2004
+    assert percentile([3.0], 0.95) == 3  # noqa: PLR2004
+    assert percentile([], 0.5) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_load() -> None:
+    """SSO flows run end to end against the in-process router."""
+    report = await run_load(
+        username="taylorswift", password="all2well", concurrency=3, flows=5
+    )
+    assert report.errors == 0
+    assert report.flows == 5  # noqa: PLR2004
+    assert [step.name for step in report.steps] == [
+        "signin",
+        "login",
+        "verify",
+        "logout",
+    ]
+    for step in report.steps:
+        assert step.count == 5  # noqa: PLR2004
+        assert 0 < step.p50 <= step.p95 <= step.p99
+    assert "5 flows" in format_report(report)
+
+
+@pytest.mark.asyncio
+async def test_run_load_errors() -> None:
+    """Failed steps are counted as errors."""
+    report = await run_load(
+        username="taylorswift", password="wrong", concurrency=2, flows=2
+    )
+    assert (report.flows, report.errors) == (0, 2)
+    errors = {step.name: step.errors for step in report.steps}
+    assert errors == {"signin": 0, "login": 2, "verify": 0, "logout": 0}
+
+
+@pytest.mark.asyncio
+async def test_run_load_unexpected_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Unexpected errors are counted too, and don't end the run."""
+
+    def read_response(_html: bytes) -> None:
+        msg = "Incorrect padding"
+        raise binascii.Error(msg)
+
+    monkeypatch.setattr(SpSimulator, "read_response", staticmethod(read_response))
+    report = await run_load(
+        username="taylorswift", password="all2well", concurrency=2, flows=3
+    )
+    assert (report.flows, report.errors) == (0, 3)
+    errors = {step.name: step.errors for step in report.steps}
+    assert errors == {"signin": 0, "login": 3, "verify": 0, "logout": 0}
+
+
+def test_main(capsys: pytest.CaptureFixture[str]) -> None:
+    """The command line defaults to the first user."""
+    assert main(["-c", "1", "-n", "2", "--no-verify"]) == 0
+    assert "2 flows" in capsys.readouterr().out
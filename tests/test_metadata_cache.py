@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+from collections.abc import Callable
+
+import pytest
+
+from saml_idp import metadata_cache
+from saml_idp.metadata_cache import MetadataCache, accepts_gzip, etag_matches
+
+
+def test_cached() -> None:
+    """Metadata is only built once per key."""
+    cache = MetadataCache()
+    calls: list[int] = []
+
+    def build() -> bytes:
+        calls.append(1)
+        return b"<xml/>"
+
+    entry = cache.get("a", "cert", build, 60)
+    assert cache.get("a", "cert", build, 60) is entry
+    assert len(calls) == 1
+    assert entry.body == b"<xml/>"
+    assert entry.etag.startswith('"')
+    assert 0 < entry.max_age() <= 60  # noqa: PLR2004
+
+    cache.get("b", "cert", build, 60)
+    assert len(calls) == 2  # noqa: PLR2004
+
+
+def test_stale() -> None:
+    """Stale metadata is rebuilt."""
+    cache = MetadataCache()
+    bodies = iter([b"<one/>", b"<two/>"])
+    first = cache.get("a", "cert", lambda: next(bodies), 0)
+    second = cache.get("a", "cert", lambda: next(bodies), 0)
+    assert first.etag != second.etag
+
+
+def test_max_entries() -> None:
+    """The least recently used entry is dropped once the cache is full."""
+    cache = MetadataCache(max_entries=2)
+    calls: list[str] = []
+
+    def builder(name: str) -> Callable[[], bytes]:
+        def build() -> bytes:
+            calls.append(name)
+            return f"<{name}/>".encode()
+
+        return build
+
+    cache.get("a", "cert", builder("a"), 60)
+    cache.get("b", "cert", builder("b"), 60)
+    cache.get("a", "cert", builder("a"), 60)
+    cache.get("c", "cert", builder("c"), 60)
+    cache.get("a", "cert", builder("a"), 60)
+    cache.get("b", "cert", builder("b"), 60)
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_material_changed() -> None:
+    """Changing the certificate invalidates every entry."""
+    cache = MetadataCache()
+    cache.get("a", "cert", lambda: b"<one/>", 60)
+    entry = cache.get("a", "new cert", lambda: b"<two/>", 60)
+    assert entry.body == b"<two/>"
+
+
+def test_single_flight() -> None:
+    """Concurrent requests for a missing entry only build it once."""
+    cache = MetadataCache()
+    calls: list[int] = []
+
+    def build() -> bytes:
+        calls.append(1)
+        time.sleep(0.05)
+        return b"<xml/>"
+
+    threads = [
+        threading.Thread(target=cache.get, args=("a", "cert", build, 60))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+def test_build_other_keys() -> None:
+    """Building one entry doesn't hold up the others."""
+    cache = MetadataCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow() -> bytes:
+        started.set()
+        release.wait(5)
+        return b"<slow/>"
+
+    thread = threading.Thread(target=cache.get, args=("a", "cert", slow, 60))
+    thread.start()
+    try:
+        started.wait(5)
+        assert cache.get("b", "cert", lambda: b"<b/>", 60).body == b"<b/>"
+    finally:
+        release.set()
+        thread.join()
+    assert cache.get("a", "cert", lambda: b"<unused/>", 60).body == b"<slow/>"
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        (None, False),
+        ("", False),
+        ("gzip", True),
+        ("deflate, GZIP;q=0.5", True),
+        ("gzip;q=0", False),
+        ("gzip; q=0.0, *", False),
+        ("x-gzip", False),
+        ("br, *;q=0.1", True),
+        ("*;q=0", False),
+        ("gzip;q=x", False),
+    ],
+)
+def test_accepts_gzip(header: str | None, *, expected: bool) -> None:
+    """Gzip is only served when the Accept-Encoding header allows it."""
+    assert accepts_gzip(header) is expected
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        (None, False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+    ],
+)
+def test_etag_matches(header: str | None, *, expected: bool) -> None:
+    """If-None-Match headers are matched against the ETag."""
+    assert etag_matches(header, '"abc"') is expected
+
+
+def test_refresh() -> None:
+    """Refreshing rebuilds every entry."""
+    cache = MetadataCache()
+    bodies = iter([b"<one/>", b"<two/>"])
+    first = cache.get("a", "cert", lambda: next(bodies), 60)
+    cache.refresh(60)
+    second = cache.get("a", "cert", lambda: b"<unused/>", 60)
+    assert first.body == b"<one/>"
+    assert second.body == b"<two/>"
+
+
+def test_refresh_unused() -> None:
+    """Refreshing drops the entries that weren't used recently."""
+    cache = MetadataCache()
+    cache.get("a", "cert", lambda: b"<one/>", 60)
+    cache.refresh(-1)
+    assert cache.get("a", "cert", lambda: b"<two/>", 60).body == b"<two/>"
+
+
+@pytest.mark.asyncio
+async def test_refresh_periodically(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Entries are refreshed in the background."""
+    monkeypatch.setattr(metadata_cache, "MIN_REFRESH_INTERVAL", 0.01)
+    cache = MetadataCache()
+    bodies = (f"<n{i}/>".encode() for i in range(100))
+    first = cache.get("a", "cert", lambda: next(bodies), 0.2)
+    task = asyncio.create_task(cache.refresh_periodically(0.2))
+    await asyncio.sleep(0.15)
+    task.cancel()
+    assert cache.get("a", "cert", lambda: b"<unused/>", 60).body != first.body
+    assert cache.get("a", "cert", lambda: b"<unused/>", 60).body != b"<unused/>"
+
+
+@pytest.mark.asyncio
+async def test_refresh_interval(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A max age of 0 doesn't refresh the entries in a busy loop."""
+    refreshes: list[float] = []
+    cache = MetadataCache()
+    monkeypatch.setattr(cache, "refresh", refreshes.append)
+    monkeypatch.setattr(metadata_cache, "MIN_REFRESH_INTERVAL", 0.02)
+    task = asyncio.create_task(cache.refresh_periodically(0))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    assert 1 <= len(refreshes) <= 3  # noqa: PLR2004
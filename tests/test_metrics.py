@@ -0,0 +1,50 @@
+from saml_idp.metrics import (
+    Histogram,
+    Sample,
+    render_metrics,
+    request_timings,
+    stage,
+)
+
+
+def test_histogram() -> None:
+    """Values are counted in the first bucket they fit in."""
+    histogram = Histogram("test", (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4  # noqa: PLR2004
+    assert histogram.sum == 2.65  # noqa: PLR2004
+    histogram.clear()
+    assert (histogram.count, histogram.sum) == (0, 0.0)
+
+
+def test_render_metrics() -> None:
+    """Stages are rendered as cumulative histograms, along with other samples."""
+    histogram = stage("test")
+    histogram.clear()
+    histogram.observe(0.0003)
+    histogram.observe(10)
+    text = render_metrics([Sample("saml_idp_things", "gauge", "Things.", 3)])
+    lines = text.splitlines()
+    assert 'saml_idp_stage_seconds_bucket{stage="test",le="0.00025"} 0' in lines
+    assert 'saml_idp_stage_seconds_bucket{stage="test",le="0.0005"} 1' in lines
+    assert 'saml_idp_stage_seconds_bucket{stage="test",le="5.0"} 1' in lines
+    assert 'saml_idp_stage_seconds_bucket{stage="test",le="+Inf"} 2' in lines
+    assert 'saml_idp_stage_seconds_count{stage="test"} 2' in lines
+    assert "# TYPE saml_idp_things gauge" in lines
+    assert "saml_idp_things 3" in lines
+    assert text.endswith("\n")
+
+
+def test_request_timings() -> None:
+    """Observed values are added to the request's timings, if they're collected."""
+    histogram = stage("test")
+    histogram.observe(1)
+    token = request_timings.set({})
+    try:
+        histogram.observe(0.25)
+        histogram.observe(0.5)
+        assert request_timings.get() == {"test": 0.75}
+    finally:
+        request_timings.reset(token)
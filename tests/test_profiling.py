@@ -0,0 +1,76 @@
+import cProfile
+import marshal
+import pstats
+
+import pytest
+from pydantic import ValidationError
+from starlette.requests import Request
+from starlette.responses import Response
+
+from saml_idp.profiling import (
+    ProfilingRequest,
+    RequestProfiler,
+    dump_collapsed,
+    dump_pstats,
+)
+
+
+async def _handler(_request: Request) -> Response:
+    sum(range(1000))
+    return Response("ok")
+
+
+def _request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+
+def test_profiling_request() -> None:
+    """Profiling has to be limited by a number of requests or a duration."""
+    with pytest.raises(ValidationError, match="Either requests or seconds"):
+        ProfilingRequest()
+    with pytest.raises(ValidationError):
+        ProfilingRequest(requests=1, rate=0)
+
+
+@pytest.mark.asyncio
+async def test_next_requests() -> None:
+    """The next N requests are profiled, and aggregated by route."""
+    profiler = RequestProfiler()
+    profiler.start(ProfilingRequest(requests=3))
+    for route in ("/a", "/b", "/a", "/a"):
+        response = await profiler.run(route, _handler, _request())
+        assert response.body == b"ok"
+    status = profiler.status()
+    assert not status.active
+    assert status.routes == {"/a": 2, "/b": 1}
+    assert profiler.stats("/a") is not None
+    assert profiler.stats("/c") is None
+    assert profiler.stats() is not None
+
+    profiler.clear()
+    assert profiler.status().routes == {}
+    assert profiler.stats() is None
+
+
+@pytest.mark.asyncio
+async def test_duration() -> None:
+    """Profiling for a duration stops once it's over."""
+    profiler = RequestProfiler()
+    profiler.start(ProfilingRequest(seconds=0.000001))
+    await profiler.run("/a", _handler, _request())
+    assert not profiler.active
+    assert profiler.status().routes == {}
+
+
+def test_dump() -> None:
+    """Profiles can be serialized as pstats files or collapsed stacks."""
+    profile = cProfile.Profile()
+    profile.runcall(sorted, [str(n) for n in range(1000)])
+    stats = pstats.Stats(profile)
+    assert marshal.loads(dump_pstats(stats)) == stats.stats  # pyright: ignore[reportAttributeAccessIssue]
+    lines = dump_collapsed(stats).splitlines()
+    assert lines
+    for line in lines:
+        stack, micros = line.rsplit(" ", 1)
+        assert stack
+        assert int(micros) > 0
@@ -0,0 +1,114 @@
+import json
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from saml_idp import Settings, reload
+from saml_idp.config import build_user_sources
+from saml_idp.reload import UserReloader
+from saml_idp.users import UserSource
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_reload_users_file(tmp_path: Path) -> None:
+    """The users file is reloaded when it changes."""
+    users_file = tmp_path / "users.csv"
+    users_file.write_text("username,password\ndavidbowie,starman\n")
+    settings = Settings(saml_idp_entity_id="x", saml_idp_users_file=str(users_file))
+    reloader = UserReloader(settings, env_file=str(tmp_path / ".env"))
+    assert not await reloader.check()
+
+    users_file.write_text("username,password\ndavidbowie,changes\ndavidlynch,x\n")
+    assert await reloader.check()
+    assert reloader.last_duration is not None
+    assert settings.search_users("david", 0, 10)[0] == 2  # noqa: PLR2004
+    await settings.authenticate_user("davidbowie", "changes")
+    with pytest.raises(ValueError, match="Invalid username or password"):
+        await settings.authenticate_user("davidbowie", "starman")
+    assert not await reloader.check()
+
+
+async def test_reload_env_file(tmp_path: Path) -> None:
+    """The users are reloaded when the .env file changes."""
+    env_file = tmp_path / ".env"
+    settings = Settings(
+        saml_idp_entity_id="x",
+        saml_idp_users='[{"username": "taylorswift", "password": "all2well"}]',  # pyright: ignore[reportArgumentType]
+    )
+    reloader = UserReloader(settings, env_file=str(env_file))
+    users = [{"username": "davidbowie", "password": "starman"}]
+    env_file.write_text(f"SAML_IDP_USERS='{json.dumps(users)}'\n")
+    assert await reloader.check()
+    assert settings.saml_idp_users == users
+    await settings.authenticate_user("davidbowie", "starman")
+    with pytest.raises(ValueError, match="Invalid username or password"):
+        await settings.authenticate_user("taylorswift", "all2well")
+
+
+async def test_reload_invalid(tmp_path: Path) -> None:
+    """An invalid users file keeps the current users, and is retried."""
+    users_file = tmp_path / "users.jsonl"
+    users_file.write_text('{"username": "davidbowie", "password": "starman"}\n')
+    settings = Settings(saml_idp_entity_id="x", saml_idp_users_file=str(users_file))
+    settings.load_users()
+    reloader = UserReloader(settings, env_file=str(tmp_path / ".env"))
+
+    users_file.write_text('{"username": "davidbowie"}\n')
+    with pytest.raises(ValueError, match="Invalid user"):
+        await reloader.check()
+    await settings.authenticate_user("davidbowie", "starman")
+
+    users_file.write_text('{"username": "davidbowie", "password": "changes"}\n')
+    assert await reloader.check()
+    await settings.authenticate_user("davidbowie", "changes")
+
+
+def _build_and_write(users_file: Path) -> Callable[..., tuple[UserSource, ...]]:
+    """Return a `build_user_sources` that changes the users file once it's read."""
+
+    def build_and_write(*args: Any) -> tuple[UserSource, ...]:
+        sources = build_user_sources(*args)
+        users_file.write_text("username,password\ndavidbowie,latest\n")
+        return sources
+
+    return build_and_write
+
+
+async def test_reload_write_during_load(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A write made while the users are loaded is picked up by the next check."""
+    users_file = tmp_path / "users.csv"
+    users_file.write_text("username,password\ndavidbowie,starman\n")
+    settings = Settings(saml_idp_entity_id="x", saml_idp_users_file=str(users_file))
+    reloader = UserReloader(settings, env_file=str(tmp_path / ".env"))
+
+    users_file.write_text("username,password\ndavidbowie,changes\n")
+    with monkeypatch.context() as patch:
+        patch.setattr(reload, "build_user_sources", _build_and_write(users_file))
+        assert await reloader.check()
+    await settings.authenticate_user("davidbowie", "changes")
+    assert await reloader.check()
+    await settings.authenticate_user("davidbowie", "latest")
+
+
+async def test_reload_new_users_file(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A new users file from the .env file is watched from before it's read."""
+    env_file = tmp_path / ".env"
+    users_file = tmp_path / "users.csv"
+    users_file.write_text("username,password\ndavidbowie,starman\n")
+    settings = Settings(saml_idp_entity_id="x")
+    reloader = UserReloader(settings, env_file=str(env_file))
+
+    env_file.write_text(f"SAML_IDP_USERS_FILE={users_file}\n")
+    with monkeypatch.context() as patch:
+        patch.setattr(reload, "build_user_sources", _build_and_write(users_file))
+        assert await reloader.check()
+    await settings.authenticate_user("davidbowie", "starman")
+    assert await reloader.check()
+    await settings.authenticate_user("davidbowie", "latest")
@@ -0,0 +1,42 @@
+from saml_idp.replay import ReplayCache
+
+
+def test_replay() -> None:
+    """IDs are rejected while they're in the window."""
+    cache = ReplayCache(window=60, slots=6)
+    assert cache.add("issuer", "_a", now=0)
+    assert not cache.add("issuer", "_a", now=59)
+    assert cache.add("other", "_a", now=59)
+    assert cache.add("issuer", "_b", now=59)
+    assert len(cache) == 3  # noqa: PLR2004
+
+
+def test_expiry() -> None:
+    """IDs are forgotten after the window, plus at most one tick."""
+    cache = ReplayCache(window=60, slots=6)
+    cache.add("issuer", "_a", now=0)
+    assert not cache.add("issuer", "_a", now=69.9)
+    assert cache.add("issuer", "_a", now=70.1)
+    assert len(cache) == 1
+
+
+def test_long_gap() -> None:
+    """Turning the wheel more than once forgets everything."""
+    cache = ReplayCache(window=60, slots=6)
+    for i in range(100):
+        cache.add("issuer", f"_{i}", now=i)
+    cache.add("issuer", "_new", now=10_000)
+    assert len(cache) == 1
+
+
+def test_full() -> None:
+    """When the cache is full, the oldest IDs are forgotten first."""
+    cache = ReplayCache(window=60, slots=6, max_entries=2)
+    cache.add("issuer", "_a", now=0)
+    cache.add("issuer", "_b", now=15)
+    cache.add("issuer", "_c", now=25)
+    assert len(cache) == 2  # noqa: PLR2004
+    assert cache.add("issuer", "_a", now=26)
+    assert not cache.add("issuer", "_c", now=27)
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from saml_idp.request_cache import RequestCache
+
+
+class Decoder:
+    """Count the decoded requests."""
+
+    def __init__(self) -> None:
+        """Start counting."""
+        self.calls = 0
+
+    def __call__(self) -> object:
+        """Decode a request."""
+        self.calls += 1
+        return object()
+
+
+def in_an_hour(_value: object) -> float:
+    """Expire an hour from now."""
+    return time.time() + 3600
+
+
+def test_hit() -> None:
+    """Repeated requests are decoded once."""
+    cache = RequestCache()
+    decode = Decoder()
+    first = cache.get("kind", "data", decode, in_an_hour, 10)
+    assert cache.get("kind", b"data", decode, in_an_hour, 10) is first
+    assert decode.calls == 1
+    assert cache.get("other", "data", decode, in_an_hour, 10) is not first
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 2, 2)
+    assert stats.hit_rate == pytest.approx(1 / 3)
+
+
+def test_expired() -> None:
+    """Requests are never cached past their validity."""
+    cache = RequestCache()
+    decode = Decoder()
+    cache.get("kind", "data", decode, lambda _: time.time() - 1, 10)
+    cache.get("kind", "data", decode, lambda _: time.time() + 0.01, 10)
+    time.sleep(0.02)
+    cache.get("kind", "data", decode, in_an_hour, 10)
+    assert decode.calls == 3  # noqa: PLR2004
+
+
+def test_lru() -> None:
+    """The least recently used requests are evicted first."""
+    cache = RequestCache()
+    decode = Decoder()
+    cache.get("kind", "a", decode, in_an_hour, 2)
+    cache.get("kind", "b", decode, in_an_hour, 2)
+    cache.get("kind", "a", decode, in_an_hour, 2)
+    cache.get("kind", "c", decode, in_an_hour, 2)
+    assert decode.calls == 3  # noqa: PLR2004
+    cache.get("kind", "a", decode, in_an_hour, 2)
+    assert decode.calls == 3  # noqa: PLR2004
+    cache.get("kind", "b", decode, in_an_hour, 2)
+    assert decode.calls == 4  # noqa: PLR2004
+    cache.clear()
+    assert cache.stats() == (0, 0, 0)
+
+
+def test_errors_not_cached() -> None:
+    """Requests that fail to decode aren't cached."""
+    cache = RequestCache()
+
+    def fail() -> object:
+        msg = "Bad request"
+        raise ValueError(msg)
+
+    for _ in range(2):
+        with pytest.raises(ValueError, match="Bad request"):
+            cache.get("kind", "data", fail, in_an_hour, 10)
+    assert cache.stats() == (0, 2, 0)
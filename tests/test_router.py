@@ -1,14 +1,25 @@
+import asyncio
+import base64
 from datetime import UTC, datetime, timedelta
 from pathlib import Path
 
 import pytest
-from httpx import AsyncClient, Cookies
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient, Cookies
 from lxml import etree
+from signxml import XMLVerifier
 from starlette import status
 
 from saml_idp import Settings
+from saml_idp.admission import admission_limiter
+from saml_idp.assertion_pool import assertion_pool
 from saml_idp.config import User, settings
+from saml_idp.replay import replay_cache
+from saml_idp.router import lifespan, router
+from saml_idp.state import close_state_backends
 from saml_idp.utils import deflate_and_encode, saml2_timestamp
+from tests.conftest import KeyAndCert
 
 pytestmark = pytest.mark.asyncio
 
@@ -18,6 +29,12 @@ def _set_users() -> None:
     """Add users for these tests."""
     settings.saml_idp_users = [{"username": "taylorswift", "password": "all2well"}]
     settings.saml_idp_secret_key = ""
+    settings.saml_idp_sign_metadata = False
+    settings.saml_idp_assertion_pool_depth = 0
+    settings.saml_idp_reject_replays = False
+    settings.saml_idp_session_format = "hash"
+    settings.saml_idp_max_concurrent_responses = 0
+    replay_cache.clear()
 
 
 @pytest.fixture
@@ -36,6 +53,7 @@ async def test_metadata_xml(ac: AsyncClient) -> None:
     assert "http://example.com/saml" in xml
     assert "http://test/signin" in xml
     assert "http://test/logout" in xml
+    assert "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256" in xml
 
     # Make sure the metadata validates
     schema_doc = (
@@ -47,6 +65,77 @@ async def test_metadata_xml(ac: AsyncClient) -> None:
         schema.assertValid(etree.fromstring(xml))
 
 
+async def test_metadata_xml_cached(ac: AsyncClient) -> None:
+    """The metadata is cached and can be revalidated with its ETag."""
+    response = await ac.get("/metadata.xml")
+    etag = response.headers["etag"]
+    assert response.headers["content-encoding"] == "gzip"
+    assert "max-age=" in response.headers["cache-control"]
+
+    response = await ac.get("/metadata.xml", headers={"Accept-Encoding": "identity"})
+    assert response.headers["etag"] == etag
+    assert "content-encoding" not in response.headers
+    assert b"EntityDescriptor" in response.content
+
+    response = await ac.get("/metadata.xml", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in response.headers
+
+    # Equivalent hosts share the cached entry.
+    response = await ac.get("/metadata.xml", headers={"Host": "TEST:80"})
+    assert response.headers["etag"] == etag
+
+    response = await ac.get("/metadata.xml", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+
+async def test_metadata_xml_cert_changed(ac: AsyncClient) -> None:
+    """Changing the certificate changes the metadata."""
+    response = await ac.get("/metadata.xml")
+    etag = response.headers["etag"]
+    cert_file = Path(__file__).parent.resolve() / "files" / "metadata.crt"
+    settings.saml_idp_metadata_cert = cert_file.read_text()
+    response = await ac.get("/metadata.xml", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+
+
+async def test_metadata_xml_signed(ac: AsyncClient) -> None:
+    """The metadata can be signed."""
+    settings.saml_idp_sign_metadata = True
+    response = await ac.get("/metadata.xml")
+    assert response.status_code == status.HTTP_200_OK
+    xml = etree.fromstring(response.content)
+    XMLVerifier().verify(xml, x509_cert=settings.saml_idp_metadata_cert)
+
+    schema_doc = (
+        Path(__file__).parent.resolve() / "schema" / "saml-schema-metadata-2.0.xsd"
+    )
+    with schema_doc.open("rb") as f:
+        schema = etree.XMLSchema(etree.parse(f))
+        schema.assertValid(xml)
+
+
+async def test_lifespan() -> None:
+    """The lifespan starts and stops the background tasks."""
+    settings.saml_idp_sign_metadata = True
+    settings.saml_idp_users_reload_interval = 60
+    try:
+        async with lifespan(FastAPI()):
+            pass
+    finally:
+        settings.saml_idp_users_reload_interval = 0
+
+
+async def test_lifespan_unsupported_key(key_and_cert: KeyAndCert) -> None:
+    """A key that can't sign is rejected on startup."""
+    key, cert = key_and_cert(ed25519.Ed25519PrivateKey.generate())
+    settings.saml_idp_metadata_key, settings.saml_idp_metadata_cert = key, cert
+    with pytest.raises(ValueError, match="Unsupported signing key type"):
+        async with lifespan(FastAPI()):
+            pass
+
+
 async def test_metadata_xml_base_url(ac: AsyncClient) -> None:
     """You can use the base URL to change the signin/logout URLs."""
     settings.saml_idp_base_url = "https://example.com"
@@ -130,6 +219,66 @@ async def test_signin_auth(
     assert not relay_state or relay_state.encode() in response.content
 
 
+async def test_idp_initiated_unauth(ac: AsyncClient) -> None:
+    """IdP-initiated SSO requires a signed-in user."""
+    response = await ac.get(
+        "/idp-initiated",
+        params={"sp": "http://example.com/sp", "acs": "https://example.com/acs"},
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED, response.content
+
+
+def _saml_response(content: bytes) -> etree._Element:
+    html = etree.fromstring(content, etree.HTMLParser())
+    (value,) = html.xpath("//input[@name='SAMLResponse']/@value")
+    return etree.fromstring(base64.b64decode(value))
+
+
+@pytest.mark.parametrize("depth", [0, 2])
+async def test_idp_initiated(ac: AsyncClient, user: User, depth: int) -> None:
+    """IdP-initiated SSO sends an unsolicited response, from the pool if enabled."""
+    settings.saml_idp_assertion_pool_depth = depth
+    ac.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
+    ids = set()
+    for _ in range(3):
+        response = await ac.get(
+            "/idp-initiated",
+            params={
+                "sp": "http://example.com/sp",
+                "acs": "https://example.com/acs",
+                "RelayState": "xxxx_relay_state",
+            },
+        )
+        assert response.status_code == status.HTTP_200_OK, response.content
+        assert b"xxxx_relay_state" in response.content
+        saml_response = _saml_response(response.content)
+        assert saml_response.get("InResponseTo") is None
+        assert saml_response.get("Destination") == "https://example.com/acs"
+        ids.add(saml_response.get("ID"))
+        # Let the pool refill
+        await asyncio.sleep(0.01)
+    assert len(ids) == 3  # noqa: PLR2004
+    key = (user["username"], "http://example.com/sp", "https://example.com/acs")
+    assert assertion_pool.size(key) == depth
+
+
+async def test_signin_overloaded(ac: AsyncClient, user: User) -> None:
+    """Requests are shed when the response queue is full, and can be retried."""
+    settings.saml_idp_max_concurrent_responses = 1
+    settings.saml_idp_response_queue_size = 0
+    settings.saml_idp_reject_replays = True
+    ac.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
+    async with admission_limiter.admit(1, 0, 0):
+        response = await ac.get("/signin", params={"SAMLRequest": request()})
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+
+    # The shed request wasn't recorded as answered.
+    response = await ac.get("/signin", params={"SAMLRequest": request()})
+    assert response.status_code == status.HTTP_200_OK, response.content
+    assert b"SAMLResponse" in response.content
+
+
 async def test_signin_old(ac: AsyncClient) -> None:
     """If the issue instant is too old, it is rejected."""
     dt = datetime.now(UTC) - timedelta(days=3)
@@ -138,6 +287,30 @@ async def test_signin_old(ac: AsyncClient) -> None:
     assert response.content == b"Out of date"
 
 
+async def test_signin_too_large(ac: AsyncClient) -> None:
+    """Requests that inflate past the maximum size are rejected."""
+    bomb = deflate_and_encode("<a>" + " " * 1_000_000 + "</a>").decode()
+    response = await ac.get("/signin", params={"SAMLRequest": bomb})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+    response = await ac.get("/logout", params={"SAMLRequest": bomb})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+
+
+@pytest.mark.parametrize(
+    "saml_request",
+    [
+        base64.b64encode(b"not deflated").decode(),
+        deflate_and_encode("<samlp:AuthnRequest").decode(),
+    ],
+)
+async def test_signin_invalid(ac: AsyncClient, saml_request: str) -> None:
+    """Requests that aren't deflated XML are rejected."""
+    response = await ac.get("/signin", params={"SAMLRequest": saml_request})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+    response = await ac.get("/logout", params={"SAMLRequest": saml_request})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+
+
 async def test_login_get(ac: AsyncClient) -> None:
     """You can get the login page."""
     settings.saml_idp_show_users = False
@@ -155,6 +328,45 @@ async def test_login_show_users(ac: AsyncClient) -> None:
     assert b"taylorswift" in response.content
 
 
+async def test_login_show_users_first_page(ac: AsyncClient) -> None:
+    """Only the first page of users is shown on the login page."""
+    settings.saml_idp_show_users = True
+    settings.saml_idp_users = [
+        {"username": f"user{n:03}", "password": "x"} for n in range(50)
+    ]
+    response = await ac.get("/login")
+    assert response.status_code == status.HTTP_200_OK, response.content
+    assert b"user019" in response.content
+    assert b"user020" not in response.content
+    assert b"Show more" in response.content
+
+
+async def test_search_users(ac: AsyncClient) -> None:
+    """The users shown on the login page can be searched and paged."""
+    settings.saml_idp_show_users = True
+    settings.saml_idp_users = [
+        {"username": f"user{n:03}", "password": "x"} for n in range(50)
+    ]
+    response = await ac.get("/users", params={"prefix": "user04", "offset": 8})
+    assert response.status_code == status.HTTP_200_OK, response.content
+    assert response.json() == {
+        "total": 10,
+        "users": [
+            {"username": "user048", "password": "x"},
+            {"username": "user049", "password": "x"},
+        ],
+    }
+    response = await ac.get("/users", params={"limit": 1000})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_search_users_hidden(ac: AsyncClient) -> None:
+    """The users can't be listed unless they're shown on the login page."""
+    settings.saml_idp_show_users = False
+    response = await ac.get("/users")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 async def test_login_post_success_regular(ac: AsyncClient, user: User) -> None:
     """You can login without SAML."""
     response = await ac.post("/login", data=user)
@@ -222,6 +434,86 @@ async def test_login_post_fail_saml(
     assert not relay_state or relay_state.encode() in response.content
 
 
+async def test_replay(ac: AsyncClient, user: User) -> None:
+    """Requests that were already answered can be rejected."""
+    settings.saml_idp_reject_replays = True
+    ac.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
+    saml_request = request()
+    response = await ac.get("/signin", params={"SAMLRequest": saml_request})
+    assert response.status_code == status.HTTP_200_OK, response.content
+    response = await ac.get("/signin", params={"SAMLRequest": saml_request})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+    assert response.content == b"Replayed request"
+
+    data = {
+        "username": user["username"],
+        "password": user["password"],
+        "saml_request_id": "_c0bce021-ddb3-47cb-848b-b257fbbcb9f4",
+        "destination": "https://example.com/saml2/idpresponse",
+        "request_issuer": "http://example.com/myissuer",
+    }
+    response = await ac.post("/login", data=data)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+    response = await ac.post("/login", data={**data, "saml_request_id": "_other"})
+    assert response.status_code == status.HTTP_200_OK, response.content
+
+    settings.saml_idp_logout_url = "https://example.com/logout"
+    saml_request = logout()
+    response = await ac.get("/logout", params={"SAMLRequest": saml_request})
+    assert response.status_code == status.HTTP_200_OK, response.content
+    response = await ac.get("/logout", params={"SAMLRequest": saml_request})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+
+
+async def test_replay_shared(ac: AsyncClient, user: User, tmp_path: Path) -> None:
+    """Answered requests can be kept in a shared state backend."""
+    settings.saml_idp_reject_replays = True
+    settings.saml_idp_state_backend = f"sqlite:///{tmp_path / 'state.db'}"
+    ac.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
+    saml_request = request()
+    try:
+        response = await ac.get("/signin", params={"SAMLRequest": saml_request})
+        assert response.status_code == status.HTTP_200_OK, response.content
+        response = await ac.get("/signin", params={"SAMLRequest": saml_request})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+        assert len(replay_cache) == 0
+    finally:
+        settings.saml_idp_state_backend = ""
+        close_state_backends()
+
+
+async def test_token_sessions(ac: AsyncClient, user: User) -> None:
+    """Token sessions remember the SPs, and only log out their session index."""
+    settings.saml_idp_secret_key = "secret"
+    settings.saml_idp_session_format = "token"
+    settings.saml_idp_logout_url = "https://example.com/logout"
+    ac.cookies = Cookies({"session_id": settings.create_session(user)})
+    response = await ac.get("/signin", params={"SAMLRequest": request()})
+    assert response.status_code == status.HTTP_200_OK, response.content
+    session = settings.get_session(response.cookies["session_id"])
+    assert session is not None
+    assert session.sps == ("http://example.com/myissuer",)
+    xml = _saml_response(response.content)
+    (statement,) = xml.iterfind(".//{*}AuthnStatement")
+    assert statement.get("SessionIndex") == session.session_index
+    ac.cookies = Cookies({"session_id": response.cookies["session_id"]})
+
+    response = await ac.get("/logout", params={"SAMLRequest": logout()})
+    status_code = _saml_response(response.content).find(".//{*}StatusCode")
+    assert status_code is not None
+    assert status_code.get("Value", "").endswith("RequestDenied")
+    assert "session_id" not in response.headers.get("set-cookie", "")
+
+    response = await ac.get(
+        "/logout",
+        params={"SAMLRequest": logout(session_index=session.session_index)},
+    )
+    status_code = _saml_response(response.content).find(".//{*}StatusCode")
+    assert status_code is not None
+    assert status_code.get("Value", "").endswith("Success")
+    assert response.cookies == Cookies([])
+
+
 def logout(
     issue: datetime | None = None,
     not_after: datetime | None = None,
@@ -299,3 +591,147 @@ async def test_logout_post(ac: AsyncClient, user: User) -> None:
     ac.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
     response = await ac.post("/logout-form")
     assert response.status_code == status.HTTP_302_FOUND, response.content
+
+
+async def test_admin_users(ac: AsyncClient) -> None:
+    """Users can be added and deleted through the admin API."""
+    body = b'{"username": "davidbowie", "password": "starman"}\n'
+    response = await ac.post("/admin/users", content=body)
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.content
+
+    settings.saml_idp_admin_token = "xxxx_token_xxxx"
+    try:
+        response = await ac.post("/admin/users", content=body)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED, response.content
+        headers = {"Authorization": "Bearer xxxx_token_xxxx"}
+        response = await ac.post(
+            "/admin/users", content=body + b"not json\n", headers=headers
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST, response.content
+        assert "line 2" in response.json()["detail"]
+
+        response = await ac.post("/admin/users", content=body, headers=headers)
+        assert response.status_code == status.HTTP_200_OK, response.content
+        assert response.json()["upserted"] == 1
+        user, _ = await settings.authenticate_user("davidbowie", "starman")
+        assert user["username"] == "davidbowie"
+        assert settings.search_users("davidbowie", 0, 10) == (1, [user])
+
+        response = await ac.post(
+            "/admin/users",
+            content=b'{"op": "delete", "username": "davidbowie"}',
+            headers=headers,
+        )
+        assert response.json()["deleted"] == 1
+        with pytest.raises(ValueError, match="Invalid username or password"):
+            await settings.authenticate_user("davidbowie", "starman")
+        assert settings.search_users("davidbowie", 0, 10) == (0, [])
+    finally:
+        settings.saml_idp_admin_token = ""
+
+
+async def test_metrics(ac: AsyncClient, user: User) -> None:
+    """The stages of a login are timed, and exposed for Prometheus."""
+    ac.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
+    response = await ac.get("/signin", params={"SAMLRequest": request()})
+    assert response.status_code == status.HTTP_200_OK, response.content
+
+    response = await ac.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK, response.content
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    counts = {
+        line.split('"')[1]: int(line.split()[-1])
+        for line in response.text.splitlines()
+        if line.startswith("saml_idp_stage_seconds_count")
+    }
+    stages = ("decode", "parse", "validate", "lookup", "build", "sign", "encode")
+    for name in (*stages, "respond", "render"):
+        assert counts[name] > 0, name
+    assert "saml_idp_request_cache_misses_total" in response.text
+    assert "saml_idp_admission_rejected_total" in response.text
+
+
+async def test_admin_profile(ac: AsyncClient, user: User) -> None:
+    """The next requests can be profiled, and their profiles downloaded."""
+    settings.saml_idp_admin_token = "xxxx_token_xxxx"
+    headers = {"Authorization": "Bearer xxxx_token_xxxx"}
+    try:
+        response = await ac.post("/admin/profile", json={"requests": 1})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        response = await ac.post(
+            "/admin/profile", json={"requests": 1}, headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK, response.content
+        assert response.json()["active"]
+
+        ac.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
+        response = await ac.get("/signin", params={"SAMLRequest": request()})
+        assert response.status_code == status.HTTP_200_OK, response.content
+
+        response = await ac.get("/admin/profile", headers=headers)
+        assert response.json()["active"] is False
+        assert response.json()["routes"] == {"/signin": 1}
+        response = await ac.get(
+            "/admin/profile/collapsed", params={"route": "/signin"}, headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK, response.content
+        assert "sign" in response.text
+        response = await ac.get("/admin/profile/pstats", headers=headers)
+        assert response.status_code == status.HTTP_200_OK, response.content
+        assert response.headers["content-type"] == "application/octet-stream"
+
+        response = await ac.delete("/admin/profile", headers=headers)
+        assert response.json()["routes"] == {}
+        response = await ac.get("/admin/profile/pstats", headers=headers)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+    finally:
+        settings.saml_idp_admin_token = ""
+
+
+async def test_admin_profile_prefix(user: User) -> None:
+    """Under a router prefix, the profile endpoints still aren't profiled."""
+    app = FastAPI()
+    app.include_router(router, prefix="/idp")
+    settings.saml_idp_admin_token = "xxxx_token_xxxx"
+    headers = {"Authorization": "Bearer xxxx_token_xxxx"}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        try:
+            response = await client.post(
+                "/idp/admin/profile", json={"seconds": 60}, headers=headers
+            )
+            assert response.status_code == status.HTTP_200_OK, response.content
+            response = await client.get("/idp/admin/profile", headers=headers)
+            assert response.json()["routes"] == {}
+
+            client.cookies = Cookies({"session_id": Settings.generate_session_id(user)})
+            response = await client.get(
+                "/idp/signin", params={"SAMLRequest": request()}
+            )
+            assert response.status_code == status.HTTP_200_OK, response.content
+            response = await client.get("/idp/admin/profile", headers=headers)
+            # Older FastAPI versions copy the routes under the prefix, newer
+            # ones include them as they are.
+            routes = response.json()["routes"]
+            assert list(routes.values()) == [1]
+            assert next(iter(routes)).endswith("/signin")
+        finally:
+            await client.delete("/idp/admin/profile", headers=headers)
+            settings.saml_idp_admin_token = ""
+
+
+async def test_admin_stats(ac: AsyncClient) -> None:
+    """The admission and request cache counters can be read through the admin API."""
+    settings.saml_idp_admin_token = "xxxx_token_xxxx"
+    try:
+        response = await ac.get(
+            "/admin/stats", headers={"Authorization": "Bearer xxxx_token_xxxx"}
+        )
+        assert response.status_code == status.HTTP_200_OK, response.content
+        stats = response.json()
+        assert {"active", "waiting", "rejected", "mean_wait"} <= stats[
+            "admission"
+        ].keys()
+        assert "hit_rate" in stats["request_cache"]
+    finally:
+        settings.saml_idp_admin_token = ""
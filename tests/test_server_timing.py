@@ -0,0 +1,78 @@
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient, Cookies, Response
+from starlette import status
+
+from saml_idp import Settings, router
+from saml_idp.config import settings
+from saml_idp.server_timing import ServerTimingMiddleware, format_server_timing
+from saml_idp.utils import deflate_and_encode, saml2_timestamp
+
+USER = {"username": "taylorswift", "password": "all2well"}
+
+
+@pytest_asyncio.fixture
+async def ac() -> AsyncIterator[AsyncClient]:
+    """Provide an AsyncClient for an app with the middleware."""
+    settings.saml_idp_users = [USER]  # pyright: ignore[reportAttributeAccessIssue]
+    settings.saml_idp_secret_key = ""
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware)
+    app.include_router(router)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+
+
+def _timings(response: Response) -> dict[str, float]:
+    entries = response.headers["Server-Timing"].split(", ")
+    return {
+        name: float(duration)
+        for name, duration in (entry.split(";dur=") for entry in entries)
+    }
+
+
+def test_format_server_timing() -> None:
+    """Timings are formatted in milliseconds."""
+    assert format_server_timing({"sign": 0.0015, "total": 0.01}) == (
+        "sign;dur=1.500, total;dur=10.000"
+    )
+
+
+@pytest.mark.asyncio
+async def test_login(ac: AsyncClient) -> None:
+    """Responses have the time spent in each stage of the request."""
+    response = await ac.post("/login", data=USER)
+    assert response.status_code == status.HTTP_302_FOUND, response.content
+    timings = _timings(response)
+    assert timings.keys() == {"lookup", "total"}
+    assert timings["total"] >= timings["lookup"]
+
+
+@pytest.mark.asyncio
+async def test_signin(ac: AsyncClient) -> None:
+    """Signing in has timings for each stage of building the response."""
+    saml_request = deflate_and_encode(f"""
+<saml2p:AuthnRequest
+    xmlns:saml2p="urn:oasis:names:tc:SAML:2.0:protocol"
+    AssertionConsumerServiceURL="https://example.com/saml2/idpresponse"
+    Destination="https://localhost:8000/signin"
+    ID="_server_timing"
+    IssueInstant="{saml2_timestamp(datetime.now(UTC))}"
+    Version="2.0">
+    <saml2:Issuer xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion"
+        >http://example.com/myissuer</saml2:Issuer>
+</saml2p:AuthnRequest>
+""").decode()
+    ac.cookies = Cookies({"session_id": Settings.generate_session_id(USER)})  # pyright: ignore[reportArgumentType]
+    response = await ac.get("/signin", params={"SAMLRequest": saml_request})
+    assert response.status_code == status.HTTP_200_OK, response.content
+    timings = _timings(response)
+    stages = ("decode", "parse", "validate", "lookup", "build", "sign", "encode")
+    for name in (*stages, "render"):
+        assert name in timings
+    assert timings["total"] >= timings["sign"]
@@ -0,0 +1,64 @@
+import time
+from collections.abc import Callable
+
+import pytest
+
+from saml_idp.sessions import MAX_SPS, SessionToken, decode_token, encode_token
+
+SECRET = "xxxx_secret_xxxx"
+
+
+def test_round_trip() -> None:
+    """Tokens can be decoded."""
+    token = SessionToken.new("taylorswift", 60).with_sp("https://sp.example.com")
+    assert decode_token(encode_token(token, SECRET), SECRET) == token
+    assert token.expires_at - token.issued_at == 60  # noqa: PLR2004
+    assert token.session_index.startswith("_")
+
+
+def test_with_sp() -> None:
+    """SPs are only added once, and only the latest are kept."""
+    token = SessionToken.new("taylorswift", 60)
+    assert token.with_sp("a").with_sp("a").sps == ("a",)
+    for i in range(MAX_SPS + 1):
+        token = token.with_sp(str(i))
+    assert len(token.sps) == MAX_SPS
+    assert token.sps[-1] == str(MAX_SPS)
+
+
+def test_expired() -> None:
+    """Expired tokens are rejected."""
+    token = SessionToken.new("taylorswift", 60, now=time.time() - 61)
+    assert decode_token(encode_token(token, SECRET), SECRET) is None
+    value = encode_token(SessionToken.new("taylorswift", 60), SECRET)
+    assert decode_token(value, SECRET, now=time.time() + 61) is None
+
+
+@pytest.mark.parametrize(
+    "tamper",
+    [
+        lambda value: value.replace(".", "x."),
+        lambda value: value[:-2],
+        lambda value: value.split(".")[0],
+        lambda _: "",
+        lambda _: "...",
+        lambda _: "not base64!.not base64!",
+    ],
+)
+def test_tampered(tamper: Callable[[str], str]) -> None:
+    """Tampered or malformed tokens are rejected."""
+    value = encode_token(SessionToken.new("taylorswift", 60), SECRET)
+    assert decode_token(tamper(value), SECRET) is None
+
+
+def test_wrong_secret() -> None:
+    """Tokens signed with another secret are rejected."""
+    value = encode_token(SessionToken.new("taylorswift", 60), SECRET)
+    assert decode_token(value, "other") is None
+    assert decode_token(value, "") is None
+
+
+def test_no_secret() -> None:
+    """Tokens can't be signed without a secret."""
+    with pytest.raises(ValueError, match="secret key"):
+        encode_token(SessionToken.new("taylorswift", 60), "")
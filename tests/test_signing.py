@@ -0,0 +1,179 @@
+import base64
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.asymmetric.types import (
+    CertificateIssuerPrivateKeyTypes,
+)
+from lxml import etree
+from pydantic import HttpUrl
+from signxml import SignatureMethod, XMLVerifier
+
+from saml_idp.config import settings
+from saml_idp.metrics import request_timings, stage
+from saml_idp.models import AuthnResponse
+from saml_idp.signing import SigningEngine, get_signing_context
+from saml_idp.utils import DS, SAML
+from tests.conftest import KeyAndCert
+
+
+def test_signing_context_cached() -> None:
+    """The same key and certificate reuse the same context."""
+    key, cert = settings.saml_idp_metadata_key, settings.saml_idp_metadata_cert
+    context = get_signing_context(key, cert)
+    assert get_signing_context(key, cert) is context
+    assert len(context.certs) == 1
+
+
+@pytest.mark.parametrize(
+    ("key", "method"),
+    [
+        (rsa.generate_private_key(65537, 2048), SignatureMethod.RSA_SHA256),
+        (ec.generate_private_key(ec.SECP256R1()), SignatureMethod.ECDSA_SHA256),
+        (ec.generate_private_key(ec.SECP384R1()), SignatureMethod.ECDSA_SHA384),
+        (ec.generate_private_key(ec.SECP521R1()), SignatureMethod.ECDSA_SHA512),
+    ],
+)
+def test_sign_key_types(
+    key: CertificateIssuerPrivateKeyTypes,
+    method: SignatureMethod,
+    key_and_cert: KeyAndCert,
+) -> None:
+    """The signature algorithm is chosen to match the key."""
+    key_pem, cert_pem = key_and_cert(key)
+    context = get_signing_context(key_pem, cert_pem)
+    assert context.signature_method == method
+    element = SAML.Assertion(DS.Signature(Id="placeholder"), ID="_xxxx")
+    signed = etree.fromstring(etree.tostring(context.sign(element)))
+    result = XMLVerifier().verify(signed, x509_cert=cert_pem)
+    assert not isinstance(result, list)
+    assert result.signature_xml is not None
+    signature_method = result.signature_xml.find(".//{*}SignatureMethod")
+    assert signature_method is not None
+    assert signature_method.get("Algorithm") == method.value
+
+
+@pytest.mark.parametrize(
+    "key",
+    [ed25519.Ed25519PrivateKey.generate(), ec.generate_private_key(ec.SECP256K1())],
+)
+def test_sign_unsupported_key(
+    key: CertificateIssuerPrivateKeyTypes, key_and_cert: KeyAndCert
+) -> None:
+    """Keys that signxml can't sign with are rejected."""
+    key_pem, cert_pem = key_and_cert(key)
+    with pytest.raises(ValueError, match="Unsupported"):
+        get_signing_context(key_pem, cert_pem)
+
+
+def test_sign() -> None:
+    """A signing context produces verifiable signatures."""
+    context = get_signing_context(
+        settings.saml_idp_metadata_key, settings.saml_idp_metadata_cert
+    )
+    for _ in range(2):
+        element = SAML.Assertion(DS.Signature(Id="placeholder"), ID="_xxxx")
+        signed = context.sign(element)
+        signed = etree.fromstring(etree.tostring(signed))
+        XMLVerifier().verify(signed, x509_cert=settings.saml_idp_metadata_cert)
+
+
+def _response() -> AuthnResponse:
+    now = datetime.now(UTC)
+    return AuthnResponse(
+        issue_instant=now,
+        issuer=HttpUrl("https://example.com/issuer"),
+        destination=HttpUrl("https://example.com/destination"),
+        in_response_to="_yyyy",
+        status_code="urn:oasis:names:tc:SAML:2.0:status:Success",
+        subject_name_id_format="urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified",
+        subject_name_id="foo@example.com",
+        subject_not_on_or_after=now,
+        conditions_not_before=now,
+        conditions_not_on_or_after=now,
+        attributes={"foo": "bar"},
+        audience_restriction="https://example.com/samlauth/",
+        authn_instant=now,
+        authn_context_class_ref="urn:oasis:names:tc:SAML:2.0:ac:classes:Password",
+        session_index="session_index",
+    )
+
+
+def _verify(encoded: str) -> None:
+    xml = etree.fromstring(base64.b64decode(encoded))
+    assertion = xml.find("{urn:oasis:names:tc:SAML:2.0:assertion}Assertion")
+    XMLVerifier().verify(assertion, x509_cert=settings.saml_idp_metadata_cert)
+
+
+@pytest.mark.asyncio
+async def test_engine_in_process() -> None:
+    """Without workers, the engine signs in-process."""
+    settings.saml_idp_signing_workers = 0
+    engine = SigningEngine()
+    _verify(await engine.to_response(_response(), settings))
+
+
+@pytest.mark.asyncio
+async def test_engine_pool() -> None:
+    """With workers, the engine signs in a worker process."""
+    settings.saml_idp_signing_workers = 1
+    engine = SigningEngine()
+    signed = stage("sign").count
+    timings: dict[str, float] = {}
+    token = request_timings.set(timings)
+    try:
+        _verify(await engine.to_response(_response(), settings))
+        assert engine._pool is not None  # noqa: SLF001
+        # The stages timed in the worker are recorded in the server.
+        assert stage("sign").count == signed + 1
+        assert {"build", "sign", "encode", "respond"} <= timings.keys()
+    finally:
+        request_timings.reset(token)
+        settings.saml_idp_signing_workers = 0
+        engine.shutdown()
+
+
+def _worker_users() -> tuple[str, bool]:
+    """Return the users file a worker process was set up with, and if it's loaded."""
+    return settings.saml_idp_users_file, settings._users_loaded  # noqa: SLF001
+
+
+@pytest.mark.asyncio
+async def test_engine_pool_users(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Workers don't load the users, even though they import the settings."""
+    users_path = tmp_path / "users.csv"
+    users_path.write_text("username,password\ndavidbowie,starman\n")
+    monkeypatch.setenv("SAML_IDP_USERS_FILE", str(users_path))
+    settings.saml_idp_signing_workers = 1
+    engine = SigningEngine()
+    try:
+        await engine.to_response(_response(), settings)
+        pool = engine._pool  # noqa: SLF001
+        assert pool is not None
+        assert pool.submit(_worker_users).result() == (str(users_path), False)
+    finally:
+        settings.saml_idp_signing_workers = 0
+        engine.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_engine_broken_pool() -> None:
+    """If the pool breaks, the engine falls back to signing in-process."""
+    settings.saml_idp_signing_workers = 1
+    engine = SigningEngine()
+    try:
+        await engine.to_response(_response(), settings)
+        pool = engine._pool  # noqa: SLF001
+        assert pool is not None
+        for process in pool._processes.values():  # noqa: SLF001
+            process.kill()
+            process.join()
+        _verify(await engine.to_response(_response(), settings))
+        assert engine._pool is None  # noqa: SLF001
+    finally:
+        settings.saml_idp_signing_workers = 0
+        engine.shutdown()
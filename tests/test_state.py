@@ -0,0 +1,126 @@
+import contextlib
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from saml_idp.state import (
+    MemoryBackend,
+    SqliteBackend,
+    StateBackend,
+    close_state_backends,
+    get_state_backend,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request: pytest.FixtureRequest, tmp_path: Path) -> Iterator[StateBackend]:
+    """Return each kind of backend."""
+    if request.param == "memory":
+        backend: StateBackend = MemoryBackend()
+    else:
+        backend = SqliteBackend(str(tmp_path / "state.db"))
+    yield backend
+    backend.close()
+
+
+def test_get_set(backend: StateBackend) -> None:
+    """Values can be set, read and deleted."""
+    assert backend.get("a") is None
+    backend.set("a", b"1", 60)
+    assert backend.get("a") == b"1"
+    backend.set_many([("a", b"2"), ("b", b"3")], 60)
+    assert backend.get("a") == b"2"
+    assert backend.get("b") == b"3"
+    backend.delete("a")
+    assert backend.get("a") is None
+
+
+def test_expiry(backend: StateBackend) -> None:
+    """Values expire."""
+    backend.set("a", b"1", 0.01)
+    time.sleep(0.02)
+    assert backend.get("a") is None
+
+
+def test_compare_and_set(backend: StateBackend) -> None:
+    """Values are only set if they have the expected value."""
+    assert backend.compare_and_set("a", None, b"1", 60)
+    assert not backend.compare_and_set("a", None, b"2", 60)
+    assert not backend.compare_and_set("a", b"2", b"3", 60)
+    assert backend.compare_and_set("a", b"1", b"3", 60)
+    assert backend.get("a") == b"3"
+
+
+def test_compare_and_set_expired(backend: StateBackend) -> None:
+    """Expired values count as missing."""
+    backend.set("a", b"1", 0.01)
+    time.sleep(0.02)
+    assert not backend.compare_and_set("a", b"1", b"2", 60)
+    assert backend.compare_and_set("a", None, b"2", 60)
+
+
+def test_compare_and_set_concurrent(backend: StateBackend) -> None:
+    """Only one of several concurrent writers wins."""
+    results: list[bool] = []
+
+    def claim() -> None:
+        results.append(backend.compare_and_set("a", None, b"1", 60))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+
+
+def test_memory_purge() -> None:
+    """Expired entries are dropped by later writes, without a full scan."""
+    backend = MemoryBackend()
+    backend.set_many([("a", b"1"), ("b", b"2")], 0.01)
+    backend.set("b", b"3", 60)
+    time.sleep(0.02)
+    backend.set("c", b"4", 60)
+    assert backend._entries.keys() == {"b", "c"}  # noqa: SLF001
+    assert len(backend._expiries) == 2  # noqa: PLR2004, SLF001
+
+
+def test_sqlite_index(tmp_path: Path) -> None:
+    """Purging expired rows uses an index."""
+    path = tmp_path / "state.db"
+    SqliteBackend(str(path)).close()
+    with contextlib.closing(sqlite3.connect(path)) as connection:
+        plan = connection.execute(
+            "EXPLAIN QUERY PLAN DELETE FROM state WHERE expires <= ?", (0,)
+        ).fetchall()
+    assert "state_expires" in str(plan)
+
+
+def test_sqlite_shared(tmp_path: Path) -> None:
+    """SQLite backends on the same file share their state."""
+    path = str(tmp_path / "state.db")
+    first, second = SqliteBackend(path), SqliteBackend(path)
+    try:
+        assert first.compare_and_set("a", None, b"1", 60)
+        assert not second.compare_and_set("a", None, b"1", 60)
+        assert second.get("a") == b"1"
+    finally:
+        first.close()
+        second.close()
+
+
+def test_get_state_backend(tmp_path: Path) -> None:
+    """Backends are opened once per URL."""
+    try:
+        assert isinstance(get_state_backend("memory"), MemoryBackend)
+        assert get_state_backend("memory") is get_state_backend("memory")
+        url = f"sqlite:///{tmp_path / 'state.db'}"
+        assert isinstance(get_state_backend(url), SqliteBackend)
+        with pytest.raises(ValueError, match="Unsupported"):
+            get_state_backend("redis://localhost")
+    finally:
+        close_state_backends()
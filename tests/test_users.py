@@ -0,0 +1,259 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+from saml_idp.users import (
+    SyntheticUsers,
+    User,
+    UserIndex,
+    UsernameIndex,
+    UserRecord,
+    UserStore,
+    generate_session_id,
+    read_users_file,
+)
+
+USERS: list[User] = [
+    {"username": "taylorswift", "password": "all2well"},
+    {"username": "davidbowie", "password": "starman"},
+]
+
+
+def test_get_by_session() -> None:
+    """Users can be found by their session ID."""
+    index = UserIndex(USERS)
+    assert len(index) == len(USERS)
+    for user in USERS:
+        assert index.get_by_session(generate_session_id(user)) is user
+
+
+def test_get_by_session_missing() -> None:
+    """An unknown session returns None."""
+    index = UserIndex(USERS)
+    assert index.get_by_session("nope") is None
+    assert UserIndex().get_by_session("nope") is None
+
+
+def test_duplicate_users() -> None:
+    """The first of two identical users wins."""
+    first: User = {"username": "a", "password": "b", "attributes": {"n": "1"}}
+    second: User = {"username": "a", "password": "b", "attributes": {"n": "2"}}
+    index = UserIndex([first, second])
+    assert index.get_by_session(generate_session_id(first)) is first
+
+
+def test_authenticate() -> None:
+    """Users can be authenticated by username and password."""
+    index = UserIndex(USERS)
+    result = index.authenticate("davidbowie", "starman")
+    assert result is not None
+    user, session_id = result
+    assert user is USERS[1]
+    assert session_id == generate_session_id(USERS[1])
+
+
+def test_authenticate_fail() -> None:
+    """Wrong passwords and unknown users fail."""
+    index = UserIndex(USERS)
+    assert index.authenticate("davidbowie", "all2well") is None
+    assert index.authenticate("davidbowie", "") is None
+    assert index.authenticate("nobody", "starman") is None
+    assert UserIndex().authenticate("nobody", "") is None
+
+
+def _records() -> list[UserRecord]:
+    return [
+        UserRecord("taylorswift", "all2well", ("email",), ("taylor@example.com",)),
+        UserRecord("davidbowie", "starman"),
+        UserRecord("davidbowie", "changes"),
+    ]
+
+
+def test_store() -> None:
+    """Users in a store can be found by session and username."""
+    store = UserStore(_records())
+    assert len(store) == 2  # noqa: PLR2004
+    taylor: User = {
+        "username": "taylorswift",
+        "password": "all2well",
+        "attributes": {"email": "taylor@example.com"},
+    }
+    david: User = {"username": "davidbowie", "password": "starman"}
+    assert store.get_by_session(generate_session_id(taylor)) == taylor
+    assert store.get_by_session(generate_session_id(david)) == david
+    assert store.get_by_username("davidbowie") == david
+    assert store.get_by_username("nobody") is None
+
+
+@pytest.mark.parametrize(
+    "session_id",
+    [
+        "nope",
+        "",
+        generate_session_id({"username": "davidbowie", "password": "changes"}),
+        generate_session_id({"username": "davidbowie", "password": "starman"})[:16],
+    ],
+)
+def test_store_bad_session(session_id: str) -> None:
+    """Unknown and partial sessions return None."""
+    assert UserStore(_records()).get_by_session(session_id) is None
+
+
+def test_store_authenticate() -> None:
+    """Users in a store can log in."""
+    store = UserStore(_records())
+    result = store.authenticate("davidbowie", "starman")
+    assert result is not None
+    user, session_id = result
+    assert user == {"username": "davidbowie", "password": "starman"}
+    assert session_id == generate_session_id(user)
+    assert store.authenticate("davidbowie", "changes") is None
+    assert store.authenticate("nobody", "starman") is None
+
+
+def test_read_jsonl(tmp_path: Path) -> None:
+    """Users can be read from JSON Lines."""
+    path = tmp_path / "users.jsonl"
+    path.write_text(
+        json.dumps({"username": "a", "password": "b", "attributes": {"x": "y"}})
+        + "\n\n"
+        + json.dumps({"username": "c", "password": "d"})
+        + "\n"
+        + json.dumps({"username": "e", "password": "f", "attributes": {"x": ""}})
+        + "\n"
+    )
+    records = list(read_users_file(path))
+    assert [r.to_user() for r in records] == [
+        {"username": "a", "password": "b", "attributes": {"x": "y"}},
+        {"username": "c", "password": "d"},
+        {"username": "e", "password": "f", "attributes": {"x": ""}},
+    ]
+
+
+def test_read_csv(tmp_path: Path) -> None:
+    """Users can be read from CSV, with a column per attribute."""
+    path = tmp_path / "users.csv"
+    path.write_text(
+        "username,password,email\na,b,a@example.com\nc,d,\ne,f,e@example.com\n"
+    )
+    records = list(read_users_file(path))
+    assert [r.to_user() for r in records] == [
+        {"username": "a", "password": "b", "attributes": {"email": "a@example.com"}},
+        {"username": "c", "password": "d"},
+        {"username": "e", "password": "f", "attributes": {"email": "e@example.com"}},
+    ]
+    # Attribute names are shared between records
+    assert records[0].attribute_names is records[2].attribute_names
+    assert records[0].attribute_names[0] is sys.intern("email")
+
+
+@pytest.mark.parametrize(
+    ("name", "content"),
+    [
+        ("users.jsonl", '{"username": "a", "password": "b"}\nnot json\n'),
+        ("users.jsonl", '{"username": "a"}\n'),
+        ("users.jsonl", "[]\n"),
+        ("users.jsonl", '{"username": "a", "password": "b", "attributes": []}\n'),
+        (
+            "users.jsonl",
+            '{"username": "a", "password": "b", "attributes": {"age": 30}}\n',
+        ),
+        ("users.csv", "username,email\na,a@example.com\n"),
+        ("users.csv", "username,password\na,b,extra\n"),
+    ],
+)
+def test_read_invalid(tmp_path: Path, name: str, content: str) -> None:
+    """Invalid users are reported with their line number."""
+    path = tmp_path / name
+    path.write_text(content)
+    with pytest.raises(ValueError, match="Invalid user on line"):
+        list(read_users_file(path))
+
+
+SYNTHETIC = SyntheticUsers(
+    {
+        "username": "user{n}@example.com",
+        "password": "pass{n}",
+        "start": 1,
+        "count": 1_000_000,
+        "attributes": {"uid": "{n}", "group": "load"},
+    }
+)
+
+
+def test_synthetic() -> None:
+    """Synthetic users are generated from their username."""
+    assert len(SYNTHETIC) == 1_000_000  # noqa: PLR2004
+    assert SYNTHETIC.get_by_username("user42@example.com") == {
+        "username": "user42@example.com",
+        "password": "pass42",
+        "attributes": {"uid": "42", "group": "load"},
+    }
+
+
+@pytest.mark.parametrize(
+    "username",
+    [
+        "user0@example.com",
+        "user1000001@example.com",
+        "user042@example.com",
+        "user",
+        "user²@example.com",
+        "user" + "1" * 5000 + "@example.com",
+    ],
+)
+def test_synthetic_missing(username: str) -> None:
+    """Usernames that don't match the pattern, or are out of range, are unknown."""
+    assert SYNTHETIC.get_by_username(username) is None
+    assert SYNTHETIC.authenticate(username, "pass0") is None
+
+
+def test_synthetic_sessions() -> None:
+    """Synthetic users log in, and are found by their session ID."""
+    result = SYNTHETIC.authenticate("user1000000@example.com", "pass1000000")
+    assert result is not None
+    user, session_id = result
+    assert session_id.startswith("synthetic-1000000-")
+    assert SYNTHETIC.session_id(user) == session_id
+    assert SYNTHETIC.get_by_session(session_id) == user
+    assert SYNTHETIC.authenticate("user1000000@example.com", "pass1") is None
+    assert SYNTHETIC.session_id({"username": "other", "password": "x"}) is None
+
+
+@pytest.mark.parametrize(
+    "session_id",
+    [
+        generate_session_id({"username": "user1@example.com", "password": "pass1"}),
+        "synthetic-1-" + "0" * 64,
+        "synthetic-01-"
+        + generate_session_id({"username": "user1@example.com", "password": "pass1"}),
+        "synthetic-x-",
+        "synthetic-0-",
+        "synthetic-²-",
+        "synthetic-10000000-",
+        "synthetic-" + "1" * 5000 + "-x",
+    ],
+)
+def test_synthetic_bad_session(session_id: str) -> None:
+    """Forged and malformed session IDs are rejected."""
+    assert SYNTHETIC.get_by_session(session_id) is None
+
+
+@pytest.mark.parametrize("username", ["user", "user{n}{n}"])
+def test_synthetic_invalid(username: str) -> None:
+    """The username template must contain {n} exactly once."""
+    with pytest.raises(ValueError, match="exactly once"):
+        SyntheticUsers({"username": username, "password": "x", "count": 1})
+
+
+def test_username_index_search() -> None:
+    """Usernames can be searched by prefix, a page at a time."""
+    index = UsernameIndex(["bob", "alice", "bobby", "bo", "carol", "bob"])
+    assert len(index) == 5  # noqa: PLR2004
+    assert index.search("", 0, 2) == (5, ["alice", "bo"])
+    assert index.search("bo", 0, 10) == (3, ["bo", "bob", "bobby"])
+    assert index.search("bob", 1, 10) == (2, ["bobby"])
+    assert index.search("bo", 5, 10) == (3, [])
+    assert index.search("z", 0, 10) == (0, [])
@@ -1,4 +1,14 @@
-from saml_idp.utils import inflate_and_decode
+import base64
+
+import pytest
+from lxml import etree
+
+from saml_idp.utils import (
+    InvalidSamlRequestError,
+    SamlRequestTooLargeError,
+    deflate_and_encode,
+    inflate_and_decode,
+)
 
 REQUEST = (
     "fZHLbttADEX3/Qph9qNXZckmLAVG0wAp0k0eXXQTMBITDyxx1CHlPr6+slIDzSbLGdx7SBx"
@@ -17,3 +27,42 @@ def test_invalid_and_decode() -> None:
     assert result.tag == "{urn:oasis:names:tc:SAML:2.0:protocol}AuthnRequest"
     result = inflate_and_decode(REQUEST.encode())
     assert result.tag == "{urn:oasis:names:tc:SAML:2.0:protocol}AuthnRequest"
+
+
+def test_inflate_too_large() -> None:
+    """Requests that inflate past the maximum size are rejected."""
+    bomb = deflate_and_encode("<a>" + " " * 1_000_000 + "</a>")
+    assert len(bomb) < 10_000  # noqa: PLR2004
+    with pytest.raises(SamlRequestTooLargeError):
+        inflate_and_decode(bomb)
+    with pytest.raises(SamlRequestTooLargeError):
+        inflate_and_decode(REQUEST, max_size=100)
+
+
+def test_inflate_truncated() -> None:
+    """Truncated requests are rejected."""
+    data = base64.b64encode(base64.b64decode(REQUEST)[:-10])
+    with pytest.raises(InvalidSamlRequestError, match="truncated"):
+        inflate_and_decode(data)
+
+
+@pytest.mark.parametrize(
+    ("data", "match"),
+    [
+        (base64.b64encode(b"not deflated"), "not deflated"),
+        ("a", "not deflated"),
+        (deflate_and_encode("<a><b></a>"), "not well-formed"),
+        (deflate_and_encode(""), "not well-formed"),
+    ],
+)
+def test_inflate_invalid(data: str | bytes, match: str) -> None:
+    """Requests that aren't deflated XML are rejected."""
+    with pytest.raises(InvalidSamlRequestError, match=match):
+        inflate_and_decode(data)
+
+
+def test_no_entities() -> None:
+    """External entities are never resolved."""
+    req = """<!DOCTYPE a [<!ENTITY e SYSTEM "file:///etc/passwd">]><a>&e;</a>"""
+    result = inflate_and_decode(deflate_and_encode(req))
+    assert "root" not in etree.tostring(result).decode()